@@ -120,7 +120,7 @@ if __name__ == '__main__':
     except IndexError:
         N = 10
     try:
-        mu = sys.argv[2]
+        mu = float(sys.argv[2])
     except IndexError:
         mu = 1./N
 
@@ -134,7 +134,7 @@ if __name__ == '__main__':
     graph = cycle(N)
     fitness_landscape = linear_fitness_landscape(m)
     incentive = replicator(fitness_landscape)
-    edge_dict = multivariate_graph_transitions(N, graph, incentive, num_types=2, mu=mu)
+    edge_dict = multivariate_graph_transitions(N, graph, incentive, mu=mu)
     edges = [(v1, v2, t) for ((v1, v2), t) in edge_dict.items()]
     g = Graph(edges)
 
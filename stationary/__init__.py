@@ -8,3 +8,4 @@ from .stationary_ import (
 from .entropy_rate_ import entropy_rate
 
 from . import convenience
+from . import simulation
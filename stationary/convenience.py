@@ -4,6 +4,7 @@ Convenience functions for common situations.
 
 from stationary import stationary_distribution
 from stationary.processes import incentive_process
+from stationary.processes import wright_fisher as wright_fisher_process
 from stationary.processes.incentives import replicator, linear_fitness_landscape
 from stationary.utils.math_helpers import simplex_generator
 
@@ -93,10 +94,10 @@ def wright_fisher(N, game_matrix=None, mu=None, incentive_func=replicator,
 
     fitness_landscape = linear_fitness_landscape(game_matrix)
     incentive = incentive_func(fitness_landscape)
-    edge_func = wright_fisher.multivariate_transitions(N, incentive, mu=mu,
-                                                       num_types=num_types)
+    edge_func = wright_fisher_process.multivariate_transitions(
+        N, incentive, mu=mu, num_types=num_types)
     states = list(simplex_generator(N, d=num_types-1))
     s = stationary_distribution(edge_func, states=states, iterations=4*N,
                                 logspace=logspace)
-    er = entropy_rate(edge_func, s)
+    er = entropy_rate(edge_func, s, states=states)
     return edge_func, s, er
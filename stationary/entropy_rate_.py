@@ -1,41 +1,117 @@
 """Entropy rate computation."""
 
-from collections import defaultdict, Callable
-from numpy import log
+from collections import Callable
 
+import numpy
+from scipy.sparse import issparse
+from scipy.special import xlogy
 
-def entropy_rate(edges, stationary, states=None):
+from stationary.utils.math_helpers import simplex_ranks
+
+
+def _stationary_array(stationary, states):
+    """The stationary distribution as an array in the order of states."""
+
+    if isinstance(stationary, dict):
+        if states is None:
+            raise ValueError(
+                "Keyword argument `states` required with a dictionary "
+                "stationary distribution")
+        return numpy.array([stationary[state] for state in states])
+    return numpy.asarray(stationary, dtype=float)
+
+
+def sparse_entropy_rate(matrix, stationary):
+    """
+    Computes the entropy rate of a process given as a sparse transition
+    matrix as a single weighted reduction of -P log P over its nonzero
+    entries, with 0 log 0 = 0.
+
+    Parameters
+    ----------
+    matrix: scipy.sparse matrix
+        The transition matrix, matrix[i, j] the transition probability from
+        state i to state j
+    stationary: numpy array
+        The stationary distribution indexed as the matrix
+
+    Returns
+    -------
+    float, entropy rate of the process
+    """
+
+    matrix = matrix.tocsr()
+    sources = numpy.repeat(numpy.arange(matrix.shape[0]),
+                           numpy.diff(matrix.indptr))
+    return float(-numpy.sum(stationary[sources] *
+                            xlogy(matrix.data, matrix.data)))
+
+
+def _block_entropy_rate(blocks, stationary):
+    """
+    The entropy rate from a transition matrix stored as consecutive row
+    blocks (see wright_fisher.multivariate_transitions).
+    """
+
+    e = 0.
+    start = 0
+    for block in blocks:
+        stop = start + len(block)
+        block = numpy.asarray(block, dtype=float)
+        e -= stationary[start:stop].dot(xlogy(block, block).sum(axis=1))
+        start = stop
+    return float(e)
+
+
+def entropy_rate(edges, stationary, states=None, block_size=256):
     """
     Computes the entropy rate given the edges of the process and the stationary distribution.
 
     Parameters
     ----------
-    edges: list of tuples or function
+    edges: list of tuples, function, or sparse matrix
         The transitions of the process, either a list of (source, target,
         transition_probability), or an edge_function that takes two parameters,
         the source and target states, to the transition transition probability.
         If using an edge_function you must supply the states of the process.
+        A sparse transition matrix is indexed as the states (if given) or as
+        the stationary array.
     states: list, None
-        States for use with the edge_func
-    stationary: dictionary
-        Precomputed stationary distribution
+        States for use with the edge_func or sparse matrix
+    stationary: dictionary or numpy array
+        Precomputed stationary distribution, an array in the order of the
+        states or the sparse matrix if not a dictionary
+    block_size: int, 256
+        The number of source states whose transitions are evaluated at once
+        with an edge_func
 
     Returns
     -------
     float, entropy rate of the process
     """
 
-    e = defaultdict(float)
     if isinstance(edges, list):
-        for a, b, v in edges:
-            e[a] -= stationary[a] * v * log(v)
-        return sum(e.values())
+        sources = [a for a, _, _ in edges]
+        v = numpy.array([v for _, _, v in edges], dtype=float)
+        s = numpy.array([stationary[a] for a in sources])
+        return float(-numpy.sum(s * xlogy(v, v)))
+    elif issparse(edges):
+        return sparse_entropy_rate(edges, _stationary_array(stationary, states))
     elif isinstance(edges, Callable):
         if not states:
             raise ValueError(
                 "Keyword argument `states` required with edge_func")
-        for a in states:
-            for b in states:
-                v = edges(a, b)
-                e[a] -= stationary[a] * v * log(v)
-        return sum(e.values())
+        s = _stationary_array(stationary, states)
+        if getattr(edges, "blocks", None):
+            # Cached transitions indexed by simplex rank
+            ranked = numpy.zeros(sum(len(block) for block in edges.blocks))
+            ranked[simplex_ranks(states)] = s
+            return _block_entropy_rate(edges.blocks, ranked)
+        e = 0.
+        for start in range(0, len(states), block_size):
+            sources = states[start: start + block_size]
+            block = numpy.array([[edges(a, b) for b in states]
+                                 for a in sources], dtype=float)
+            e -= s[start: start + len(sources)].dot(
+                xlogy(block, block).sum(axis=1))
+        return float(e)
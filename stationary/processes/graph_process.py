@@ -1,75 +1,378 @@
 from collections import defaultdict
-from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import numpy
 
 from ..utils.graph import Graph
 
 
-## Don't put N > 20 into this unless you have a lot of RAM and time
-def multivariate_graph_transitions(N, graph, incentive, mu=0.001):
+def encode_configuration(config):
     """
-    Computes transition probabilities of the incentive process on a graph.
-    Warning: this uses a LOT of RAM (exponential in N typically), keep N small.
+    The integer code of a binary configuration, with the first position as
+    the most significant bit, so that codes follow the order of
+    product([0, 1], repeat=N).
+    """
+
+    code = 0
+    for c in config:
+        code = (code << 1) | int(c)
+    return code
+
+
+def decode_configurations(codes, N):
+    """
+    The binary configurations of an array of integer codes, as an array of
+    shape (len(codes), N).
+    """
+
+    codes = numpy.asarray(codes)
+    shifts = numpy.arange(N - 1, -1, -1)
+    return ((codes[:, numpy.newaxis] >> shifts) & 1).astype(numpy.int8)
+
+
+def graph_transitions_arrays(N, graph, incentive, mu=0.001, processes=None,
+                             chunk_size=None):
+    """
+    Computes transition probabilities of the incentive process on a graph as
+    the arrays of a sparse matrix. Configurations are represented by their
+    integer codes (see encode_configuration) and a replacement is a bit flip,
+    so every transition costs 16 bytes (a source, a target and a
+    probability) rather than a pair of tuples in a dictionary. The transitions
+    for each edge of the graph are computed for all configurations at once.
+
+    Transitions between the same configurations are not merged, so convert
+    with e.g. scipy.sparse.csr_matrix((values, (rows, cols))), which sums
+    them.
 
     Parameters
     ----------
     N: int
-        Population size / simplex divisor
+        Population size, the number of vertices of the graph
     graph: Graph
         The graph that the population occuupies
     incentive: function
         An incentive function from incentives.py
     mu: float, 0.001
         The mutation rate of the process
+    processes: int, None
+        If greater than one, the configurations are split into ranges of
+        codes that are built in parallel by a pool of this many processes
+    chunk_size: int, None
+        The number of configurations per range, by default enough for four
+        ranges per process
+
+    Returns
+    -------
+    rows, cols, values: numpy arrays
+        The source codes, target codes and transition probabilities
     """
 
-    def population_state(N, config):
-        """Calculates the population state from a graph configuration, i.e.
-        if the population were well-mixed on a complete graph."""
-        s = sum(config)
-        population_state_ = (N-s, s)
-        return numpy.array(population_state_)
+    index_dtype = numpy.int32 if N < 31 else numpy.int64
+    codes = numpy.arange(1 << N, dtype=index_dtype)
+    return _graph_transitions(N, graph, incentive, mu, codes,
+                              processes=processes, chunk_size=chunk_size)
 
-    edges = defaultdict(float)
 
-    # Enumerate the graph vertices
-    enum = dict(enumerate(graph.vertices()))
-    inv_enum = dict([(y, x) for (x, y) in enumerate(graph.vertices())])
+def reproduction_rates(N, incentive):
+    """
+    The probability that a given individual of each type is picked to
+    reproduce, by the number of individuals of type 1.
+
+    Parameters
+    ----------
+    N: int
+        The number of vertices (population size)
+    incentive: function
+        An incentive function from incentives.py
+
+    Returns
+    -------
+    numpy array of shape (N + 1, 2)
+    """
 
-    # Generate all binary strings (configurations)
-    for source_config in product([0, 1], repeat=N):
-        edges[(source_config, source_config)] = 1.
-        # For each position in the configuration, mutate it and replace one of
-        # its neighbors, as dictated by the graph.
-        s = sum(source_config)
+    rates = numpy.zeros((N + 1, 2))
+    for s in range(N + 1):
         population_state = (N - s, s)
         inc = incentive(population_state)
         denom = float(sum(inc))
-        for source_position, source_type in enumerate(source_config):
-            # Probability that this one was picked to reproduce is
-            r = 1. / population_state[source_type] * float(inc[source_type]) / denom
-            # Replace out neighbors
-            source_vertex = inv_enum[source_position]
-            out_vertices = graph.out_vertices(source_vertex)
-            total_out_vertices = float(len(out_vertices))
-            for target_vertex in graph.out_vertices(source_vertex):
-                target_position = enum[target_vertex]
-                # Replace without mutation
-                target_config = list(source_config)
-                target_config[target_position] = source_type
-                target_config = tuple(target_config)
-                if source_config != target_config:
-                    t = r * (1. - mu) / total_out_vertices
-                    edges[(source_config, target_config)] += t
-                    edges[(source_config, source_config)] -= t
-                # Replace with mutation
-                target_config = list(source_config)
-                target_config[target_position] = 1 - source_type
-                target_config = tuple(target_config)
-                if source_config != target_config:
-                    t = r * mu / total_out_vertices
-                    edges[(source_config, target_config)] += t
-                    edges[(source_config, source_config)] -= t
-    return edges
+        for t in range(2):
+            if population_state[t]:
+                rates[s, t] = 1. / population_state[t] * float(inc[t]) / denom
+    return rates
+
+
+def edge_positions(graph):
+    """
+    The edges of the graph as (source position, target position, out-degree
+    of the source), with vertices in the order of graph.vertices().
+
+    Parameters
+    ----------
+    graph: Graph
+        The population structure
+
+    Returns
+    -------
+    list of tuples
+    """
+
+    vertices = list(graph.vertices())
+    position = dict((vertex, i) for (i, vertex) in enumerate(vertices))
+    directed_edges = []
+    for source_vertex in vertices:
+        out_vertices = list(graph.out_vertices(source_vertex))
+        for target_vertex in out_vertices:
+            directed_edges.append((position[source_vertex],
+                                   position[target_vertex],
+                                   float(len(out_vertices))))
+    return directed_edges
+
+
+def _transitions_block(N, rates, directed_edges, mu, codes):
+    """
+    The transitions out of the configurations with the given codes, from the
+    precomputed reproduction rates and directed edges. Only depends on
+    arrays and tuples, so it can run in a worker process.
+    """
+
+    num_configs = len(codes)
+    bits = []
+    counts = numpy.zeros(num_configs, dtype=numpy.int16)
+    for i in range(N):
+        bits.append(((codes >> (N - 1 - i)) & 1).astype(numpy.int8))
+        counts += bits[-1]
+
+    # Each edge of the graph changes every configuration in exactly one way:
+    # by replacement without mutation if the two vertices differ and by
+    # replacement with mutation otherwise. The last block is the diagonal.
+    size = (len(directed_edges) + 1) * num_configs
+    rows = numpy.empty(size, dtype=codes.dtype)
+    cols = numpy.empty(size, dtype=codes.dtype)
+    values = numpy.empty(size)
+    total = numpy.zeros(num_configs)
+    for k, (source_position, target_position, total_out_vertices) in \
+            enumerate(directed_edges):
+        block = slice(k * num_configs, (k + 1) * num_configs)
+        source_type = bits[source_position]
+        r = rates[counts, source_type]
+        rows[block] = codes
+        cols[block] = codes ^ (1 << (N - 1 - target_position))
+        values[block] = numpy.where(
+            source_type != bits[target_position],
+            r * (1. - mu) / total_out_vertices,
+            r * mu / total_out_vertices)
+        total += values[block]
+    block = slice(len(directed_edges) * num_configs, size)
+    rows[block] = codes
+    cols[block] = codes
+    values[block] = 1. - total
+    return rows, cols, values
+
+
+def _graph_transitions(N, graph, incentive, mu, codes, processes=None,
+                       chunk_size=None):
+    """
+    The transitions of graph_transitions_arrays out of the configurations
+    with the given codes only, possibly split into chunks built by a process
+    pool and concatenated.
+    """
+
+    rates = reproduction_rates(N, incentive)
+    directed_edges = edge_positions(graph)
+    if not processes or processes < 2:
+        return _transitions_block(N, rates, directed_edges, mu, codes)
+
+    if not chunk_size:
+        chunk_size = max(1, -(-len(codes) // (4 * processes)))
+    chunks = [codes[start: start + chunk_size]
+              for start in range(0, len(codes), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        blocks = list(executor.map(
+            _transitions_block, repeat(N), repeat(rates),
+            repeat(directed_edges), repeat(mu), chunks))
+    return tuple(numpy.concatenate([block[i] for block in blocks])
+                 for i in range(3))
+
+
+## Graph symmetries
+
+def cycle_automorphisms(N, reflections=True):
+    """
+    Generators of the symmetry group of the cycle on the vertices 0, ...,
+    N - 1: the rotation by one vertex and, if reflections is True, a
+    reflection.
+    """
+
+    generators = [[(i + 1) % N for i in range(N)]]
+    if reflections:
+        generators.append([(-i) % N for i in range(N)])
+    return generators
 
+
+def _position_permutations(graph, automorphisms):
+    """
+    Converts automorphisms, mappings from each vertex to its image (e.g.
+    lists when the vertices are 0, ..., N - 1), to permutations of the
+    vertex positions, and checks that they are automorphisms of the graph.
+    """
+
+    vertices = list(graph.vertices())
+    position = dict((vertex, i) for (i, vertex) in enumerate(vertices))
+    edges = set((u, v) for u in vertices for v in graph.out_vertices(u))
+    permutations = []
+    for automorphism in automorphisms:
+        try:
+            image = [position[automorphism[vertex]] for vertex in vertices]
+        except (KeyError, IndexError):
+            raise ValueError("Automorphisms must map vertices to vertices")
+        if len(set(image)) != len(vertices):
+            raise ValueError("Automorphisms must be bijections")
+        for u, v in edges:
+            if (automorphism[u], automorphism[v]) not in edges:
+                raise ValueError(
+                    "Automorphisms must map edges of the graph to edges, but "
+                    "%s -> %s is not an edge" % (automorphism[u],
+                                                 automorphism[v]))
+        permutations.append(numpy.array(image))
+    return permutations
+
+
+def _permute_codes(codes, permutation, N):
+    """The codes of the configurations with positions permuted."""
+
+    permuted = numpy.zeros_like(codes)
+    for i, j in enumerate(permutation):
+        permuted |= ((codes >> (N - 1 - i)) & 1) << (N - 1 - j)
+    return permuted
+
+
+def orbit_representatives(N, graph, automorphisms):
+    """
+    Labels every configuration by the smallest code in its orbit under the
+    group generated by the automorphisms, by propagating the minimum along
+    the generators until nothing changes.
+
+    Parameters
+    ----------
+    N: int
+        Population size, the number of vertices of the graph
+    graph: Graph
+        The graph that the population occupies
+    automorphisms: list
+        Generators of a group of automorphisms of the graph, each mapping a
+        vertex to its image (see cycle_automorphisms)
+
+    Returns
+    -------
+    labels: numpy array
+        The code of the orbit representative of each code
+    """
+
+    index_dtype = numpy.int32 if N < 31 else numpy.int64
+    codes = numpy.arange(1 << N, dtype=index_dtype)
+    images = [_permute_codes(codes, permutation, N) for permutation in
+              _position_permutations(graph, automorphisms)]
+    labels = codes.copy()
+    while True:
+        new_labels = labels
+        for image in images:
+            new_labels = numpy.minimum(new_labels, labels[image])
+        new_labels = numpy.minimum(new_labels, new_labels[new_labels])
+        if numpy.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def quotient_graph_transitions_arrays(N, graph, incentive, automorphisms,
+                                      mu=0.001, processes=None,
+                                      chunk_size=None):
+    """
+    Computes the transitions of the incentive process on a graph lumped over
+    the orbits of a group of graph automorphisms, without building the full
+    chain. The process is lumpable since automorphisms preserve the
+    population state and the graph, so the transition probability from an
+    orbit to another is the sum of the transitions from its representative
+    into the other orbit. For a cycle with rotations and reflections the
+    state space shrinks by about a factor of 2N.
+
+    Parameters
+    ----------
+    N: int
+        Population size, the number of vertices of the graph
+    graph: Graph
+        The graph that the population occupies
+    incentive: function
+        An incentive function from incentives.py
+    automorphisms: list
+        Generators of a group of automorphisms of the graph, each mapping a
+        vertex to its image (see cycle_automorphisms)
+    mu: float, 0.001
+        The mutation rate of the process
+    processes: int, None
+        The number of worker processes, see graph_transitions_arrays
+    chunk_size: int, None
+        The number of representatives per chunk of work
+
+    Returns
+    -------
+    representatives: numpy array
+        The codes of the orbit representatives, the smallest in each orbit
+    rows, cols, values: numpy arrays
+        The transitions between orbits, indexed as representatives
+    """
+
+    labels = orbit_representatives(N, graph, automorphisms)
+    representatives = numpy.flatnonzero(
+        labels == numpy.arange(len(labels))).astype(labels.dtype)
+    rows, cols, values = _graph_transitions(
+        N, graph, incentive, mu, representatives, processes=processes,
+        chunk_size=chunk_size)
+    rows = numpy.searchsorted(representatives, rows).astype(labels.dtype)
+    cols = numpy.searchsorted(representatives, labels[cols]).astype(
+        labels.dtype)
+    return representatives, rows, cols, values
+
+
+## Don't put N > 20 into this unless you have a lot of RAM and time
+def multivariate_graph_transitions(N, graph, incentive, mu=0.001,
+                                   automorphisms=None, processes=None):
+    """
+    Computes transition probabilities of the incentive process on a graph.
+    Warning: this uses a LOT of RAM (exponential in N typically), keep N small.
+    See graph_transitions_arrays for a compact version.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    graph: Graph
+        The graph that the population occuupies
+    incentive: function
+        An incentive function from incentives.py
+    mu: float, 0.001
+        The mutation rate of the process
+    automorphisms: list, None
+        Generators of a group of automorphisms of the graph (see
+        cycle_automorphisms). If given, the transitions are those of the
+        chain lumped over orbits, keyed by the orbit representatives.
+    processes: int, None
+        The number of worker processes, see graph_transitions_arrays
+
+    Returns
+    -------
+    dictionary of transition probabilities keyed by pairs of configurations
+    """
+
+    if automorphisms:
+        codes, rows, cols, values = quotient_graph_transitions_arrays(
+            N, graph, incentive, automorphisms, mu=mu, processes=processes)
+    else:
+        codes = numpy.arange(1 << N)
+        rows, cols, values = graph_transitions_arrays(
+            N, graph, incentive, mu=mu, processes=processes)
+    configs = [tuple(c) for c in decode_configurations(codes, N).tolist()]
+    edges = defaultdict(float)
+    for i, j, v in zip(rows.tolist(), cols.tolist(), values.tolist()):
+        edges[(configs[i], configs[j])] += v
+    return edges
@@ -4,10 +4,13 @@ Calculates transitions for the Moran process and generalizations.
 
 from ..utils.math_helpers import (
     simplex_generator, one_step_indicies_generator, logsumexp,
-    log_factorial, log_inc_factorial, factorial, inc_factorial)
+    log_factorial, log_inc_factorial, factorial, inc_factorial,
+    simplex_states, simplex_ranks, logsumexp_array, log1mexp)
 from ..utils.edges import (
     edge_func_to_edges, states_from_edges, power_transitions)
+from ..utils.disk_cache import cached_arrays, edges_to_arrays, arrays_to_edges
 
+import numpy
 from numpy import log, exp
 
 from .incentives import *
@@ -27,7 +30,7 @@ def is_valid_state(state, lower, upper):
 
 
 def multivariate_transitions(N, incentive, num_types=3, mu=0.001,
-                             no_boundary=False):
+                             no_boundary=False, cache=None, cache_key=None):
     """
     Computes transition probabilities the Incentive process
 
@@ -43,10 +46,31 @@ def multivariate_transitions(N, incentive, num_types=3, mu=0.001,
         The mutation rate of the process
     no_boundary: bool, False
         Exclude the boundary states
+    cache: DiskCache or string, None
+        If given, the transitions are loaded from or stored in this on-disk
+        cache (see utils.disk_cache). Converting the cached arrays back to a
+        list of edges dominates the load time, use
+        multivariate_transitions_arrays with the cache for memory-mapped
+        arrays that load in milliseconds.
+    cache_key: dict, None
+        Identifies the incentive for the cache, e.g. {"game_matrix": m,
+        "incentive": "fermi", "beta": 1.}
     """
 
-    return list(multivariate_transitions_gen(
-        N, incentive, num_types=num_types, mu=mu, no_boundary=no_boundary))
+    if cache is None:
+        return list(multivariate_transitions_gen(
+            N, incentive, num_types=num_types, mu=mu,
+            no_boundary=no_boundary))
+
+    def build():
+        return edges_to_arrays(multivariate_transitions(
+            N, incentive, num_types=num_types, mu=mu,
+            no_boundary=no_boundary))
+
+    arrays = cached_arrays(
+        cache, cache_key, build, process="incentive_process", N=N,
+        num_types=num_types, mu=mu, no_boundary=no_boundary)
+    return arrays_to_edges(arrays)
 
 
 def multivariate_transitions_gen(N, incentive, num_types=3, mu=0.001,
@@ -107,6 +131,114 @@ def multivariate_transitions_gen(N, incentive, num_types=3, mu=0.001,
         yield (state, state, 1. - s)
 
 
+def incentive_array(incentive, states):
+    """
+    Evaluates an incentive on every row of an (S, n) array of population
+    states, returning an (S, n) array. Uses the batch version of the
+    incentive (see incentives.py) if it has one.
+    """
+
+    if hasattr(incentive, "batch"):
+        return numpy.asarray(incentive.batch(states), dtype=float)
+    return numpy.array([incentive(tuple(state)) for state in states.tolist()],
+                       dtype=float)
+
+
+def multivariate_transitions_arrays(N, incentive, num_types=3, mu=0.001,
+                                    no_boundary=False, cache=None,
+                                    cache_key=None):
+    """
+    Computes transition probabilities the Incentive process for the whole
+    simplex at once with array operations. The transitions are the same as
+    those of multivariate_transitions but are returned as the arrays of a
+    sparse matrix, with states indexed by their rank in simplex_generator
+    order (see math_helpers.simplex_ranks).
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py
+    num_types: int, 3
+        Number of types in population
+    mu: float, 0.001
+        The mutation rate of the process
+    no_boundary: bool, False
+        Exclude the boundary states
+    cache: DiskCache or string, None
+        If given, the arrays are loaded memory-mapped from or stored in this
+        on-disk cache (see utils.disk_cache)
+    cache_key: dict, None
+        Identifies the incentive for the cache, e.g. {"game_matrix": m,
+        "incentive": "fermi", "beta": 1.}
+
+    Returns
+    -------
+    rows, cols, values: numpy arrays
+        The source indices, target indices and transition probabilities,
+        e.g. for scipy.sparse.csr_matrix((values, (rows, cols)))
+    """
+
+    if cache is not None:
+        def build():
+            rows, cols, values = multivariate_transitions_arrays(
+                N, incentive, num_types=num_types, mu=mu,
+                no_boundary=no_boundary)
+            return {"rows": rows, "cols": cols, "values": values}
+
+        arrays = cached_arrays(
+            cache, cache_key, build, process="incentive_process_arrays", N=N,
+            num_types=num_types, mu=mu, no_boundary=no_boundary)
+        return arrays["rows"], arrays["cols"], arrays["values"]
+
+    d = num_types - 1
+    states = simplex_states(N, d)
+    if no_boundary:
+        lower, upper = 1, N-1
+        sources = numpy.all(states > 0, axis=1)
+    else:
+        lower, upper = 0, N
+        sources = numpy.ones(len(states), dtype=bool)
+    ranks = numpy.arange(len(states))[sources]
+    states = states[sources]
+
+    inc = incentive_array(incentive, states)
+    denom = numpy.sum(inc, axis=1)
+    # r[:, j] is the probability that the offspring is of type j
+    r = numpy.zeros(inc.shape)
+    for j in range(num_types):
+        mutations = [mu / d] * num_types
+        mutations[j] = 1. - mu
+        for i in range(num_types):
+            r[:, j] += inc[:, i] * mutations[i]
+        r[:, j] /= denom
+
+    rows, cols, values = [], [], []
+    s = numpy.zeros(len(states))
+    # Transition probabilities for each adjacent state.
+    for plus_index, minus_index in one_step_indicies_generator(d):
+        target_states = states.copy()
+        target_states[:, plus_index] += 1
+        target_states[:, minus_index] -= 1
+        # Are we on or near the boundary?
+        valid = numpy.all((target_states >= lower) & (target_states <= upper),
+                          axis=1)
+        transitions = numpy.where(
+            valid, r[:, plus_index] * states[:, minus_index] / float(N), 0.)
+        rows.append(ranks[valid])
+        cols.append(simplex_ranks(target_states[valid]))
+        values.append(transitions[valid])
+        s += transitions
+    # Transition probabilities for staying put.
+    rows.append(ranks)
+    cols.append(ranks)
+    values.append(1. - s)
+
+    return numpy.concatenate(rows), numpy.concatenate(cols), \
+        numpy.concatenate(values)
+
+
 def log_multivariate_transitions(N, logincentive, num_types=3, mu=0.001,
                                  no_boundary=False):
     """
@@ -164,6 +296,83 @@ def log_multivariate_transitions(N, logincentive, num_types=3, mu=0.001,
     return edges
 
 
+def log_multivariate_transitions_arrays(N, logincentive, num_types=3,
+                                        mu=0.001, no_boundary=False):
+    """
+    Computes transition probabilities the Incentive process in log-space for
+    the whole simplex at once with array operations. The log-transitions are
+    those of log_multivariate_transitions, except that the probability of
+    staying put is computed as log1p(-sum of transitions) stably, and are
+    returned as the arrays of a sparse matrix with states indexed by their
+    rank in simplex_generator order.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    logincentive: function
+        A log-incentive function, e.g. log_logit from incentives.py. Its
+        batch version is used if it has one.
+    num_types: int, 3
+        Number of types in population
+    mu: float, 0.001
+        The mutation rate of the process
+    no_boundary: bool, False
+        Exclude the boundary states
+
+    Returns
+    -------
+    rows, cols, log_values: numpy arrays
+        The source indices, target indices and log-transition probabilities
+    """
+
+    d = num_types - 1
+    states = simplex_states(N, d)
+    if no_boundary:
+        lower, upper = 1, N-1
+        sources = numpy.all(states > 0, axis=1)
+    else:
+        lower, upper = 0, N
+        sources = numpy.ones(len(states), dtype=bool)
+    ranks = numpy.arange(len(states))[sources]
+    states = states[sources]
+
+    inc = incentive_array(logincentive, states)
+    denom = logsumexp_array(inc, axis=1)
+    # r[:, j] is the log-probability that the offspring is of type j
+    r = numpy.zeros(inc.shape)
+    with numpy.errstate(divide='ignore'):
+        for j in range(num_types):
+            mutations = [mu / d] * num_types
+            mutations[j] = 1. - mu
+            r[:, j] = logsumexp_array(inc + log(mutations), axis=1) - denom
+        log_states = log(states) - log(N)
+
+    rows, cols, log_values = [], [], []
+    log_transitions = []
+    # Transition probabilities for each adjacent state.
+    for plus_index, minus_index in one_step_indicies_generator(d):
+        target_states = states.copy()
+        target_states[:, plus_index] += 1
+        target_states[:, minus_index] -= 1
+        # Are we on or near the boundary?
+        valid = numpy.all((target_states >= lower) & (target_states <= upper),
+                          axis=1)
+        log_transition = numpy.where(
+            valid, r[:, plus_index] + log_states[:, minus_index], -numpy.inf)
+        rows.append(ranks[valid])
+        cols.append(simplex_ranks(target_states[valid]))
+        log_values.append(log_transition[valid])
+        log_transitions.append(log_transition)
+    # Transition probabilities for staying put.
+    rows.append(ranks)
+    cols.append(ranks)
+    log_values.append(log1mexp(logsumexp_array(log_transitions, axis=0)))
+
+    return numpy.concatenate(rows), numpy.concatenate(cols), \
+        numpy.concatenate(log_values)
+
+
 def compute_edges(N=30, num_types=None, m=None, incentive_func=logit, beta=1.,
                   q=1., mu=None):
     """
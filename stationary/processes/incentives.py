@@ -8,7 +8,29 @@ import numpy
 from ..utils.math_helpers import multiply_vectors, dot_product
 
 
-# Fitness Landscapes
+# Fitness Landscapes and incentives come in two forms: functions of a single
+# population state, and batch functions of an (S, n) array of population
+# states returning an (S, n) array. Where possible the single state functions
+# carry their batch version as the attribute `batch`, which the whole simplex
+# transition builders use.
+
+def _with_batch(f, batch):
+    """Attaches the batch version of a function, if there is one."""
+
+    if batch is not None:
+        f.batch = batch
+    return f
+
+
+def batch_constant_fitness(c):
+    """
+    Batch version of constant_fitness.
+    """
+
+    def f(pops):
+        return numpy.asarray(pops, dtype=float) * numpy.array(c)
+    return f
+
 
 def constant_fitness(c):
     """
@@ -17,6 +39,42 @@ def constant_fitness(c):
 
     def f(pop):
         return numpy.array(pop) * numpy.array(c)
+    return _with_batch(f, batch_constant_fitness(c))
+
+
+def batch_linear_fitness_landscape(m, self_interaction=True, normalize=False):
+    """
+    Batch version of linear_fitness_landscape, computing the fitness landscape
+    from a game matrix for an (S, n) array of population states.
+
+    Parameters
+    ----------
+    m: matrix or list of lists
+        The game matrix defining the landscape
+    self_interaction: bool, True
+        Whether players can self-interact, which affects the fitness landscape
+    normalize: bool, False
+        Whether to normalize the population states (typically not necessary)
+
+    Returns
+    -------
+    A function on (S, n) arrays of population states returning (S, n) arrays
+    """
+
+    m = numpy.array(m, dtype=float)
+
+    def f(pops):
+        pops = numpy.asarray(pops, dtype=float)
+        div = numpy.sum(pops, axis=1)
+        if not self_interaction:
+            div = div - 1
+        # Normalize population vectors
+        fitness = (pops / div[:, numpy.newaxis]).dot(m.T)
+        if not self_interaction:
+            fitness -= numpy.diag(m)
+        if normalize:
+            fitness /= div[:, numpy.newaxis]
+        return fitness
     return f
 
 
@@ -57,7 +115,8 @@ def linear_fitness_landscape(m, self_interaction=True, normalize=False):
                 f = f / float(div)
             fitness.append(f)
         return fitness
-    return f
+    return _with_batch(f, batch_linear_fitness_landscape(
+        m, self_interaction=self_interaction, normalize=normalize))
 
 
 def rock_paper_scissors(a=1, b=1):
@@ -73,6 +132,30 @@ rock_scissors_paper = rock_paper_scissors
 
 # Incentive Functions
 
+def batch_replicator(fitness, q=1, **kwargs):
+    """
+    Batch version of the replicator incentive.
+
+    Parameters
+    ----------
+    fitness: function
+        A batch fitness landscape
+    q: float
+        Exponent for the population state
+
+    Returns
+    -------
+    a function on (S, n) arrays corresponding to the incentive
+    """
+
+    def f(x):
+        x = numpy.asarray(x, dtype=float)
+        if q == 1:
+            return x * fitness(x)
+        return numpy.power(x, q) * fitness(x)
+    return f
+
+
 def replicator(fitness, q=1, **kwargs):
     """
     The replicator incentive for a power q. For q=1 this reproduces the Moran
@@ -90,15 +173,45 @@ def replicator(fitness, q=1, **kwargs):
     a function corresponding to the incentive
     """
 
+    batch = None
+    if hasattr(fitness, "batch"):
+        batch = batch_replicator(fitness.batch, q=q)
+
     if q == 1:
         def f(x):
             return multiply_vectors(x, fitness(x))
-        return f
+        return _with_batch(f, batch)
 
     def g(x):
         y = numpy.power(x, q)
         return y * fitness(x)
-    return g
+    return _with_batch(g, batch)
+
+
+def batch_logit(fitness, beta=1., q=0.):
+    """
+    Batch version of the logit incentive.
+
+    Parameters
+    ----------
+    fitness: function
+        A batch fitness landscape
+    q: float
+        Exponent for the population state
+    beta: float
+        An inverse temperature / strength of selection parameter
+
+    Returns
+    -------
+    a function on (S, n) arrays corresponding to the incentive.
+    """
+
+    def f(x):
+        x = numpy.asarray(x, dtype=float)
+        if q == 0:
+            return numpy.exp(fitness(x) * beta)
+        return numpy.power(x, q) * numpy.exp(fitness(x) * beta)
+    return f
 
 
 def logit(fitness, beta=1., q=0.):
@@ -120,15 +233,19 @@ def logit(fitness, beta=1., q=0.):
     a function corresponding to the incentive.
     """
 
+    batch = None
+    if hasattr(fitness, "batch"):
+        batch = batch_logit(fitness.batch, beta=beta, q=q)
+
     if q == 0:
         def f(x):
             return numpy.exp(numpy.array(fitness(x)) * beta)
-        return f
+        return _with_batch(f, batch)
 
     def g(x):
         y = numpy.power(x, q)
         return multiply_vectors(y, numpy.exp(numpy.array(fitness(x)) * beta))
-    return g
+    return _with_batch(g, batch)
 
 
 def fermi(fitness, beta=1., q=1.):
@@ -153,6 +270,69 @@ def fermi(fitness, beta=1., q=1.):
     return logit(fitness, beta=beta, q=1)
 
 
+def batch_fermi(fitness, beta=1., q=1.):
+    """
+    Batch version of the Fermi incentive.
+    """
+
+    return batch_logit(fitness, beta=beta, q=1)
+
+
+def batch_log_logit(fitness, beta=1., q=0.):
+    """
+    Batch version of log_logit.
+    """
+
+    def f(x):
+        x = numpy.asarray(x, dtype=float)
+        if q == 0:
+            return fitness(x) * beta
+        with numpy.errstate(divide='ignore'):
+            return q * numpy.log(x) + fitness(x) * beta
+    return f
+
+
+def log_logit(fitness, beta=1., q=0.):
+    """
+    The logarithm of the logit incentive for a power q, for use with the
+    log-space transitions when beta is large and the logit incentive
+    overflows or underflows.
+
+    Parameters
+    ----------
+    fitness: function
+        A fitness landscape
+    q: float
+        Exponent for the population state
+    beta: float
+        An inverse temperature / strength of selection parameter
+
+    Returns
+    -------
+    a function corresponding to the log-incentive.
+    """
+
+    def f(x):
+        g = numpy.array(fitness(x)) * beta
+        if q == 0:
+            return g
+        with numpy.errstate(divide='ignore'):
+            return q * numpy.log(x) + g
+
+    batch = None
+    if hasattr(fitness, "batch"):
+        batch = batch_log_logit(fitness.batch, beta=beta, q=q)
+    return _with_batch(f, batch)
+
+
+def log_fermi(fitness, beta=1., q=1.):
+    """
+    The logarithm of the Fermi incentive, equal to log_logit with q=1.
+    """
+
+    return log_logit(fitness, beta=beta, q=1)
+
+
 def logit2(fitness, beta=1., **kwargs):
     """
     The logit incentive for use with large beta, which approximates the
@@ -1,4 +1,5 @@
 from ..utils.math_helpers import normalize, multiply_vectors
+from ..utils.disk_cache import cached_arrays, edges_to_arrays, arrays_to_edges
 
 
 # Random-death probability distributions
@@ -59,7 +60,7 @@ def even_death(N):
 # 2d moran-like process separating birth and death processes
 def variable_population_transitions(
         N, fitness_landscape, death_probabilities=None, incentive=None,
-        mu=0.001):
+        mu=0.001, cache=None, cache_key=None):
     """
     Computes transition probabilities for the incentive process on two types
     for a population of varying size.
@@ -76,8 +77,34 @@ def variable_population_transitions(
         An incentive function from incentives.py
     mu: float, 0.001
         The mutation rate of the process
+    cache: DiskCache or string, None
+        If given, the transitions are loaded from or stored in this on-disk
+        cache (see utils.disk_cache)
+    cache_key: dict, None
+        Identifies the fitness landscape, and the death probabilities and
+        incentive if given (under the keys "death_probabilities" and
+        "incentive"), for the cache
     """
 
+    if cache is not None:
+        for name, f in [("death_probabilities", death_probabilities),
+                        ("incentive", incentive)]:
+            if f is not None and name not in (cache_key or dict()):
+                raise ValueError(
+                    "Keyword argument `cache_key` must describe the %s "
+                    "to cache the transitions." % name)
+
+        def build():
+            return edges_to_arrays(variable_population_transitions(
+                N, fitness_landscape, death_probabilities=death_probabilities,
+                incentive=incentive, mu=mu))
+
+        arrays = cached_arrays(
+            cache, cache_key, build, process="variable_population_size", N=N,
+            mu=mu, default_death_probabilities=death_probabilities is None,
+            default_incentive=incentive is None)
+        return arrays_to_edges(arrays)
+
     if not death_probabilities:
         death_probabilities = moran_death(N)
     edges = []
@@ -2,11 +2,18 @@
 The Wright-Fisher process
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
 from numpy import array, log, exp
 from scipy.special import gammaln
 
-from ..utils.math_helpers import simplex_generator, dot_product
+from ..utils.math_helpers import (
+    simplex_generator, dot_product, simplex_states,
+    simplex_rank, kl_divergence_array)
+from ..stationary_ import iterate_to_convergence
+from ..utils.disk_cache import cached_arrays
+from .incentive_process import incentive_array
 
 
 def cache_multinomial_coefficients(N, num_types=3):
@@ -33,10 +40,251 @@ def cache_multinomial_coefficients(N, num_types=3):
             M[i][j] = gammaln(N+1) - gammaln(i+1) - gammaln(j+1) - gammaln(k+1)
         return M
 
+    # Indexed by the first num_types - 1 coordinates as above
+    states = simplex_states(N, num_types - 1)
+    M = numpy.zeros(shape=(N+1,) * (num_types - 1))
+    M[tuple(states[:, :-1].T)] = log_multinomial_coefficients(
+        N, num_types=num_types)
+    return M
+
+
+def log_multinomial_coefficients(N, num_types=3):
+    """
+    The logarithms of the multinomial coefficients N! / (x_1! ... x_n!) of
+    all the states x of the simplex, indexed by simplex rank. Unlike
+    cache_multinomial_coefficients the size is the number of states, which
+    keeps higher dimensions practical.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    num_types: int, 3
+        Number of types in population
+
+    Returns
+    -------
+    numpy array of length S
+    """
+
+    log_factorials = gammaln(numpy.arange(N + 1) + 1.)
+    states = simplex_states(N, num_types - 1)
+    return log_factorials[N] - log_factorials[states].sum(axis=1)
+
+
+def _rank_table(N, num_types=3):
+    """
+    A lookup table from the first num_types - 1 coordinates of a state to its
+    rank in simplex_generator order.
+    """
+
+    states = simplex_states(N, num_types - 1)
+    table = numpy.full((N + 1,) * (num_types - 1), -1, dtype=int)
+    table[tuple(states[:, :-1].T)] = numpy.arange(len(states))
+    return table
+
+
+def _mutation_matrix(mu, num_types):
+    """
+    The mutation kernel Q, where Q[i][j] is the probability that an offspring
+    of type i is of type j. If mu is a rate, offspring mutate to each other
+    type with probability mu / (num_types - 1); otherwise mu is taken to be
+    the num_types x num_types kernel itself.
+    """
+
+    if numpy.ndim(mu) == 2:
+        Q = numpy.array(mu, dtype=float)
+        if Q.shape != (num_types, num_types):
+            raise ValueError(
+                "The mutation matrix must have shape (num_types, num_types).")
+        if numpy.any(Q < 0) or not numpy.allclose(Q.sum(axis=1), 1.):
+            raise ValueError(
+                "The rows of the mutation matrix must be probability "
+                "distributions.")
+        return Q
+    Q = numpy.full((num_types, num_types), mu / (num_types - 1.))
+    numpy.fill_diagonal(Q, 1. - mu)
+    return Q
+
+
+def transition_rows(N, incentive, sources, mu=0.001, num_types=3,
+                    log_coefficients=None):
+    """
+    Computes the Wright-Fisher transition probabilities from each of the
+    source states to every state of the simplex at once. The incentive is
+    evaluated once per source state (with its batch version if it has one)
+    and the log-multinomial probabilities of all next states are a single
+    matrix product with the cached multinomial coefficients.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py
+    sources: array of shape (k, num_types)
+        The source states
+    mu: float or array, 0.001
+        The mutation rate of the process, or a num_types x num_types
+        mutation matrix whose entry [i][j] is the probability that an
+        offspring of type i is of type j
+    num_types: int, 3
+        Number of types in population
+    log_coefficients: numpy array, None
+        The log-multinomial coefficients from log_multinomial_coefficients,
+        computed if not given
+
+    Returns
+    -------
+    numpy array of shape (k, S), the transition probabilities to the states
+    in simplex_generator order
+    """
+
+    if log_coefficients is None:
+        log_coefficients = log_multinomial_coefficients(
+            N, num_types=num_types)
+    ps = offspring_probabilities(incentive, sources, mu=mu,
+                                 num_types=num_types)
+    next_states = simplex_states(N, num_types - 1)
+    return _multinomial_rows(ps, next_states, log_coefficients)
+
+
+def offspring_probabilities(incentive, sources, mu=0.001, num_types=3):
+    """
+    The probability that an offspring is of each type, for each of the source
+    states, i.e. the parameters of the multinomial distribution of the next
+    generation.
+
+    Parameters
+    ----------
+    incentive: function
+        An incentive function from incentives.py
+    sources: array of shape (k, num_types)
+        The source states
+    mu: float or array, 0.001
+        The mutation rate of the process, or a num_types x num_types
+        mutation matrix whose entry [i][j] is the probability that an
+        offspring of type i is of type j
+    num_types: int, 3
+        Number of types in population
+
+    Returns
+    -------
+    numpy array of shape (k, num_types)
+    """
+
+    inc = incentive_array(incentive, numpy.asarray(sources))
+    s = inc.sum(axis=1)
+    if numpy.any(s == 0):
+        raise ValueError(
+            "You need to use a Fermi incentive to prevent division by zero."
+        )
+    return inc.dot(_mutation_matrix(mu, num_types)) / s[:, numpy.newaxis]
+
+
+def _multinomial_rows(ps, next_states, log_coefficients):
+    """
+    The multinomial probabilities of all next states for each row of
+    offspring probabilities ps, computed in log-space from the
+    log-multinomial coefficients of the next states. Types with probability
+    zero contribute nothing when absent from the next state, and rule out the
+    next state otherwise.
+    """
+
+    zero = ps <= 0
+    with numpy.errstate(divide='ignore'):
+        log_ps = numpy.where(zero, 0., log(ps))
+    result = log_ps.dot(next_states.T)
+    result += log_coefficients
+    if numpy.any(zero):
+        impossible = zero.astype(float).dot((next_states > 0).T) > 0
+        result[impossible] = -numpy.inf
+    return exp(result, out=result)
+
+
+# Number of rows computed at once when caching the transitions
+_ROWS_PER_STEP = 256
+
+
+def _cache_transitions(N, incentive, mu, num_types, dtype=float,
+                       chunk_size=None):
+    """
+    Caches the Wright-Fisher transition matrix as an S x S array indexed by
+    the simplex ranks of the states, where S is the number of states, so that
+    no memory is spent on invalid coordinates. The rows are stored in blocks
+    of chunk_size rows, allocated separately, to avoid a single large
+    allocation, and are computed a few hundred at a time with
+    transition_rows.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py
+    mu: float or array
+        The mutation rate of the process or its mutation matrix
+    num_types: int
+        Number of types in population
+    dtype: numpy dtype, float
+        The storage type, e.g. numpy.float32 to halve the memory used
+    chunk_size: int, None
+        The number of rows per block. If None, a single S x S block is used.
+
+    Returns
+    -------
+    blocks: list of numpy arrays
+        The row blocks of the transition matrix
+    """
+
+    log_coefficients = log_multinomial_coefficients(N, num_types=num_types)
+    states = simplex_states(N, num_types - 1)
+    S = len(states)
+    if not chunk_size:
+        chunk_size = S
+    blocks = []
+    for start in range(0, S, chunk_size):
+        block = numpy.zeros((min(chunk_size, S - start), S), dtype=dtype)
+        for i in range(0, len(block), _ROWS_PER_STEP):
+            stop = min(i + _ROWS_PER_STEP, len(block))
+            sources = states[start + i: start + stop]
+            block[i: i + len(sources)] = transition_rows(
+                N, incentive, sources, mu=mu, num_types=num_types,
+                log_coefficients=log_coefficients)
+        blocks.append(block)
+    return blocks
+
+
+def _cached_edge_func(N, num_types, blocks):
+    """
+    The edge_func over the cached transition matrix blocks. The blocks are
+    exposed as the attribute `blocks` of the function, and the full S x S
+    matrix as `matrix` if it is stored in a single block.
+    """
+
+    chunk_size = len(blocks[0])
+    if num_types <= 3:
+        table = _rank_table(N, num_types)
+        rank = lambda state: table[tuple(state[:-1])]
+    else:
+        # A lookup table would have (N+1)^(num_types-1) entries
+        rank = simplex_rank
+
+    def h(current_state, next_state):
+        i = rank(current_state)
+        j = rank(next_state)
+        return blocks[i // chunk_size][i % chunk_size, j]
+
+    h.blocks = blocks
+    h.matrix = blocks[0] if len(blocks) == 1 else None
+    return h
+
 
-def multivariate_transitions_sub(N, incentive, mu=0.001, low_memory=False):
+def multivariate_transitions_sub(N, incentive, mu=0.001, low_memory=False,
+                                 dtype=float, chunk_size=None):
     """
-    Computes transitions for dimension n=3 moran process given a game matrix.
+    Computes transitions for dimension n=2 Wright-Fisher process given a
+    game matrix.
 
     Parameters
     ----------
@@ -46,6 +294,12 @@ def multivariate_transitions_sub(N, incentive, mu=0.001, low_memory=False):
         An incentive function from incentives.py
     mu: float, 0.001
         The mutation rate of the process
+    low_memory: bool, False
+        If True, nothing is cached
+    dtype: numpy dtype, float
+        The storage type of the cached transitions
+    chunk_size: int, None
+        The number of rows per block of the cached transitions
     """
 
     num_types = 2
@@ -73,23 +327,73 @@ def multivariate_transitions_sub(N, incentive, mu=0.001, low_memory=False):
         return multinomial_probability(next_state, ps)
 
     if low_memory:
+        g.low_memory = True
         return g
 
-    # Cache the full edge computation
-    edges = numpy.zeros(shape=(N+1, N+1))
-    for current_state in simplex_generator(N, num_types - 1):
-        for next_state in simplex_generator(N, num_types - 1):
-            edges[current_state[0]][next_state[0]] = g(current_state,
-                                                       next_state)
+    # Cache the full edge computation, indexed by simplex rank
+    blocks = _cache_transitions(N, incentive, mu, num_types, dtype=dtype,
+                                chunk_size=chunk_size)
+    return _cached_edge_func(N, num_types, blocks)
 
-    def h(current_state, next_state):
-        return edges[current_state[0]][next_state[0]]
 
-    return h
+def multivariate_transitions_general(N, incentive, mu=0.001, num_types=4,
+                                     low_memory=False, dtype=float,
+                                     chunk_size=None):
+    """
+    Computes transitions for the Wright-Fisher process with any number of
+    types, with mutation to each other type with probability
+    mu / (num_types - 1) or according to a given mutation matrix.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py
+    mu: float or array, 0.001
+        The mutation rate of the process, or a num_types x num_types
+        mutation matrix whose entry [i][j] is the probability that an
+        offspring of type i is of type j
+    num_types: int, 4
+        Number of types in population
+    low_memory: bool, False
+        If True, nothing is cached
+    dtype: numpy dtype, float
+        The storage type of the cached transitions
+    chunk_size: int, None
+        The number of rows per block of the cached transitions
+    """
+
+    Q = _mutation_matrix(mu, num_types)
+    log_factorials = gammaln(numpy.arange(N + 1) + 1.)
+
+    def g(current_state, next_state):
+        inc = numpy.array(incentive(current_state))
+        s = float(sum(inc))
+        if s == 0:
+            raise ValueError(
+                "You need to use a Fermi incentive to prevent division by zero."
+            )
+        ps = inc.dot(Q) / s
+        xs = array(next_state)
+        result = log_factorials[N] - log_factorials[xs].sum()
+        if numpy.any(ps[xs > 0] <= 0):
+            return 0.
+        return exp(result + sum(xs[xs > 0] * log(ps[xs > 0])))
+
+    if low_memory:
+        g.low_memory = True
+        return g
+
+    # Cache the full edge computation, indexed by simplex rank
+    blocks = _cache_transitions(N, incentive, mu, num_types, dtype=dtype,
+                                chunk_size=chunk_size)
+    return _cached_edge_func(N, num_types, blocks)
 
 
 def multivariate_transitions(N, incentive, mu=0.001, num_types=3,
-                             low_memory=False):
+                             low_memory=False, dtype=float, chunk_size=None,
+                             cache=None, cache_key=None):
     """Computes transitions for the Wright-Fisher process. Since this can be a
     large matrix, this function returns a function that computes the transitions
     for any given two states. This can be converted to a list of edges with
@@ -103,19 +407,59 @@ def multivariate_transitions(N, incentive, mu=0.001, num_types=3,
         An incentive function from incentives.py
     num_types: int, 3
         Number of types in population
-    mu: float, 0.001
-        The mutation rate of the process
+    mu: float or array, 0.001
+        The mutation rate of the process, or a num_types x num_types
+        mutation matrix whose entry [i][j] is the probability that an
+        offspring of type i is of type j
     low_memory: bool, False
-        If True, less is cached to save memory
+        If True, less is cached to save memory (and stationary_distribution
+        does not evaluate the edge function for the reversibility test)
+    dtype: numpy dtype, float
+        The storage type of the cached transitions, e.g. numpy.float32
+    chunk_size: int, None
+        The number of rows per separately allocated block of the cached
+        transitions. If None the transitions are stored in one S x S array.
+    cache: DiskCache or string, None
+        If given, the cached transition matrix is loaded memory-mapped from
+        or stored in this on-disk cache (see utils.disk_cache). Ignored if
+        low_memory is True.
+    cache_key: dict, None
+        Identifies the incentive for the cache, e.g. {"game_matrix": m,
+        "incentive": "fermi", "beta": 1.}
 
     Returns
     -------
     edge_func: function on states x states
+        Unless low_memory is True, the cached transitions are available as
+        the attribute `blocks` (a list of row blocks of the S x S transition
+        matrix, indexed by simplex rank) and `matrix` (the full array, or
+        None if chunked).
     """
 
+    if cache is not None and not low_memory:
+        def build():
+            h = multivariate_transitions(N, incentive, mu=mu,
+                                         num_types=num_types, dtype=dtype)
+            return {"matrix": h.matrix}
+
+        matrix = cached_arrays(
+            cache, cache_key, build, process="wright_fisher", N=N, mu=mu,
+            num_types=num_types, dtype=numpy.dtype(dtype).str)["matrix"]
+        if not chunk_size:
+            chunk_size = len(matrix)
+        blocks = [matrix[start: start + chunk_size]
+                  for start in range(0, len(matrix), chunk_size)]
+        return _cached_edge_func(N, num_types, blocks)
+
+    if numpy.ndim(mu) == 2 or num_types > 3:
+        # The specialized transitions only handle uniform mutation
+        return multivariate_transitions_general(
+            N, incentive, mu=mu, num_types=num_types, low_memory=low_memory,
+            dtype=dtype, chunk_size=chunk_size)
     if num_types == 2:
         return multivariate_transitions_sub(
-            N, incentive, mu=mu, low_memory=low_memory)
+            N, incentive, mu=mu, low_memory=low_memory, dtype=dtype,
+            chunk_size=chunk_size)
 
     M = cache_multinomial_coefficients(N, num_types=num_types)
 
@@ -142,15 +486,127 @@ def multivariate_transitions(N, incentive, mu=0.001, num_types=3,
         return multinomial_probability(next_state, ps)
 
     if low_memory:
+        g.low_memory = True
         return g
 
-    # Cache the full edge computation
-    edges = numpy.zeros(shape=(N+1, N+1, N+1, N+1))
-    for current_state in simplex_generator(N, num_types-1):
-        for next_state in simplex_generator(N, num_types-1):
-            edges[current_state[0]][current_state[1]][next_state[0]][next_state[1]] = g(current_state, next_state)
+    # Cache the full edge computation, indexed by simplex rank
+    blocks = _cache_transitions(N, incentive, mu, num_types, dtype=dtype,
+                                chunk_size=chunk_size)
+    return _cached_edge_func(N, num_types, blocks)
 
-    def h(current_state, next_state):
-        return edges[current_state[0]][current_state[1]][next_state[0]][next_state[1]]
 
-    return h
+## Matrix-free stationary distribution
+
+def _apply_block(ps, ranks, next_states, log_coefficients):
+    """
+    The contribution of a block of source states, with offspring
+    probabilities ps and current probabilities ranks, to the next iteration.
+    """
+
+    return _multinomial_rows(ps, next_states, log_coefficients).T.dot(ranks)
+
+
+def matrix_free_generator(N, incentive, mu=0.001, num_types=3,
+                          block_size=256, executor=None, initial_state=None):
+    """
+    Generator for the stationary distribution of the Wright-Fisher process
+    that never stores the transition matrix. Each iteration generates the
+    transition rows in blocks of block_size source states, applies them to
+    the current distribution and discards them, so peak memory is about
+    block_size x S floats per concurrent block. Blocks are spread over the
+    executor (e.g. a ThreadPoolExecutor) if one is given.
+
+    Yields
+    ------
+    numpy arrays of floats indexed by simplex rank
+    """
+
+    next_states = simplex_states(N, num_types - 1)
+    log_coefficients = log_multinomial_coefficients(N, num_types=num_types)
+    S = len(next_states)
+    # The offspring probabilities are small (S x num_types), keep them
+    ps = offspring_probabilities(incentive, next_states, mu=mu,
+                                 num_types=num_types)
+    starts = range(0, S, block_size)
+
+    if initial_state is None or len(initial_state) == 0:
+        ranks = numpy.ones(S) / S
+    else:
+        ranks = numpy.array(initial_state, dtype=float)
+
+    yield ranks
+    while True:
+        args = [(ps[start: start + block_size],
+                 ranks[start: start + block_size]) for start in starts]
+        if executor:
+            parts = executor.map(
+                lambda a: _apply_block(a[0], a[1], next_states,
+                                       log_coefficients), args)
+        else:
+            parts = (_apply_block(p, r, next_states, log_coefficients)
+                     for p, r in args)
+        new_ranks = numpy.zeros(S)
+        for part in parts:
+            new_ranks += part
+        ranks = new_ranks
+        yield ranks
+
+
+def matrix_free_stationary(N, incentive, mu=0.001, num_types=3,
+                           block_size=256, threads=None, iterations=None,
+                           lim=1e-8, initial_state=None):
+    """
+    Approximates the stationary distribution of the Wright-Fisher process by
+    iterating the transition matrix without storing it, for population sizes
+    where the S x S transition matrix does not fit in memory. Blocks of
+    transition rows are computed on the fly in a thread pool (numpy releases
+    the GIL in the matrix products).
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py
+    mu: float or array, 0.001
+        The mutation rate of the process, or a num_types x num_types
+        mutation matrix whose entry [i][j] is the probability that an
+        offspring of type i is of type j
+    num_types: int, 3
+        Number of types in population
+    block_size: int, 256
+        The number of source states per block. Peak memory is roughly
+        threads x block_size x S floats.
+    threads: int, None
+        The number of worker threads, by default the number of processors.
+        Use 1 to compute in the calling thread.
+    iterations: int, None
+        Maximum number of iterations
+    lim: float, 1e-8
+        The iteration stops when successive iterations have a kl_divergence
+        less than lim
+    initial_state: None
+        A distribution over the states in simplex_generator order. If None,
+        the uniform distribution is used.
+
+    Returns
+    -------
+    dictionary, the stationary distribution keyed by state
+    """
+
+    states = [tuple(state) for state in
+              simplex_states(N, num_types - 1).tolist()]
+    if threads == 1:
+        executor = None
+    else:
+        executor = ThreadPoolExecutor(max_workers=threads)
+    try:
+        gen = matrix_free_generator(
+            N, incentive, mu=mu, num_types=num_types, block_size=block_size,
+            executor=executor, initial_state=initial_state)
+        ranks = iterate_to_convergence(gen, iterations=iterations, lim=lim,
+                                       divergence=kl_divergence_array)
+    finally:
+        if executor:
+            executor.shutdown()
+    return dict(zip(states, ranks))
@@ -0,0 +1,407 @@
+"""
+Monte Carlo estimates of stationary distributions from ensembles of
+independent chains, for processes whose state spaces are too large to
+enumerate. All the chains are advanced at once with array operations.
+"""
+
+from __future__ import absolute_import
+
+import numpy
+from scipy.stats import norm
+
+from stationary.processes.incentive_process import incentive_array
+from stationary.processes.graph_process import (
+    decode_configurations, edge_positions, encode_configuration,
+    reproduction_rates)
+from stationary.utils.math_helpers import (
+    num_simplex_states, simplex_ranks, simplex_unranks)
+
+
+def _sample(p, u):
+    """
+    Samples an index from each row of the probability distributions p, given
+    uniform random numbers u.
+    """
+
+    cumulative = numpy.cumsum(p, axis=1)
+    indices = (u[:, numpy.newaxis] * cumulative[:, -1:] >
+               cumulative).sum(axis=1)
+    return numpy.minimum(indices, p.shape[1] - 1)
+
+
+def incentive_process_step(N, incentive, num_types=3, mu=0.001,
+                           no_boundary=False):
+    """
+    A function advancing an ensemble of incentive processes by one step, with
+    the transition probabilities of incentive_process.multivariate_transitions:
+    a type j reproduces (with mutation) with probability r_j and an
+    individual of type i is replaced with probability x_i / N.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py, preferably with a batch
+        version
+    num_types: int, 3
+        Number of types in population
+    mu: float, 0.001
+        The mutation rate of the process
+    no_boundary: bool, False
+        Exclude the boundary states
+
+    Returns
+    -------
+    step: function
+        step(states, random_state) returns the next states of an (C,
+        num_types) array of population states
+    """
+
+    d = num_types - 1
+    Q = numpy.full((num_types, num_types), mu / d)
+    numpy.fill_diagonal(Q, 1. - mu)
+    if no_boundary:
+        lower, upper = 1, N - 1
+    else:
+        lower, upper = 0, N
+
+    def step(states, random_state):
+        inc = incentive_array(incentive, states)
+        r = inc.dot(Q) / inc.sum(axis=1)[:, numpy.newaxis]
+        u = random_state.random_sample((2, len(states)))
+        plus_index = _sample(r, u[0])
+        minus_index = _sample(states / float(N), u[1])
+        chains = numpy.arange(len(states))
+        next_states = states.copy()
+        next_states[chains, plus_index] += 1
+        next_states[chains, minus_index] -= 1
+        valid = numpy.all((next_states >= lower) & (next_states <= upper),
+                          axis=1)
+        return numpy.where(valid[:, numpy.newaxis], next_states, states)
+
+    return step
+
+
+def graph_process_step(N, graph, incentive, mu=0.001):
+    """
+    A function advancing an ensemble of incentive processes on a graph by
+    one step, with the transition probabilities of
+    graph_process.graph_transitions_arrays: an individual is picked to
+    reproduce according to the incentive of its type, and its offspring
+    (mutated with probability mu) replaces a uniformly random out-neighbor.
+    Configurations are integer codes (see graph_process.encode_configuration).
+
+    Parameters
+    ----------
+    N: int
+        Population size, the number of vertices of the graph (at most 62)
+    graph: Graph
+        The graph that the population occupies
+    incentive: function
+        An incentive function from incentives.py
+    mu: float, 0.001
+        The mutation rate of the process
+
+    Returns
+    -------
+    step: function
+        step(codes, random_state) returns the next codes of an array of
+        configuration codes
+    """
+
+    if N > 62:
+        raise ValueError("Configurations of more than 62 vertices do not fit"
+                         " in 64 bit integer codes.")
+    rates = reproduction_rates(N, incentive)
+    directed_edges = edge_positions(graph)
+    degrees = numpy.zeros(N, dtype=int)
+    for source_position, _, _ in directed_edges:
+        degrees[source_position] += 1
+    neighbors = numpy.zeros((N, max(degrees.max(), 1)), dtype=int)
+    filled = numpy.zeros(N, dtype=int)
+    for source_position, target_position, _ in directed_edges:
+        neighbors[source_position, filled[source_position]] = target_position
+        filled[source_position] += 1
+    shifts = numpy.arange(N - 1, -1, -1, dtype=numpy.int64)
+
+    def step(codes, random_state):
+        bits = (codes[:, numpy.newaxis] >> shifts) & 1
+        counts = bits.sum(axis=1)
+        weights = rates[counts[:, numpy.newaxis], bits]
+        u = random_state.random_sample((3, len(codes)))
+        source_position = _sample(weights, u[0])
+        chains = numpy.arange(len(codes))
+        degree = degrees[source_position]
+        target_position = neighbors[
+            source_position,
+            numpy.minimum((u[1] * degree).astype(int), degree - 1)]
+        offspring = bits[chains, source_position] ^ (u[2] < mu)
+        target_shift = shifts[target_position]
+        cleared = codes & ~(numpy.int64(1) << target_shift)
+        next_codes = cleared | (offspring.astype(numpy.int64) << target_shift)
+        # Vertices without out-neighbors are chosen but replace no one
+        return numpy.where(degree > 0, next_codes, codes)
+
+    return step
+
+
+def integrated_autocorrelation_time(traces, c=5.):
+    """
+    Estimates the integrated autocorrelation time of a scalar observable
+    from the traces of independent chains, with the autocorrelation function
+    averaged over chains and Sokal's automatic window (the smallest window M
+    with M >= c * tau).
+
+    Parameters
+    ----------
+    traces: array of shape (T, C)
+        The observable at T successive steps of C chains
+    c: float, 5.
+        The window constant
+
+    Returns
+    -------
+    float, the integrated autocorrelation time in steps
+    """
+
+    traces = numpy.asarray(traces, dtype=float)
+    T = len(traces)
+    centered = traces - traces.mean(axis=0)
+    # Autocovariance by FFT, zero padded to avoid circular wrap around
+    n = 1 << int(numpy.ceil(numpy.log2(2 * T)))
+    f = numpy.fft.rfft(centered, n=n, axis=0)
+    acov = numpy.fft.irfft(f * numpy.conj(f), n=n, axis=0)[:T].mean(axis=1)
+    if acov[0] <= 0:
+        return 1.
+    rho = acov / acov[0]
+    taus = 2. * numpy.cumsum(rho) - 1.
+    windows = numpy.arange(T)
+    m = numpy.flatnonzero(windows >= c * taus)
+    if len(m):
+        return float(taus[m[0]])
+    return float(taus[-1])
+
+
+def ensemble_simulation(step, initial_states, keys, observable, steps=10000,
+                        burn_in=1000, seed=None, confidence=0.95):
+    """
+    Advances an ensemble of independent chains and estimates the stationary
+    distribution by the occupation frequencies averaged over chains, with
+    normal confidence intervals from the spread across chains.
+
+    Parameters
+    ----------
+    step: function
+        step(states, random_state) advances all the chains by one step
+    initial_states: numpy array
+        The initial state of each chain (one per row)
+    keys: function
+        Maps an array of states to integer keys identifying them
+    observable: function
+        Maps an array of states to a scalar per chain, for the
+        autocorrelation time
+    steps: int, 10000
+        The number of recorded steps of each chain
+    burn_in: int, 1000
+        The number of steps discarded first
+    seed: int or numpy.random.RandomState, None
+        The seed of the random number generator, or the generator itself
+    confidence: float, 0.95
+        The confidence level of the intervals
+
+    Returns
+    -------
+    report: dictionary
+        "keys", "estimate", "lower", "upper" (arrays over the visited states),
+        "autocorrelation_time", "effective_sample_size", "chains" and
+        "steps"
+    """
+
+    if isinstance(seed, numpy.random.RandomState):
+        random_state = seed
+    else:
+        random_state = numpy.random.RandomState(seed)
+    states = numpy.array(initial_states)
+    C = len(states)
+    for _ in range(burn_in):
+        states = step(states, random_state)
+
+    visited = numpy.empty((steps, C), dtype=numpy.int64)
+    traces = numpy.empty((steps, C))
+    for t in range(steps):
+        states = step(states, random_state)
+        visited[t] = keys(states)
+        traces[t] = observable(states)
+
+    # Occupation counts of each (state, chain) pair without a dense
+    # states x chains array
+    unique_keys, inverse = numpy.unique(visited, return_inverse=True)
+    inverse = inverse.reshape(visited.shape)
+    pairs, counts = numpy.unique(
+        inverse * C + numpy.arange(C)[numpy.newaxis, :], return_counts=True)
+    state_index = pairs // C
+    fractions = counts / float(steps)
+    K = len(unique_keys)
+    total = numpy.bincount(state_index, weights=fractions, minlength=K)
+    total_squares = numpy.bincount(state_index, weights=fractions ** 2,
+                                   minlength=K)
+    estimate = total / C
+    if C > 1:
+        variance = (total_squares - C * estimate ** 2) / (C - 1.)
+        standard_error = numpy.sqrt(numpy.maximum(variance, 0.) / C)
+    else:
+        standard_error = numpy.zeros(K)
+    z = norm.ppf(0.5 + confidence / 2.)
+
+    tau = integrated_autocorrelation_time(traces)
+    return {"keys": unique_keys, "estimate": estimate,
+            "lower": numpy.maximum(estimate - z * standard_error, 0.),
+            "upper": numpy.minimum(estimate + z * standard_error, 1.),
+            "autocorrelation_time": tau,
+            "effective_sample_size": C * steps / max(tau, 1.),
+            "chains": C, "steps": steps}
+
+
+def _stationary_from_report(report, states, return_report):
+    d = dict(zip(states, report["estimate"]))
+    if not return_report:
+        return d
+    report = dict(report)
+    report["confidence_intervals"] = dict(
+        zip(states, zip(report["lower"], report["upper"])))
+    return d, report
+
+
+def simulate_incentive_process(N, incentive, num_types=3, mu=0.001,
+                               no_boundary=False, chains=1000, steps=10000,
+                               burn_in=1000, seed=None, initial_state=None,
+                               confidence=0.95, report=False):
+    """
+    Estimates the stationary distribution of the incentive process by
+    simulating an ensemble of independent chains.
+
+    Parameters
+    ----------
+    N: int
+        Population size / simplex divisor
+    incentive: function
+        An incentive function from incentives.py
+    num_types: int, 3
+        Number of types in population
+    mu: float, 0.001
+        The mutation rate of the process
+    no_boundary: bool, False
+        Exclude the boundary states
+    chains: int, 1000
+        The number of independent chains
+    steps: int, 10000
+        The number of recorded steps of each chain
+    burn_in: int, 1000
+        The number of steps discarded first
+    seed: int, None
+        The seed of the random number generator
+    initial_state: tuple, None
+        The initial state of every chain. If None, the chains start at
+        uniformly random states.
+    confidence: float, 0.95
+        The confidence level of the intervals
+    report: bool, False
+        Also return a dictionary with "confidence_intervals" (keyed by
+        state), "autocorrelation_time" (of the number of individuals of the
+        first type) and the other entries of ensemble_simulation
+
+    Returns
+    -------
+    dictionary, the estimated stationary distribution over the visited
+    states, and the report if report is True
+    """
+
+    d = num_types - 1
+    random_state = numpy.random.RandomState(seed)
+    if initial_state is not None:
+        initial_states = numpy.tile(initial_state, (chains, 1))
+    else:
+        # Uniformly random initial states, moved off the boundary if needed
+        initial_states = simplex_unranks(random_state.randint(
+            num_simplex_states(N, d), size=chains), N, d)
+        if no_boundary:
+            center = numpy.full(num_types, N // num_types)
+            center[-1] = N - center[:-1].sum()
+            on_boundary = numpy.any(initial_states == 0, axis=1)
+            initial_states[on_boundary] = center
+    step = incentive_process_step(N, incentive, num_types=num_types, mu=mu,
+                                  no_boundary=no_boundary)
+    result = ensemble_simulation(
+        step, initial_states, simplex_ranks, lambda states: states[:, 0],
+        steps=steps, burn_in=burn_in, seed=random_state,
+        confidence=confidence)
+    states = [tuple(state) for state in
+              simplex_unranks(result["keys"], N, d).tolist()]
+    return _stationary_from_report(result, states, report)
+
+
+def simulate_graph_process(N, graph, incentive, mu=0.001, chains=1000,
+                           steps=10000, burn_in=1000, seed=None,
+                           initial_state=None, confidence=0.95,
+                           report=False):
+    """
+    Estimates the stationary distribution of the incentive process on a
+    graph by simulating an ensemble of independent chains, for graphs too
+    large to enumerate the 2^N configurations.
+
+    Parameters
+    ----------
+    N: int
+        Population size, the number of vertices of the graph (at most 62)
+    graph: Graph
+        The graph that the population occupies
+    incentive: function
+        An incentive function from incentives.py
+    mu: float, 0.001
+        The mutation rate of the process
+    chains: int, 1000
+        The number of independent chains
+    steps: int, 10000
+        The number of recorded steps of each chain
+    burn_in: int, 1000
+        The number of steps discarded first
+    seed: int, None
+        The seed of the random number generator
+    initial_state: tuple, None
+        The initial configuration of every chain. If None, the chains start
+        at uniformly random configurations.
+    confidence: float, 0.95
+        The confidence level of the intervals
+    report: bool, False
+        Also return a dictionary with "confidence_intervals" (keyed by
+        configuration), "autocorrelation_time" (of the number of individuals
+        of type 1) and the other entries of ensemble_simulation
+
+    Returns
+    -------
+    dictionary, the estimated stationary distribution over the visited
+    configurations, and the report if report is True
+    """
+
+    step = graph_process_step(N, graph, incentive, mu=mu)
+    random_state = numpy.random.RandomState(seed)
+    if initial_state is not None:
+        initial_states = numpy.full(
+            chains, encode_configuration(initial_state), dtype=numpy.int64)
+    else:
+        initial_states = numpy.zeros(chains, dtype=numpy.int64)
+        for i in range(N):
+            initial_states = (initial_states << 1) | random_state.randint(
+                2, size=chains)
+    shifts = numpy.arange(N - 1, -1, -1, dtype=numpy.int64)
+
+    def popcount(codes):
+        return ((codes[:, numpy.newaxis] >> shifts) & 1).sum(axis=1)
+
+    result = ensemble_simulation(
+        step, initial_states, lambda codes: codes, popcount, steps=steps,
+        burn_in=burn_in, seed=random_state, confidence=confidence)
+    states = [tuple(c) for c in
+              decode_configurations(result["keys"], N).tolist()]
+    return _stationary_from_report(result, states, report)
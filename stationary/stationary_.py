@@ -6,28 +6,40 @@ from __future__ import absolute_import
 
 from collections import Callable
 import itertools
+import warnings
 
+import numpy
 from numpy import log, exp
+from scipy.sparse import (
+    csr_matrix, diags, identity, issparse, tril, triu, vstack)
+from scipy.sparse.linalg import (
+    ArpackNoConvergence, eigs, splu, spsolve)
 
-from stationary.utils.edges import edges_to_edge_dict
+from stationary.utils.edges import edges_to_sparse_matrix
 from stationary.utils.graph import Graph
 from stationary.utils.math_helpers import (
-    simplex_generator, logsumexp, kl_divergence, kl_divergence_dict)
+    logsumexp, kl_divergence, kl_divergence_array,
+    kl_divergence_dict, interpolate_simplex, num_simplex_states,
+    simplex_ranks, simplex_states, simplex_unranks, log_kl_divergence_array,
+    logsumexp_array)
 
 
 def stationary_distribution(edges=None, exact=False, logspace=False,
                             initial_state=None, iterations=None, lim=1e-8,
-                            states=None):
+                            states=None, method=None, reversibility_tol=1e-8,
+                            omega=1., report=False):
     """
     Convenience function to route to different stationary distribution
     computations.
 
     Parameters
     ----------
-    edges: list of tuples or function
+    edges: list of tuples, function or sparse matrix
         The transitions of the process, either a list of (source, target,
         transition_probability), or an edge_function that takes two parameters,
-        the source and target states, to the transition transition probability.
+        the source and target states, to the transition transition probability,
+        or a scipy sparse transition matrix (e.g. built from the arrays of
+        incentive_process.multivariate_transitions_arrays).
         If using an edge_function you must supply the states of the process.
     exact: bool, False
         Try to use the exact formula. Only works for reversible processes (no
@@ -43,21 +55,167 @@ def stationary_distribution(edges=None, exact=False, logspace=False,
         A distribution over the states of the process. If None, the uniform
         distiribution is used.
     states: list, None
-        States for use with the edge_function.
+        States for use with the edge_function. For a sparse matrix, the states
+        corresponding to its rows (a list or an (S, n) array); if not given
+        the stationary distribution is returned as an array.
+    method: str, None
+        The computation to use: "approx" (iterated sparse matrix
+        multiplication), "exact" (the exact formula for reversible processes,
+        on a spanning tree of the simplex), "solve" (a sparse direct linear
+        solve, for any process), "eigen" (a Krylov eigenvector solver, for
+        state spaces too large to factor), "sor" (Gauss-Seidel / successive
+        over-relaxation sweeps in the lexicographic order of the states),
+        "birth_death" (the O(N) product formula for two-type birth-death
+        chains) or "auto". If None the method is "exact" if `exact` is True
+        and "auto" otherwise.
+        "auto" uses "exact" for processes on the simplex that pass the
+        detailed balance test of is_reversible, "birth_death" for
+        tridiagonal sparse matrices without states and "approx" otherwise.
+        Edge functions are tested by evaluating them once for every pair of
+        states, unless they cache row blocks or are built with low_memory
+        (e.g. by wright_fisher.multivariate_transitions), in which case they
+        use "approx", as they do with `exact` True.
+    reversibility_tol: float, 1e-8
+        Tolerance of the detailed balance test of the "auto" method
+    omega: float, 1.
+        The relaxation parameter of the "sor" method, see sor_stationary
+    report: bool, False
+        Also return a report with the method used and, for the "auto" method,
+        the outcome of the reversibility test
+
+    Returns
+    -------
+    dictionary (or array for a sparse matrix without states), the stationary
+    distribution, and if report is True a dictionary with the "method" used,
+    whether the process is "reversible" (None if not tested, e.g. if the
+    states are not those of a simplex) and its "detailed_balance_error"
+    """
+
+    if not method:
+        method = "exact" if exact else "auto"
+        if exact and not (isinstance(edges, list) or issparse(edges)):
+            # The exact formula has never been used for edge functions
+            method = "approx"
+    info = {"method": method, "reversible": None,
+            "detailed_balance_error": None}
+    if method == "auto":
+        info, edges, states = _choose_method(edges, states=states,
+                                             tol=reversibility_tol)
+        method = info["method"]
+
+    s = _route_stationary(
+        edges, method, logspace=logspace, initial_state=initial_state,
+        iterations=iterations, lim=lim, states=states, omega=omega)
+    if report:
+        return s, info
+    return s
+
+
+def _choose_method(edges, states=None, tol=1e-8):
+    """
+    Chooses the exact computation for reversible processes and the
+    approximate one otherwise, see stationary_distribution. Returns the
+    report, the transitions and the states to use (the sparse matrix of an
+    edge function that is reversible, indexed as a list of its states).
+    """
+
+    info = {"method": "approx", "reversible": None,
+            "detailed_balance_error": None}
+    if issparse(edges) and states is None:
+        matrix = edges.tocoo()
+        if _birth_death_log_ratios(matrix.row, matrix.col, matrix.data,
+                                   matrix.shape[0]) is not None:
+            info.update(method="birth_death", reversible=True)
+        return info, edges, states
+    matrix = edges
+    if not (isinstance(edges, list) or issparse(edges)):
+        # Cached row blocks (Wright-Fisher) are iterated directly, and the
+        # test would defeat the purpose of low memory edge functions
+        if (not states or getattr(edges, "blocks", None) or
+                getattr(edges, "low_memory", False)):
+            return info, edges, states
+        try:
+            _simplex_parameters(list(states))
+        except (TypeError, ValueError):
+            return info, edges, states
+        matrix_states = list(states)
+        matrix = _edge_func_matrix(edges, matrix_states)
+    else:
+        matrix_states = states
+    arrays = _simplex_rank_matrix(matrix, states=matrix_states)
+    if arrays is None:
+        # The test does not apply off the simplex
+        return info, edges, states
+    error = _simplex_balance_error(*arrays)
+    info["detailed_balance_error"] = error
+    info["reversible"] = bool(error <= tol)
+    if info["reversible"]:
+        info["method"] = "exact"
+        return info, matrix, matrix_states
+    return info, edges, states
+
+
+def _edge_func_matrix(edge_func, states):
     """
+    Evaluates edge_func once for every pair of states and returns the sparse
+    transition matrix indexed as the states.
+    """
+
+    rows, cols, values = [], [], []
+    for i, x in enumerate(states):
+        for j, y in enumerate(states):
+            v = edge_func(x, y)
+            if v > 0:
+                rows.append(i)
+                cols.append(j)
+                values.append(v)
+    n = len(states)
+    return csr_matrix((values, (rows, cols)), shape=(n, n))
+
+
+def _route_stationary(edges, method, logspace=False, initial_state=None,
+                      iterations=None, lim=1e-8, states=None, omega=1.):
+    """Computes the stationary distribution with the given method."""
 
     if isinstance(edges, list):
-        if not exact:
+        if method == "approx":
             return approx_stationary(
                 edges, logspace=logspace, iterations=iterations, lim=lim,
                 initial_state=initial_state)
+        elif method == "exact":
+            # The exact computation is always carried out in logspace and
+            # needs no initial state
+            return exact_stationary(edges)
+        elif method == "solve":
+            return solve_stationary(edges)
+        elif method == "eigen":
+            return eigen_stationary(
+                edges, initial_state=initial_state, iterations=iterations,
+                lim=lim)
+        elif method == "sor":
+            return sor_stationary(
+                edges, omega=omega, initial_state=initial_state,
+                iterations=iterations, lim=lim)
+        elif method == "birth_death":
+            return birth_death_stationary(edges)
+    elif issparse(edges):
+        if method == "exact":
+            ranks = tree_stationary(edges, states=states)
         else:
-            return exact_stationary(
-                edges, initial_state=initial_state, logspace=logspace)
-    elif isinstance(edges, Callable):
+            ranks = matrix_stationary(
+                edges, method=method, initial_state=initial_state,
+                iterations=iterations, lim=lim, omega=omega)
+        if states is None:
+            return ranks
+        if isinstance(states, numpy.ndarray):
+            states = [tuple(state) for state in states.tolist()]
+        return dict(zip(states, ranks))
+    elif isinstance(edges, Callable) and method in ["approx", "exact"]:
         if not states:
             raise ValueError(
                 "Keyword argument `states` required with edge_func")
+        if method == "exact":
+            return tree_stationary(edges, states=states)
         return approx_stationary_func(
             edges, states, iterations=iterations, lim=lim, logspace=logspace)
     # Still here?
@@ -149,11 +307,214 @@ def stationary_generator(cache, logspace=False, initial_state=None):
         yield exp_func(ranks)
 
 
+def sparse_stationary_generator(matrix, initial_state=None):
+    """
+    Generator for the stationary distribution of a Markov chain, produced by
+    iteration of a sparse transition matrix. Each step is a single sparse
+    matrix-vector product. The iterator yields successive approximations of
+    the stationary distribution.
+
+    Parameters
+    ----------
+    matrix: scipy.sparse matrix
+        The transpose of the transition matrix, so that matrix[i, j] is the
+        transition probability from state j to state i. CSR format is the most
+        efficient.
+    initial_state: None
+        A distribution over the states of the process. If None, the uniform
+        distribution is used.
+
+    Yields
+    ------
+    a numpy array of floats
+    """
+
+    N = matrix.shape[0]
+    if initial_state is None or len(initial_state) == 0:
+        ranks = numpy.ones(N) / N
+    else:
+        ranks = numpy.array(initial_state, dtype=float)
+
+    yield ranks
+    while True:
+        ranks = matrix.dot(ranks)
+        yield ranks
+
+
+def block_stationary_generator(blocks, initial_state=None):
+    """
+    Generator for the stationary distribution of a Markov chain, produced by
+    iteration of a dense transition matrix stored as a list of row blocks,
+    such as the cached Wright-Fisher transitions. The iterator yields
+    successive approximations of the stationary distribution.
+
+    Parameters
+    ----------
+    blocks: list of numpy arrays
+        Consecutive row blocks of the transition matrix, so that
+        blocks[k][i, j] is the transition probability from the i-th state of
+        the k-th block to state j
+    initial_state: None
+        A distribution over the states of the process. If None, the uniform
+        distribution is used.
+
+    Yields
+    ------
+    a numpy array of floats
+    """
+
+    N = blocks[0].shape[1]
+    if initial_state is None or len(initial_state) == 0:
+        ranks = numpy.ones(N) / N
+    else:
+        ranks = numpy.array(initial_state, dtype=float)
+
+    yield ranks
+    while True:
+        new_ranks = numpy.zeros(N)
+        start = 0
+        for block in blocks:
+            stop = start + len(block)
+            new_ranks += block.T.dot(ranks[start:stop].astype(block.dtype))
+            start = stop
+        ranks = new_ranks
+        yield ranks
+
+
+def log_sparse_matrix(rows, cols, log_values, n=None):
+    """
+    Arranges the log-transition probabilities of a Markov process in
+    compressed row order of the transposed transition matrix, i.e. grouped by
+    target state, for use with log_sparse_stationary_generator. Repeated
+    (source, target) pairs are kept as separate entries, so their
+    probabilities are effectively summed.
+
+    Parameters
+    ----------
+    rows, cols, log_values: numpy arrays
+        The source indices, target indices and log-transition probabilities,
+        e.g. from log_multivariate_transitions_arrays
+    n: int, None
+        The number of states, by default one more than the largest index
+
+    Returns
+    -------
+    log_weights, indices, indptr: numpy arrays
+        The log-transition probabilities and source indices sorted by target,
+        and the offsets of each target's entries
+    """
+
+    rows = numpy.asarray(rows)
+    cols = numpy.asarray(cols)
+    log_values = numpy.asarray(log_values, dtype=float)
+    if n is None:
+        n = int(max(rows.max(), cols.max())) + 1
+    order = numpy.argsort(cols, kind="stable")
+    indptr = numpy.zeros(n + 1, dtype=int)
+    indptr[1:] = numpy.cumsum(numpy.bincount(cols, minlength=n))
+    return log_values[order], rows[order], indptr
+
+
+def _log_matvec(log_weights, indices, indptr, log_ranks):
+    """
+    Computes the log of the sparse matrix-vector product of the transposed
+    transition matrix and exp(log_ranks) with segmented reductions: the
+    maximum of each target's terms is subtracted before exponentiating and
+    summing, so no underflow occurs. States with no in-edges get -inf.
+    """
+
+    terms = log_weights + log_ranks[indices]
+    new_ranks = numpy.full(len(indptr) - 1, -numpy.inf)
+    nonempty = numpy.flatnonzero(indptr[1:] > indptr[:-1])
+    if not len(nonempty):
+        return new_ranks
+    starts = indptr[nonempty]
+    m = numpy.maximum.reduceat(terms, starts)
+    m = numpy.where(numpy.isfinite(m), m, 0.)
+    lengths = indptr[nonempty + 1] - starts
+    shifted = numpy.exp(terms - numpy.repeat(m, lengths))
+    with numpy.errstate(divide='ignore'):
+        new_ranks[nonempty] = numpy.log(numpy.add.reduceat(shifted, starts)) + m
+    return new_ranks
+
+
+def log_sparse_stationary_generator(log_weights, indices, indptr,
+                                    initial_state=None):
+    """
+    Generator for the stationary distribution of a Markov chain in log-space,
+    produced by iteration of a sparse transition matrix of log-probabilities.
+    Each step is a single vectorized log-domain matrix-vector product. The
+    iterator yields successive approximations of the logarithm of the
+    stationary distribution.
+
+    Parameters
+    ----------
+    log_weights, indices, indptr: numpy arrays
+        The transposed transition matrix in log-space, as returned by
+        log_sparse_matrix
+    initial_state: None
+        The logarithm of a distribution over the states of the process. If
+        None, the uniform distribution is used.
+
+    Yields
+    ------
+    a numpy array of floats
+    """
+
+    N = len(indptr) - 1
+    if initial_state is None or len(initial_state) == 0:
+        log_ranks = numpy.full(N, -log(N))
+    else:
+        log_ranks = numpy.array(initial_state, dtype=float)
+
+    yield log_ranks
+    while True:
+        log_ranks = _log_matvec(log_weights, indices, indptr, log_ranks)
+        # Renormalize to keep rounding errors from accumulating
+        log_ranks -= logsumexp_array(log_ranks)
+        yield log_ranks
+
+
 ## Approximate stationary distributions computed by by sparse matrix
 # multiplications.
 
+def iterate_to_convergence(gen, iterations=None, lim=1e-8,
+                           divergence=kl_divergence):
+    """
+    Runs a stationary generator until successive iterations have a divergence
+    less than lim or the maximum number of iterations is reached, returning
+    the last approximation.
+
+    Parameters
+    ----------
+    gen: generator
+        Yields successive approximations of the stationary distribution
+    iterations: int, None
+        Maximum number of iterations
+    lim: float, 1e-8
+        The iteration stops when successive approximations have a divergence
+        less than lim
+    divergence: function, kl_divergence
+        The divergence between successive approximations, e.g.
+        kl_divergence_array for numpy arrays
+    """
+
+    previous_ranks = None
+    for i, ranks in enumerate(gen):
+        if i > 200:
+            if i % 10:
+                s = divergence(ranks, previous_ranks)
+                if s < lim:
+                    break
+        if iterations:
+            if i == iterations:
+                break
+        previous_ranks = ranks
+    return ranks
+
+
 def approx_stationary(edges, logspace=False, iterations=None, lim=1e-8,
-                      initial_state=None):
+                      initial_state=None, sparse=True):
     """
     Approximate stationary distributions computed by by sparse matrix
     multiplications. Produces correct results and uses little memory but is
@@ -161,6 +522,8 @@ def approx_stationary(edges, logspace=False, iterations=None, lim=1e-8,
     eigenvector calculator may be better).
 
     Essentially raises the transition probabilities matrix to a large power.
+    By default the edges are converted once to a compiled sparse (CSR) matrix
+    and each iteration is a single sparse matrix-vector product.
 
     Parameters
     -----------
@@ -177,35 +540,103 @@ def approx_stationary(edges, logspace=False, iterations=None, lim=1e-8,
     initial_state: None
         A distribution over the states of the process. If None, the uniform
         distribution is used.
-
+    sparse: bool, True
+        Use the compiled sparse matrix engine rather than the pure python
+        iteration over a Cache. With logspace, the iteration is a log-domain
+        sparse matrix-vector product and initial_state is a log-distribution.
     """
 
-    g = Graph()
-    g.add_edges(edges)
-    cache = Cache(g)
-    gen = stationary_generator(
-        cache, logspace=logspace, initial_state=initial_state)
-
-    previous_ranks = None
-    for i, ranks in enumerate(gen):
-        if i > 200:
-            if i % 10:
-                s = kl_divergence(ranks, previous_ranks)
-                if s < lim:
-                    break
-        if iterations:
-            if i == iterations:
-                break
-        previous_ranks = ranks
+    if sparse and logspace:
+        mat, enum, inv_enum = edges_to_sparse_matrix(edges)
+        mat = mat.T.tocsr()
+        with numpy.errstate(divide='ignore'):
+            log_weights = log(mat.data)
+        gen = log_sparse_stationary_generator(
+            log_weights, mat.indices, mat.indptr, initial_state=initial_state)
+        ranks = exp(iterate_to_convergence(
+            gen, iterations=iterations, lim=lim,
+            divergence=log_kl_divergence_array))
+    elif sparse:
+        mat, enum, inv_enum = edges_to_sparse_matrix(edges)
+        gen = sparse_stationary_generator(
+            mat.T.tocsr(), initial_state=initial_state)
+        ranks = iterate_to_convergence(
+            gen, iterations=iterations, lim=lim,
+            divergence=kl_divergence_array)
+    else:
+        g = Graph()
+        g.add_edges(edges)
+        cache = Cache(g)
+        inv_enum = cache.inv_enum
+        gen = stationary_generator(
+            cache, logspace=logspace, initial_state=initial_state)
+        ranks = iterate_to_convergence(
+            gen, iterations=iterations, lim=lim, divergence=kl_divergence)
 
     # Reverse the enumeration
     d = dict()
     for m, r in enumerate(ranks):
-        state = cache.inv_enum[m]
+        state = inv_enum[m]
         d[(state)] = r
     return d
 
 
+def log_approx_stationary(rows, cols, log_values, n=None, initial_state=None,
+                          iterations=None, lim=1e-8):
+    """
+    Approximate stationary distribution computed entirely in log-space from
+    the arrays of a sparse matrix of log-transition probabilities, such as
+    those returned by log_multivariate_transitions_arrays. Suitable for
+    processes whose transition probabilities underflow in linear space.
+
+    Parameters
+    -----------
+    rows, cols, log_values: numpy arrays
+        The source indices, target indices and log-transition probabilities
+    n: int, None
+        The number of states, by default one more than the largest index
+    initial_state: None
+        The logarithm of a distribution over the states of the process. If
+        None, the uniform distribution is used.
+    iterations: int, None
+        Maximum number of iterations
+    lim: float, 1e-8
+        Approximate algorithm breaks when successive iterations have a
+        kl_divergence less than lim
+
+    Returns
+    -------
+    numpy array, the logarithm of the stationary distribution indexed as
+    the states of rows and cols
+    """
+
+    log_weights, indices, indptr = log_sparse_matrix(
+        rows, cols, log_values, n=n)
+    gen = log_sparse_stationary_generator(
+        log_weights, indices, indptr, initial_state=initial_state)
+    return iterate_to_convergence(gen, iterations=iterations, lim=lim,
+                                  divergence=log_kl_divergence_array)
+
+
+def _log_sparse_matrix_func(edge_func, states):
+    """
+    Evaluates edge_func once for every pair of states and stores the nonzero
+    transition probabilities as log-weights grouped by target, in the format
+    of log_sparse_matrix.
+    """
+
+    log_weights, indices, indptr = [], [], [0]
+    for x in states:
+        for j, y in enumerate(states):
+            v = edge_func(y, x)
+            if v > 0:
+                log_weights.append(log(v))
+                indices.append(j)
+        indptr.append(len(indices))
+    return (numpy.array(log_weights, dtype=float),
+            numpy.array(indices, dtype=int), numpy.array(indptr, dtype=int))
+
+
 def approx_stationary_func(edge_func, states, iterations=100, lim=1e-8,
                            logspace=False):
     """
@@ -230,18 +661,33 @@ def approx_stationary_func(edge_func, states, iterations=100, lim=1e-8,
         Approximate algorithm breaks when successive iterations have a
         kl_divergence less than lim
     logspace: bool False
-        Carry out the calculation in logspace
+        Carry out the calculation in logspace. The transitions are evaluated
+        once and stored as sparse log-weights, trading memory for speed.
+
+    If edge_func caches its transition matrix as row blocks indexed by
+    simplex rank (the attribute `blocks`, e.g. from
+    wright_fisher.multivariate_transitions), the blocks are iterated directly
+    and states must be the states of the simplex.
     """
 
-    initial_state = [1./float(len(states))]*(len(states))
+    if not logspace and getattr(edge_func, "blocks", None):
+        indices = simplex_ranks(states)
+        gen = block_stationary_generator(edge_func.blocks)
+        ranks = iterate_to_convergence(
+            gen, iterations=iterations, lim=lim,
+            divergence=kl_divergence_array)
+        return dict(zip(states, ranks[indices]))
 
     if logspace:
-        sum_func = logsumexp
-        exp_func = exp
-        initial_state = log(initial_state)
-    else:
-        sum_func = sum
-        exp_func = lambda x: x
+        log_weights, indices, indptr = _log_sparse_matrix_func(
+            edge_func, states)
+        gen = log_sparse_stationary_generator(log_weights, indices, indptr)
+        ranks = iterate_to_convergence(
+            gen, iterations=iterations, lim=lim,
+            divergence=log_kl_divergence_array)
+        return dict(zip(states, exp(ranks)))
+
+    initial_state = [1./float(len(states))]*(len(states))
 
     ranks = dict(zip(states, initial_state))
     previous_ranks = None
@@ -259,27 +705,767 @@ def approx_stationary_func(edge_func, states, iterations=100, lim=1e-8,
             l = []
             for y in states:
                 v = edge_func(y,x)
-                if logspace:
-                    l.append(log(v) + ranks[y])
-                else:
-                    l.append(v * ranks[y])
-            new_ranks[x] = sum_func(l)
+                l.append(v * ranks[y])
+            new_ranks[x] = sum(l)
         previous_ranks = ranks
         ranks = new_ranks
 
+    return ranks
+
+
+## Stationary distributions computed by Gauss-Seidel / SOR sweeps
+
+# Maximum number of sweeps if none is given
+_MAX_SWEEPS = 10000
+
+
+def _sor_matrices(matrix, omega=1.):
+    """
+    Splits (I - P^T), where matrix is the transition matrix P, into the
+    triangular matrices of the SOR iteration
+    (D + omega L) s_{k+1} = ((1 - omega) D - omega U) s_k.
+    """
+
+    n = matrix.shape[0]
+    A = (identity(n, format='csr') - matrix.T).tocsr()
+    D = A.diagonal()
+    if numpy.any(D == 0):
+        raise ValueError(
+            "SOR requires that no state is absorbing (P[i, i] < 1).")
+    lower = (diags(D) + omega * tril(A, k=-1)).tocsr()
+    upper = ((1. - omega) * diags(D) - omega * triu(A, k=1)).tocsr()
+    return lower, upper
+
+
+def _sor_solver(lower):
+    """
+    Factors the lower triangular matrix of the SOR iteration once, without
+    pivoting (the factor is the matrix itself), so that each sweep is a
+    single compiled forward substitution without validation or conversion.
+    """
+
+    return splu(lower.tocsc(), permc_spec="NATURAL", diag_pivot_thresh=0.,
+                options={"SymmetricMode": True}).solve
+
+
+def _sor_sweep(solve, upper, ranks):
+    """A single SOR sweep, carried out as one sparse triangular solve."""
+
+    ranks = solve(upper.dot(ranks))
+    return ranks / numpy.sum(ranks)
+
+
+def _sor_sparse(matrix, omega=1., initial_state=None, iterations=None,
+                lim=1e-8):
+    """
+    Successive over-relaxation for (I - P^T) s = 0 where matrix is the
+    transition matrix P. Each sweep updates the states in order, using the
+    values already updated in the same sweep. Stops when the residual
+    |s P - s|_1 is less than lim, after the maximum number of sweeps
+    (_MAX_SWEEPS if iterations is None) or when the residual grows, i.e. the
+    iteration diverges, with a RuntimeWarning in the last two cases. Returns
+    the distribution, the number of sweeps, and the final residual.
+    """
+
+    n = matrix.shape[0]
+    P_T = matrix.T.tocsr()
+    lower, upper = _sor_matrices(matrix, omega=omega)
+    solve = _sor_solver(lower)
+    if not iterations:
+        iterations = _MAX_SWEEPS
+
+    if initial_state is None or len(initial_state) == 0:
+        ranks = numpy.ones(n) / n
+    else:
+        ranks = numpy.array(initial_state, dtype=float)
+
+    residual = float('inf')
+    for sweep in range(1, iterations + 1):
+        ranks = _sor_sweep(solve, upper, ranks)
+        last = sweep == iterations
+        # The residual costs as much as a sweep, so check every few sweeps
+        if sweep % 10 and sweep > 1 and not last:
+            continue
+        previous = residual
+        residual = float(numpy.sum(numpy.abs(P_T.dot(ranks) - ranks)))
+        if residual < lim:
+            break
+        if not residual <= previous:
+            # Diverging (e.g. over-relaxation of a non-reversible process)
+            break
+    if not residual < lim:
+        warnings.warn(
+            "SOR with omega %g did not converge after %d sweeps, the residual "
+            "%g is not less than lim %g." % (omega, sweep, residual, lim),
+            RuntimeWarning, stacklevel=3)
+    return ranks, sweep, residual
+
+
+def sor_stationary(edges, omega=1., initial_state=None, iterations=None,
+                   lim=1e-8, report=False):
+    """
+    Computes the stationary distribution with Gauss-Seidel (omega = 1) or
+    successive over-relaxation sweeps. States are swept in sorted order when
+    they are sortable, which is the order of simplex_generator for population
+    states, so for processes that move between adjacent states (like the
+    incentive process) probability is carried across the simplex in a single
+    sweep, rather than one step per iteration as for the approximate
+    algorithm.
+
+    A sweep costs about four sparse matrix-vector products (the triangular
+    solve, the upper triangular product and the residual every ten sweeps),
+    so although fewer sweeps are needed than iterations of the approximate
+    algorithm, Gauss-Seidel is usually slower. Mild over-relaxation (omega
+    about 1.2 to 1.4) reduces the number of sweeps for reversible processes,
+    but the iteration may diverge for non-reversible ones, such as
+    rock-paper-scissors landscapes, and for omega of 1.5 or more. A diverging
+    iteration stops as soon as the residual grows, with a RuntimeWarning.
+
+    Parameters
+    ----------
+    edges: list of tuples
+        Transition probabilities of the form [(source, target,
+        transition_probability
+    omega: float, 1.
+        The relaxation parameter, 0 < omega < 2. Gauss-Seidel for omega = 1.
+    initial_state: None
+        A distribution over the states of the process, either a list in the
+        order that states first appear in edges or a dictionary. If None, the
+        uniform distribution is used.
+    iterations: int, None
+        Maximum number of sweeps, _MAX_SWEEPS if None
+    lim: float, 1e-8
+        The algorithm stops when the residual |s P - s|_1 is less than lim
+    report: bool, False
+        Also return a convergence report
+
+    Returns
+    -------
+    dictionary, the stationary distribution, and if report is True a
+    dictionary with the number of sweeps, the residual and whether the
+    residual is less than lim.
+    """
+
+    mat, enum, inv_enum = edges_to_sparse_matrix(edges)
+    if isinstance(initial_state, dict):
+        initial_state = [initial_state[state] for state in inv_enum]
+
+    # Sweep in sorted (lexicographic) order if possible
+    try:
+        order = sorted(range(len(inv_enum)), key=lambda i: inv_enum[i])
+    except TypeError:
+        order = list(range(len(inv_enum)))
+    mat = mat[order][:, order]
+    if initial_state is not None and len(initial_state):
+        initial_state = numpy.array(initial_state, dtype=float)[order]
+
+    ranks, sweeps, residual = _sor_sparse(
+        mat, omega=omega, initial_state=initial_state, iterations=iterations,
+        lim=lim)
+
     d = dict()
-    for m, r in ranks.items():
-        d[m] = exp_func(r)
+    for m, r in zip(order, ranks):
+        d[inv_enum[m]] = r
+    if report:
+        return d, {"iterations": sweeps, "residual": residual,
+                   "converged": residual < lim}
     return d
 
 
-# Exact computations for reversible processes. Use at your own risk! No check
-# for reversibility is performed
+## Stationary distributions computed by a direct sparse linear solve
+
+def _solve_sparse(matrix):
+    """
+    Solves (P^T - I) s = 0 with sum(s) = 1 by a sparse LU factorization, where
+    matrix is the transition matrix P. The equation for the first state is
+    replaced by the normalization constraint.
+    """
+
+    n = matrix.shape[0]
+    A = (matrix.T - identity(n, format='csr')).tocsr()
+    A = vstack([csr_matrix(numpy.ones((1, n))), A[1:]], format='csc')
+    b = numpy.zeros(n)
+    b[0] = 1.
+    ranks = spsolve(A, b)
+    # Remove round-off negatives
+    ranks[ranks < 0] = 0.
+    return ranks / numpy.sum(ranks)
+
+
+def solve_stationary(edges):
+    """
+    Computes the stationary distribution by solving the singular linear system
+    (P^T - I) s = 0 together with the normalization constraint sum(s) = 1,
+    using a sparse direct factorization. Works for any irreducible process,
+    reversible or not, and the run time does not depend on how quickly the
+    process mixes (unlike the approximate algorithm).
+
+    Parameters
+    ----------
+    edges: list of tuples
+        Transition probabilities of the form [(source, target,
+        transition_probability
+
+    Returns
+    -------
+    dictionary, the stationary distribution
+    """
+
+    mat, enum, inv_enum = edges_to_sparse_matrix(edges)
+    ranks = _solve_sparse(mat)
+
+    d = dict()
+    for m, r in enumerate(ranks):
+        d[inv_enum[m]] = r
+    return d
+
+
+## Stationary distributions computed by an eigenvector solver
+
+def _eigen_sparse(matrix, initial_state=None, iterations=None, lim=1e-8,
+                  restarts=10):
+    """
+    Computes the left eigenvector of the transition matrix for the eigenvalue
+    1 with the implicitly restarted Arnoldi method (ARPACK), warm started from
+    initial_state. The solver is restarted from its latest estimate until the
+    residual |s P - s|_1 is less than lim, with a RuntimeWarning if it is not
+    after the given number of restarts.
+    """
+
+    n = matrix.shape[0]
+    A = matrix.T.tocsr()
+    if initial_state is None or len(initial_state) == 0:
+        ranks = numpy.ones(n) / n
+    else:
+        ranks = numpy.array(initial_state, dtype=float)
+
+    def to_distribution(vector):
+        # Fix the arbitrary phase of the eigenvector
+        vector = vector / vector[numpy.argmax(numpy.abs(vector))]
+        vector = numpy.real(vector)
+        vector[vector < 0] = 0.
+        return vector / numpy.sum(vector)
+
+    if n < 3:
+        # ARPACK needs at least three states
+        values, vectors = numpy.linalg.eig(A.toarray())
+        return to_distribution(vectors[:, numpy.argmax(numpy.real(values))])
+
+    residual = numpy.inf
+    for i in range(restarts):
+        try:
+            values, vectors = eigs(A, k=1, which='LR', v0=ranks, tol=lim,
+                                   maxiter=iterations)
+        except ArpackNoConvergence as e:
+            if not len(e.eigenvalues):
+                break
+            values, vectors = e.eigenvalues, e.eigenvectors
+        ranks = to_distribution(vectors[:, 0])
+        residual = numpy.sum(numpy.abs(A.dot(ranks) - ranks))
+        if residual < lim:
+            break
+    if not residual < lim:
+        warnings.warn(
+            "The eigensolver did not converge after %d restarts, the residual "
+            "%g is not less than lim %g." % (restarts, residual, lim),
+            RuntimeWarning, stacklevel=3)
+    return ranks
+
+
+def eigen_stationary(edges, initial_state=None, iterations=None, lim=1e-8):
+    """
+    Computes the stationary distribution as the dominant left eigenvector of
+    the sparse transition matrix with a Krylov (Arnoldi) eigensolver. Needs
+    far fewer matrix-vector products than iterating the transition matrix and
+    no factorization, so it is suited to very large state spaces.
+
+    Parameters
+    ----------
+    edges: list of tuples
+        Transition probabilities of the form [(source, target,
+        transition_probability
+    initial_state: None
+        A distribution over the states of the process, either a list in the
+        order that states first appear in edges or a dictionary, used as the
+        starting vector. E.g. the solution for nearby parameter values. If
+        None, the uniform distribution is used.
+    iterations: int, None
+        Maximum number of Arnoldi iterations per restart
+    lim: float, 1e-8
+        The algorithm stops when the residual |s P - s|_1 is less than lim. A
+        RuntimeWarning is issued if the solver gives up before that.
+
+    Returns
+    -------
+    dictionary, the stationary distribution
+    """
+
+    mat, enum, inv_enum = edges_to_sparse_matrix(edges)
+    if isinstance(initial_state, dict):
+        initial_state = [initial_state[state] for state in inv_enum]
+    ranks = _eigen_sparse(mat, initial_state=initial_state,
+                          iterations=iterations, lim=lim)
+
+    d = dict()
+    for m, r in enumerate(ranks):
+        d[inv_enum[m]] = r
+    return d
+
+
+## Multilevel stationary distributions, solved from coarse to fine
+# discretizations of the simplex.
+
+def _simplex_aggregation(states, N, M, coarse_states):
+    """
+    Maps each state of the simplex with divisor N to (the index in
+    coarse_states of) the state of the coarser simplex with divisor M whose
+    cell contains it, by flooring the scaled cumulative coordinates, which
+    keeps them ordered.
+    """
+
+    states = numpy.array(states)
+    d = states.shape[1] - 1
+    c = numpy.floor(numpy.cumsum(states[:, :-1], axis=1) * float(M) / N)
+    coarse = numpy.diff(c.astype(int), axis=1, prepend=0, append=M)
+    # Positions of the coarse states by simplex rank
+    lookup = numpy.zeros(num_simplex_states(M, d), dtype=int)
+    lookup[simplex_ranks(coarse_states)] = numpy.arange(len(coarse_states))
+    aggregation = lookup[simplex_ranks(coarse)]
+    # Drop empty cells
+    _, aggregation = numpy.unique(aggregation, return_inverse=True)
+    return aggregation
+
+
+# Maximum number of aggregation cycles per level if none is given
+_MAX_CYCLES = 200
+
+
+def _aggregation_cycles(matrix, aggregation, ranks, sweeps=3, omega=1.,
+                        iterations=None, lim=1e-8):
+    """
+    Two-level iterative aggregation / disaggregation. Each cycle smooths with
+    SOR sweeps, solves the aggregated (coarse) chain exactly and rescales the
+    states of each aggregate to the coarse solution. Stops when the residual
+    |s P - s|_1 is less than lim, after the maximum number of cycles
+    (_MAX_CYCLES if iterations is None) or when the residual grows. Returns
+    the distribution, the number of cycles and the final residual.
+    """
+
+    n = matrix.shape[0]
+    P_T = matrix.T.tocsr()
+    lower, upper = _sor_matrices(matrix, omega=omega)
+    solve = _sor_solver(lower)
+    R = csr_matrix((numpy.ones(n), (aggregation, numpy.arange(n))))
+    sizes = R.dot(numpy.ones(n))[aggregation]
+    if not iterations:
+        iterations = _MAX_CYCLES
+
+    residual = float('inf')
+    for cycle in range(1, iterations + 1):
+        for i in range(sweeps):
+            ranks = _sor_sweep(solve, upper, ranks)
+        # Distribution of each state within its aggregate
+        totals = R.dot(ranks)[aggregation]
+        weights = numpy.where(
+            totals > 0, ranks / numpy.where(totals > 0, totals, 1.),
+            1. / sizes)
+        coarse_matrix = R.dot(diags(weights).dot(matrix)).dot(R.T)
+        coarse_ranks = _solve_sparse(coarse_matrix.tocsr())
+        ranks = weights * coarse_ranks[aggregation]
+        previous = residual
+        residual = float(numpy.sum(numpy.abs(P_T.dot(ranks) - ranks)))
+        if residual < lim or not residual <= previous:
+            break
+    return ranks, cycle, residual
+
+
+def multilevel_stationary(edges_func, N, num_types=3, N_coarse=None,
+                          sweeps=3, omega=1., iterations=None, lim=1e-8,
+                          report=False):
+    """
+    Computes the stationary distribution of a process on the simplex from
+    coarse to fine discretizations. The process is first solved exactly for a
+    small population size. At each finer level (halving the simplex spacing
+    until N is reached) the previous solution is interpolated onto the finer
+    simplex as the initial state and then corrected by aggregation /
+    disaggregation cycles: SOR smoothing sweeps followed by an exact solve of
+    the chain aggregated onto the previous (coarser) simplex. The number of
+    cycles per level grows with N, faster for non-reversible processes, and
+    over-relaxed smoothing (omega > 1) may diverge for non-reversible
+    processes such as rock-paper-scissors landscapes. If the finest level
+    does not converge a RuntimeWarning is issued; the "solve" method of
+    stationary_distribution is then the better choice.
+
+    Parameters
+    ----------
+    edges_func: function
+        Returns the transitions of the process for a given population size,
+        e.g. lambda N: multivariate_transitions(N, incentive, mu=1./N)
+    N: int
+        Population size / simplex divisor of the target process
+    num_types: int, 3
+        Number of types in population
+    N_coarse: int, None
+        The smallest population size, by default N // 8
+    sweeps: int, 3
+        SOR sweeps per cycle
+    omega: float, 1.
+        The SOR relaxation parameter
+    iterations: int, None
+        Maximum number of cycles at each level, _MAX_CYCLES if None. A level
+        also stops when its residual grows.
+    lim: float, 1e-8
+        Each level stops when the residual |s P - s|_1 is less than lim
+    report: bool, False
+        Also return a report of the levels and cycles at each level
+
+    Returns
+    -------
+    dictionary, the stationary distribution, and if report is True a
+    dictionary with the list of population sizes ("levels"), the cycles
+    ("iterations") and final residuals ("residuals") per level and whether
+    the finest level "converged".
+    """
+
+    if not N_coarse:
+        N_coarse = max(N // 8, 1)
+    levels = [N]
+    while levels[-1] // 2 >= N_coarse:
+        levels.append(levels[-1] // 2)
+    levels.reverse()
+
+    # Solve the coarsest level exactly
+    mat, enum, inv_enum = edges_to_sparse_matrix(edges_func(levels[0]))
+    ranks = _solve_sparse(mat)
+    level_cycles = [0]
+    residuals = [0.]
+
+    for M, level in zip(levels, levels[1:]):
+        d = interpolate_simplex(dict(zip(inv_enum, ranks)), level,
+                                num_types=num_types)
+        coarse_states = inv_enum
+        mat, enum, inv_enum = edges_to_sparse_matrix(edges_func(level))
+        ranks = numpy.array([d[state] for state in inv_enum])
+        ranks /= numpy.sum(ranks)
+        aggregation = _simplex_aggregation(inv_enum, level, M, coarse_states)
+        # Intermediate levels only need to be as accurate as interpolation
+        level_lim = lim if level == N else numpy.sqrt(lim)
+        ranks, cycles, residual = _aggregation_cycles(
+            mat, aggregation, ranks, sweeps=sweeps, omega=omega,
+            iterations=iterations, lim=level_lim)
+        level_cycles.append(cycles)
+        residuals.append(residual)
+
+    converged = residuals[-1] < lim
+    if not converged:
+        warnings.warn(
+            "The multilevel solver did not converge after %d cycles, the "
+            "residual %g is not less than lim %g." % (
+                level_cycles[-1], residuals[-1], lim),
+            RuntimeWarning, stacklevel=2)
+    d = dict(zip(inv_enum, ranks))
+    if report:
+        return d, {"levels": levels, "iterations": level_cycles,
+                   "residuals": residuals, "converged": converged}
+    return d
+
+
+def matrix_stationary(matrix, method="approx", initial_state=None,
+                      iterations=None, lim=1e-8, omega=1.):
+    """
+    Computes the stationary distribution of a process given by a sparse
+    transition matrix.
+
+    Parameters
+    ----------
+    matrix: scipy sparse matrix
+        The transition matrix, matrix[i, j] is the transition probability
+        from state i to state j
+    method: str, "approx"
+        One of "approx", "solve", "eigen", "sor" or "birth_death", see
+        stationary_distribution.
+        For "sor" states are swept in the order of the rows.
+    initial_state: None
+        A distribution over the states of the process. If None, the uniform
+        distribution is used.
+    iterations: int, None
+        Maximum number of iterations
+    lim: float, 1e-8
+        Convergence threshold of the iterative methods
+    omega: float, 1.
+        The relaxation parameter of the "sor" method
+
+    Returns
+    -------
+    numpy array, the stationary distribution
+    """
+
+    matrix = csr_matrix(matrix)
+    if method == "approx":
+        gen = sparse_stationary_generator(
+            matrix.T.tocsr(), initial_state=initial_state)
+        return iterate_to_convergence(
+            gen, iterations=iterations, lim=lim,
+            divergence=kl_divergence_array)
+    elif method == "solve":
+        return _solve_sparse(matrix)
+    elif method == "eigen":
+        return _eigen_sparse(matrix, initial_state=initial_state,
+                             iterations=iterations, lim=lim)
+    elif method == "sor":
+        return _sor_sparse(matrix, omega=omega, initial_state=initial_state,
+                           iterations=iterations, lim=lim)[0]
+    elif method == "birth_death":
+        return birth_death_stationary(matrix)
+    raise ValueError("Method %s not implemented for matrices" % method)
+
+
+## Stationary distributions of birth-death chains
+
+def _birth_death_log_ratios(rows, cols, values, n):
+    """
+    Returns log(P(i, i+1) / P(i+1, i)) for i = 0, ..., n - 2 if the transition
+    matrix given by its nonzero entries is tridiagonal (a birth-death chain)
+    with all rates to neighboring states positive, and None otherwise.
+    """
+
+    rows = numpy.asarray(rows)
+    cols = numpy.asarray(cols)
+    values = numpy.asarray(values, dtype=float)
+    nonzero = values > 0
+    rows, cols, values = rows[nonzero], cols[nonzero], values[nonzero]
+    if n < 2 or numpy.any(numpy.abs(rows - cols) > 1):
+        return None
+    up = numpy.bincount(rows, weights=numpy.where(cols == rows + 1, values, 0),
+                        minlength=n)[:-1]
+    down = numpy.bincount(cols, weights=numpy.where(cols == rows - 1, values,
+                                                    0), minlength=n)[:-1]
+    if numpy.any(up <= 0) or numpy.any(down <= 0):
+        return None
+    return log(up) - log(down)
+
+
+def _birth_death_edges(edges):
+    """
+    Maps a list of edges of a two-type process to the rows, columns and
+    values of its transition matrix, indexing the state (i, N - i) by i.
+    Returns None if the states are not those of a two-type population of a
+    fixed size.
+    """
+
+    sources = numpy.array([source for source, _, _ in edges])
+    targets = numpy.array([target for _, target, _ in edges])
+    if (sources.ndim != 2 or sources.shape[1] != 2 or
+            targets.shape != sources.shape):
+        return None
+    N = sources[0].sum()
+    if numpy.any(sources.sum(axis=1) != N) or \
+            numpy.any(targets.sum(axis=1) != N):
+        return None
+    values = numpy.array([v for _, _, v in edges], dtype=float)
+    return int(N), sources[:, 0], targets[:, 0], values
+
+
+def birth_death_stationary(edges, states=None):
+    """
+    Computes the stationary distribution of a birth-death chain, such as the
+    two-type incentive and Moran processes, from the product of the ratios of
+    its birth and death rates, in one cumulative sum in log-space. This takes
+    O(N) time and is exact up to round-off.
+
+    Parameters
+    ----------
+    edges: list of tuples or sparse matrix
+        The transitions of a two-type process on the states (i, N - i), or a
+        tridiagonal sparse transition matrix (in the order of its rows).
+    states: list, None
+        The states corresponding to the rows of a sparse matrix. If not given
+        the stationary distribution of a sparse matrix is returned as an
+        array.
+
+    Returns
+    -------
+    dictionary (or array for a sparse matrix), the stationary distribution
+
+    Raises
+    ------
+    ValueError if the process is not an irreducible birth-death chain
+    """
+
+    if issparse(edges):
+        matrix = edges.tocoo()
+        n = matrix.shape[0]
+        log_ratios = _birth_death_log_ratios(
+            matrix.row, matrix.col, matrix.data, n)
+    else:
+        arrays = _birth_death_edges(edges)
+        log_ratios = None
+        if arrays is not None:
+            N, rows, cols, values = arrays
+            n = N + 1
+            log_ratios = _birth_death_log_ratios(rows, cols, values, n)
+    if log_ratios is None:
+        raise ValueError("The process is not an irreducible birth-death chain")
+
+    log_ranks = numpy.concatenate([[0.], numpy.cumsum(log_ratios)])
+    ranks = exp(log_ranks - logsumexp_array(log_ranks))
+    if issparse(edges):
+        if states is None:
+            return ranks
+        if isinstance(states, numpy.ndarray):
+            states = [tuple(state) for state in states.tolist()]
+        return dict(zip(states, ranks))
+    return dict(((i, N - i), r) for i, r in enumerate(ranks))
+
+
+# Exact computations for reversible processes. No check for reversibility is
+# performed, see is_reversible.
+
+def _simplex_tree(N, d=2):
+    """
+    A spanning tree of the simplex rooted at (0, ..., 0, N). The parent of a
+    state x is x - e_k + e_d for the first k < d with x_k > 0, which precedes
+    x in the order of simplex_generator. Returns the states of the simplex,
+    the ranks of their parents (-1 for the root) and their depths N - x_d.
+    """
+
+    states = simplex_states(N, d)
+    depths = N - states[:, d]
+    parents = numpy.full(len(states), -1, dtype=numpy.int64)
+    inner = depths > 0
+    if numpy.any(inner):
+        parent_states = states[inner]
+        k = numpy.argmax(parent_states[:, :d] > 0, axis=1)
+        parent_states[numpy.arange(len(parent_states)), k] -= 1
+        parent_states[:, d] += 1
+        parents[inner] = simplex_ranks(parent_states)
+    return states, parents, depths
+
+
+def _tree_log_weights(parents, depths, log_ratios):
+    """
+    Sums the log ratios along the paths from the root of the tree, one depth
+    at a time.
+    """
+
+    order = numpy.argsort(depths, kind='stable')
+    bounds = numpy.searchsorted(depths[order], numpy.arange(depths.max() + 2))
+    log_weights = numpy.zeros(len(parents))
+    for depth in range(1, len(bounds) - 1):
+        indices = order[bounds[depth]: bounds[depth + 1]]
+        log_weights[indices] = log_weights[parents[indices]] + \
+            log_ratios[indices]
+    return log_weights
+
+
+def _tree_log_potentials(transitions, N, d):
+    """
+    The unnormalized log stationary distribution of a reversible process on
+    the simplex, in the order of simplex_generator, from the transitions
+    transitions(sources, targets) between states given by their ranks.
+    """
+
+    _, parents, depths = _simplex_tree(N, d)
+    inner = numpy.flatnonzero(parents >= 0)
+    forward = transitions(parents[inner], inner)
+    backward = transitions(inner, parents[inner])
+    if numpy.any(forward <= 0) or numpy.any(backward <= 0):
+        raise ValueError("Zero transition between neighboring states")
+    log_ratios = numpy.zeros(len(parents))
+    log_ratios[inner] = log(forward) - log(backward)
+    return _tree_log_weights(parents, depths, log_ratios)
+
+
+def _simplex_parameters(states):
+    """The simplex size N and dimension d of an array of states."""
+
+    states = numpy.asarray(states)
+    if states.ndim != 2 or states.dtype.kind not in 'iu':
+        raise ValueError("States must be integer tuples of a common length")
+    sums = states.sum(axis=1)
+    if numpy.any(sums != sums[0]) or numpy.any(states < 0):
+        raise ValueError("States must lie on a common simplex")
+    return int(sums[0]), states.shape[1] - 1
+
+
+def tree_stationary(edges, states=None):
+    """
+    Computes the stationary distribution of a reversible process on the
+    simplex exactly from the ratios of the transition probabilities along a
+    spanning tree of the simplex. Each state's weight is derived from its
+    parent's, so only 2S transition probabilities are needed and the
+    computation is a single pass in log-space. No check for reversibility.
+
+    Parameters
+    ----------
+    edges: list of tuples, function or sparse matrix
+        The transitions of the process, either a list of (source, target,
+        transition_probability), an edge_function that takes two parameters,
+        the source and target states, to the transition transition probability,
+        or a sparse transition matrix. The states must be all the states of a
+        simplex discretization.
+    states: list or array, None
+        The states of the process, required with an edge_function or a sparse
+        matrix (in the order of its rows)
+
+    Returns
+    -------
+    dictionary (or array indexed as a sparse matrix), the stationary
+    distribution
+
+    Raises
+    ------
+    ValueError if a transition along the tree is zero or the states are not
+    those of a simplex
+    """
+
+    if isinstance(edges, list):
+        N, d = _simplex_parameters([edges[0][0]])
+        simplex = [tuple(state) for state in simplex_states(N, d).tolist()]
+        edge_dict = dict(((a, b), v) for a, b, v in edges)
+        transitions = lambda a, b: numpy.array([
+            edge_dict.get((simplex[i], simplex[j]), 0.)
+            for i, j in zip(a, b)], dtype=float)
+    else:
+        if states is None or not len(states):
+            raise ValueError("Keyword argument `states` required with "
+                             "edge_func or a sparse matrix")
+        N, d = _simplex_parameters(states)
+        indices = simplex_ranks(states)
+        S = num_simplex_states(N, d)
+        if len(numpy.unique(indices)) != S:
+            raise ValueError("States must be all the states of the simplex")
+        if issparse(edges):
+            matrix = csr_matrix(edges)
+            positions = numpy.empty(S, dtype=numpy.int64)
+            positions[indices] = numpy.arange(S)
+            transitions = lambda a, b: numpy.asarray(
+                matrix[positions[a], positions[b]]).ravel()
+        elif isinstance(edges, Callable):
+            transitions = lambda a, b: numpy.array([
+                edges(tuple(x), tuple(y)) for x, y in
+                zip(simplex_unranks(a, N, d).tolist(),
+                    simplex_unranks(b, N, d).tolist())], dtype=float)
+        else:
+            raise ValueError("Unsupported transitions %r" % (edges,))
+
+    log_weights = _tree_log_potentials(transitions, N, d)
+    ranks = exp(log_weights - logsumexp_array(log_weights))
+
+    if isinstance(edges, list):
+        return dict(zip(simplex, ranks))
+    if issparse(edges):
+        return ranks[indices]
+    if isinstance(states, numpy.ndarray):
+        states = [tuple(state) for state in states.tolist()]
+    return dict(zip(states, ranks[indices]))
+
 
 def exact_stationary(edges, initial_state=None, logspace=False):
     """
     Computes the stationary distribution of a reversible process on the simplex
-    exactly. No check for reversibility.
+    exactly with tree_stationary, or birth_death_stationary for two-type
+    birth-death chains. No check for reversibility.
 
     Parameters
     ----------
@@ -287,66 +1473,155 @@ def exact_stationary(edges, initial_state=None, logspace=False):
     edges: list or dictionary
         The edges or edge_dict of the process
     initial_state: tuple, None
-        The initial state. If not given a suitable state is created.
+        Deprecated and ignored, the distribution does not depend on the state
+        it is computed from
     logspace: bool False
-        Carry out the calculation in logspace
+        Deprecated and ignored, the calculation is always carried out in
+        logspace
 
     returns
     -------
     dictionary, the stationary distribution
     """
 
-    # Convert edges to edge_dict if necessary
-    if isinstance(edges, list):
-        edges = edges_to_edge_dict(edges)
-    # Compute population parameters from the edge_dict
-    state = list(edges)[0][0]
-    N = sum(state)
-    num_players = len(state)
-    # Get an initial state
-    if not initial_state:
-        initial_state = [N // num_players]* num_players
-        initial_state[-1] = N - (num_players -1 ) * (N // num_players)
-    initial_state = tuple(initial_state)
-
-    # Use the exact form of the stationary distribution.
-    d = dict()
-    for state in simplex_generator(N, num_players - 1):
-        # Take a path from initial to state.
-        seq = [initial_state]
-        e = list(seq[-1])
-        for i in range(0, num_players):
-            while e[i] < state[i]:
-                for j in range(0, num_players):
-                    if e[j] > state[j]:
-                        break
-                e[j] = e[j] - 1
-                e[i] = e[i] + 1
-                seq.append(tuple(e))
-            while e[i] > state[i]:
-                for j in range(0, num_players):
-                    if e[j] < state[j]:
-                        break
-                e[j] = e[j] + 1
-                e[i] = e[i] - 1
-                seq.append(tuple(e))
-        if logspace:
-            s = 0.
-        else:
-            s = 1.
-        for index in range(len(seq)-1):
-            e, f = seq[index], seq[index+1]
-            if logspace:
-                s += log(edges[(e, f)]) - log(edges[(f, e)])
-            else:
-                s *= edges[(e, f)] / edges[(f, e)]
-        d[state] = s
+    if initial_state is not None:
+        warnings.warn("exact_stationary ignores initial_state",
+                      DeprecationWarning, stacklevel=2)
     if logspace:
-        s0 = logsumexp([v for v in d.values()])
-        for key, v in d.items():
-            d[key] = exp(v - s0)
-    else:
-        s0 = 1. / sum([v for v in d.values()])
-        for key, v in d.items():
-            d[key] = s0 * v
-    return d
+        warnings.warn("exact_stationary always computes in logspace, the "
+                      "logspace argument is ignored", DeprecationWarning,
+                      stacklevel=2)
+    if not isinstance(edges, list):
+        edges = [(a, b, v) for (a, b), v in edges.items()]
+    # Two-type processes are birth-death chains
+    if len(edges[0][0]) == 2:
+        try:
+            return birth_death_stationary(edges)
+        except ValueError:
+            pass
+    return tree_stationary(edges)
+
+
+## Reversibility
+
+def _simplex_rank_matrix(edges, states=None):
+    """
+    The transition matrix of a process on all the states of a simplex in the
+    order of simplex_generator, with N and d. Returns None if the states are
+    not those of a simplex.
+    """
+
+    try:
+        if isinstance(edges, list):
+            sources = numpy.array([source for source, _, _ in edges])
+            targets = numpy.array([target for _, target, _ in edges])
+            values = numpy.array([v for _, _, v in edges], dtype=float)
+        else:
+            if states is None:
+                return None
+            matrix = edges.tocoo()
+            states = numpy.asarray(states)
+            sources, targets, values = \
+                states[matrix.row], states[matrix.col], matrix.data
+        N, d = _simplex_parameters(sources)
+        if _simplex_parameters(targets)[0] != N:
+            return None
+    except (TypeError, ValueError):
+        return None
+    rows = simplex_ranks(sources)
+    cols = simplex_ranks(targets)
+    S = num_simplex_states(N, d)
+    if len(numpy.unique(rows)) != S:
+        return None
+    return csr_matrix((values, (rows, cols)), shape=(S, S)), N, d
+
+
+def _detailed_balance_error(matrix, log_weights):
+    """
+    The largest difference of log(s_i P_ij) and log(s_j P_ji) over the
+    transitions of the matrix, or inf if a transition has no reverse.
+    """
+
+    forward = csr_matrix(matrix, copy=True)
+    forward.sum_duplicates()
+    forward.eliminate_zeros()
+    forward.sort_indices()
+    backward = forward.T.tocsr()
+    backward.sort_indices()
+    if not (numpy.array_equal(forward.indptr, backward.indptr) and
+            numpy.array_equal(forward.indices, backward.indices)):
+        return float('inf')
+    if not forward.nnz:
+        return 0.
+    rows = numpy.repeat(numpy.arange(forward.shape[0]),
+                        numpy.diff(forward.indptr))
+    flux = log_weights[rows] + log(forward.data)
+    reverse_flux = log_weights[forward.indices] + log(backward.data)
+    return float(numpy.max(numpy.abs(flux - reverse_flux)))
+
+
+def _simplex_balance_error(matrix, N, d):
+    """
+    The detailed_balance_error of a transition matrix indexed by simplex
+    rank, from _simplex_rank_matrix.
+    """
+
+    transitions = lambda a, b: numpy.asarray(matrix[a, b]).ravel()
+    try:
+        log_weights = _tree_log_potentials(transitions, N, d)
+    except ValueError:
+        return float('inf')
+    return _detailed_balance_error(matrix, log_weights)
+
+
+def detailed_balance_error(edges, states=None):
+    """
+    Tests the detailed balance condition s_i P_ij = s_j P_ji of a process on
+    the simplex for all transitions at once, with the potential s computed
+    on a spanning tree of the simplex (see tree_stationary). The process is
+    reversible if and only if the error vanishes, which is equivalent to
+    Kolmogorov's criterion: the ratio products around every cycle of the
+    simplex are equal to one.
+
+    Parameters
+    ----------
+    edges: list of tuples or sparse matrix
+        The transitions of the process, a list of (source, target,
+        transition_probability) or a sparse transition matrix
+    states: list or array, None
+        The states corresponding to the rows of a sparse matrix
+
+    Returns
+    -------
+    float, the largest absolute difference of log(s_i P_ij) and
+    log(s_j P_ji), or inf if the process is not on a simplex, some transition
+    has no reverse or the spanning tree does not connect the simplex
+    """
+
+    arrays = _simplex_rank_matrix(edges, states=states)
+    if arrays is None:
+        return float('inf')
+    return _simplex_balance_error(*arrays)
+
+
+def is_reversible(edges, states=None, tol=1e-8):
+    """
+    Tests if a process on the simplex is reversible, that is, if the
+    detailed_balance_error is at most tol.
+
+    Parameters
+    ----------
+    edges: list of tuples or sparse matrix
+        The transitions of the process, a list of (source, target,
+        transition_probability) or a sparse transition matrix
+    states: list or array, None
+        The states corresponding to the rows of a sparse matrix
+    tol: float, 1e-8
+        Tolerance for the differences of the log probability fluxes
+
+    Returns
+    -------
+    bool
+    """
+
+    return detailed_balance_error(edges, states=states) <= tol
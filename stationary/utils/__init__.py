@@ -1,4 +1,5 @@
 from . import bomze
+from . import disk_cache
 from . import edges
 from . import extrema
 from . import graph
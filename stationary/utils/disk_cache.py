@@ -0,0 +1,218 @@
+"""
+A persistent on-disk cache of generated transition matrices, stored as
+memory-mappable .npy files keyed by a hash of the parameters that produced
+them, with least-recently-used eviction by total size.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy
+
+
+def _canonical(value):
+    """
+    Converts parameters to a canonical form whose repr is stable across runs,
+    e.g. numpy arrays to nested lists and dictionaries to sorted items.
+    """
+
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, numpy.ndarray):
+        return _canonical(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if callable(value):
+        raise ValueError(
+            "Functions cannot be hashed, describe them in the cache_key "
+            "instead (e.g. the game matrix, incentive name, beta and q).")
+    return value
+
+
+def hash_parameters(**parameters):
+    """
+    A hexadecimal digest identifying a set of parameters, e.g.
+    hash_parameters(process="wright_fisher", N=40, mu=0.01,
+    game_matrix=[[1, 2], [2, 1]], incentive="fermi", beta=1.).
+    """
+
+    return hashlib.sha1(repr(_canonical(parameters)).encode()).hexdigest()
+
+
+class DiskCache(object):
+    """
+    Content-addressed cache of named numpy arrays on disk. Each entry is a
+    directory of .npy files named by the hash of its parameters, which are
+    loaded memory-mapped. Entries are evicted least recently used first once
+    the cache exceeds max_bytes.
+
+    Parameters
+    ----------
+    directory: string
+        Where to store the cache, created if needed
+    max_bytes: int, None
+        The maximum total size of the cache. If None the cache is unbounded.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._path(key))
+
+    def get(self, key):
+        """
+        Loads the arrays of an entry memory-mapped, or returns None if the
+        entry is not cached. Marks the entry as recently used.
+        """
+
+        path = self._path(key)
+        if not os.path.isdir(path):
+            return None
+        arrays = dict()
+        for filename in os.listdir(path):
+            name, extension = os.path.splitext(filename)
+            if extension == ".npy":
+                arrays[name] = numpy.load(os.path.join(path, filename),
+                                          mmap_mode='r')
+        os.utime(path, None)
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Stores a dictionary of named arrays under key, then evicts the least
+        recently used entries if the cache is too large.
+        """
+
+        path = self._path(key)
+        # Write to a temporary directory and rename it, so that readers never
+        # see partial entries
+        temp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        for name, values in arrays.items():
+            numpy.save(os.path.join(temp, name + ".npy"),
+                       numpy.asarray(values))
+        try:
+            os.rename(temp, path)
+        except OSError:
+            # Stored concurrently by someone else
+            shutil.rmtree(temp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        The cached entries as a list of (last use time, size in bytes, key),
+        least recently used first.
+        """
+
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, filename))
+                       for filename in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, key))
+        return sorted(entries)
+
+    def size(self):
+        """The total size of the cached entries in bytes."""
+
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Removes least recently used entries until the total size is at most
+        max_bytes. The most recently used entry is always kept.
+        """
+
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Removes all the entries."""
+
+        for _, _, key in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+
+def get_cache(cache):
+    """A DiskCache from either a DiskCache or a directory name."""
+
+    if isinstance(cache, DiskCache):
+        return cache
+    return DiskCache(cache)
+
+
+def cached_arrays(cache, cache_key, build, **parameters):
+    """
+    Loads the arrays for the given parameters from the cache, or builds them
+    with build() and stores them.
+
+    Parameters
+    ----------
+    cache: DiskCache or string
+        The cache or its directory
+    cache_key: dict
+        Parameters identifying the inputs that cannot be hashed directly,
+        such as the game matrix and incentive (e.g. {"game_matrix": m,
+        "incentive": "fermi", "beta": 1.})
+    build: function
+        Computes a dictionary of named arrays
+    parameters:
+        The remaining parameters of the builder
+
+    Returns
+    -------
+    dictionary of (possibly memory-mapped) numpy arrays
+    """
+
+    if cache_key is None:
+        raise ValueError(
+            "Keyword argument `cache_key` required with cache, describing the "
+            "incentive or fitness landscape.")
+    cache = get_cache(cache)
+    key = hash_parameters(cache_key=cache_key, **parameters)
+    arrays = cache.get(key)
+    if arrays is None:
+        arrays = build()
+        cache.put(key, arrays)
+    return arrays
+
+
+def edges_to_arrays(edges):
+    """
+    Converts a list of edges between tuple states to arrays for caching.
+    """
+
+    sources = numpy.array([source for source, _, _ in edges])
+    targets = numpy.array([target for _, target, _ in edges])
+    values = numpy.array([value for _, _, value in edges], dtype=float)
+    return {"sources": sources, "targets": targets, "values": values}
+
+
+def arrays_to_edges(arrays):
+    """
+    Converts cached arrays back to a list of edges between tuple states.
+    """
+
+    sources = map(tuple, numpy.asarray(arrays["sources"]).tolist())
+    targets = map(tuple, numpy.asarray(arrays["targets"]).tolist())
+    values = numpy.asarray(arrays["values"]).tolist()
+    return list(zip(sources, targets, values))
@@ -1,5 +1,6 @@
-from numpy import zeros
+from numpy import array, zeros
 from numpy.linalg import matrix_power
+from scipy.sparse import csr_matrix
 
 
 def states_from_edges(edges):
@@ -116,6 +117,49 @@ def edges_to_matrix(edges):
     return mat, all_states, enumeration
 
 
+def edges_to_sparse_matrix(edges):
+    """
+    Converts a list of edges to a sparse (CSR) transition matrix by enumerating
+    the states. States are enumerated in the order in which they first appear
+    as the source of an edge, followed by any states that only appear as
+    targets. Repeated edges are summed.
+
+    Parameters
+    ----------
+    edges: list of tuples
+        Transition probabilities of the form [(source, target, transition
+        probability
+
+    Returns
+    -------
+    mat, scipy.sparse.csr_matrix
+        The transition matrix, mat[i, j] is the transition probability from
+        state i to state j
+    enum, dict
+        A dictionary mapping states to integers
+    inv_enum, list
+        A list mapping integers to states
+    """
+
+    enum = dict()
+    inv_enum = []
+    for (source, target, weight) in edges:
+        if source not in enum:
+            enum[source] = len(inv_enum)
+            inv_enum.append(source)
+    for (source, target, weight) in edges:
+        if target not in enum:
+            enum[target] = len(inv_enum)
+            inv_enum.append(target)
+
+    rows = array([enum[source] for (source, _, _) in edges], dtype=int)
+    cols = array([enum[target] for (_, target, _) in edges], dtype=int)
+    values = array([weight for (_, _, weight) in edges], dtype=float)
+    n = len(inv_enum)
+    mat = csr_matrix((values, (rows, cols)), shape=(n, n))
+    return mat, enum, inv_enum
+
+
 def edges_to_edge_dict(edges):
     """
     Converts a list of edges to a transition dictionary taking (source, target)
@@ -1,56 +1,114 @@
-from collections import defaultdict, Callable
+from collections import Callable
 
 import numpy
+from scipy.sparse import issparse
 
-from .math_helpers import normalize, q_divergence
+from .edges import edges_to_sparse_matrix
+from .math_helpers import q_divergence_array, simplex_ranks
 
 
-def expected_divergence(edges, states=None, q_d=1, boundary=True):
+def sparse_expected_divergence(matrix, states, q_d=1, boundary=True):
+    """
+    Computes the divergence of the expected next state with the state for
+    all states at once, from a sparse transition matrix. The expected next
+    states are the single product of the matrix with the array of states.
+
+    Parameters
+    ----------
+    matrix: scipy.sparse matrix
+        The transition matrix, matrix[i, j] the transition probability from
+        state i to state j
+    states: array of shape (S, n)
+        The states indexed as the matrix
+    q_d: float, 1
+        parameter that specifies which divergence function to use
+    boundary: bool, True
+        Include the boundary states. If False their divergences are NaN.
+
+    Returns
+    -------
+    numpy array of length S, D(E(state), state)
+    """
+
+    states = numpy.asarray(states, dtype=float)
+    return _divergences(matrix.dot(states), states, q_d, boundary)
+
+
+def _divergences(expected, states, q_d, boundary):
+    """
+    The q-divergences of the normalized expected next states and states,
+    NaN on the boundary if boundary is False.
+    """
+
+    x = expected / expected.sum(axis=1)[:, numpy.newaxis]
+    y = states / states.sum(axis=1)[:, numpy.newaxis]
+    d = q_divergence_array(q_d, x, y)
+    if not boundary:
+        # Some divergences do not play well on the boundary
+        d[numpy.any(states == 0, axis=1)] = float('nan')
+    return d
+
+
+def expected_divergence(edges, states=None, q_d=1, boundary=True,
+                        block_size=256):
     """
     Computes the KL-div of the expected state with the state, for all states.
 
     Parameters
     ----------
-    edges: list of tuples or function
+    edges: list of tuples, function or sparse matrix
         The transitions of the process, either a list of (source, target,
         transition_probability), or an edge_function that takes two parameters,
         the source and target states, to the transition transition probability.
-        If using an edge_function you must supply the states of the process.
+        If using an edge_function or a sparse transition matrix you must
+        supply the states of the process.
     q_d: float, 1
         parameter that specifies which divergence function to use
     states: list, None
-        States for use with the edge_func
+        States for use with the edge_func, or indexing the sparse matrix
     boundary: bool, False
         Exclude the boundary states
+    block_size: int, 256
+        The number of source states whose transitions are evaluated at once
+        with an edge_func
 
     Returns
     -------
-    Dictionary mapping states to D(E(state), state)
+    Dictionary mapping states to D(E(state), state), or an array (NaN for
+    excluded boundary states) for a sparse matrix
     """
 
-    dist = q_divergence(q_d)
-    e = defaultdict(float)
+    if issparse(edges):
+        if states is None:
+            raise ValueError(
+                "Keyword argument `states` required with a sparse matrix")
+        return sparse_expected_divergence(edges, states, q_d=q_d,
+                                          boundary=boundary)
 
     if isinstance(edges, list):
-        for x, y, w in edges:
-            e[x] += numpy.array(y) * w
+        matrix, enum, inv_enum = edges_to_sparse_matrix(edges)
+        # Only the sources of edges have expected next states
+        sources = numpy.flatnonzero(numpy.diff(matrix.indptr) > 0)
+        states = [inv_enum[i] for i in sources]
+        expected = matrix[sources].dot(numpy.array(inv_enum, dtype=float))
     elif isinstance(edges, Callable):
         if not states:
             raise ValueError(
                 "Keyword argument `states` required with edge_func")
-        for x in states:
-            e[x] = 0.
-            for y in states:
-                w = edges(x, y)
-                e[x] += numpy.array(y) * w
-    d = dict()
-    for state, v in e.items():
-        # Some divergences do not play well on the boundary
-        if not boundary:
-            p = 1.
-            for s in state:
-                p *= s
-            if p == 0:
-                continue
-        d[state] = dist(normalize(v), normalize(list(state)))
-    return d
+        state_array = numpy.array(states, dtype=float)
+        if getattr(edges, "blocks", None):
+            # Cached transitions indexed by simplex rank
+            ranks = simplex_ranks(states)
+            expected = numpy.vstack([block.dot(state_array[
+                numpy.argsort(ranks)]) for block in edges.blocks])[ranks]
+        else:
+            expected = numpy.vstack([
+                numpy.array([[edges(x, y) for y in states] for x in
+                             states[start: start + block_size]]).dot(
+                                 state_array)
+                for start in range(0, len(states), block_size)])
+
+    d = _divergences(expected, numpy.array(states, dtype=float), q_d,
+                     boundary)
+    return dict((state, v) for state, v in zip(states, d.tolist())
+                if boundary or all(state))
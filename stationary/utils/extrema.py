@@ -1,10 +1,69 @@
 import math
 import numpy
 
-from .math_helpers import one_step_generator
+from .math_helpers import one_step_generator, simplex_neighbors, simplex_ranks
 from .graph import Graph
 
 
+def local_extrema_array(values, N, d=2, maxima=False, neighbors=None):
+    """
+    Finds the local extrema of an array-valued distribution on the simplex with
+    one vectorized comparison against the precomputed neighbor table.
+
+    Parameters
+    ----------
+    values: numpy array
+        The values on the states of simplex_generator(N, d), in that order.
+        NaN values are neither extrema nor compared against.
+    N: int
+        The number of subdivsions in each dimension
+    d: int, 2
+        The dimension of the simplex
+    maxima: bool, False
+        Find the strict local maxima rather than the minima
+    neighbors: numpy array, None
+        Precomputed simplex_neighbors(N, d)
+
+    Returns
+    -------
+    boolean numpy array, True at the extrema
+    """
+
+    values = numpy.asarray(values, dtype=float)
+    if neighbors is None:
+        neighbors = simplex_neighbors(N, d)
+    # Out of simplex neighbors (-1) index the appended NaN
+    adj = numpy.append(values, numpy.nan)[neighbors]
+    with numpy.errstate(invalid='ignore'):
+        if maxima:
+            dominated = numpy.any(values[:, numpy.newaxis] <= adj, axis=1)
+        else:
+            dominated = numpy.any(values[:, numpy.newaxis] >= adj, axis=1)
+    return ~(dominated | numpy.isnan(values))
+
+
+def _dict_extrema(d, maxima=False):
+    """
+    Finds the extrema of a dictionary on a simplex discretization with
+    local_extrema_array. Returns None if the keys are not all integer states
+    of the same simplex.
+    """
+
+    keys = list(d.keys())
+    states = numpy.array(keys)
+    if states.ndim != 2 or states.dtype.kind not in 'iu':
+        return None
+    sums = states.sum(axis=1)
+    if numpy.any(sums != sums[0]) or numpy.any(states < 0):
+        return None
+    N, dim = int(sums[0]), states.shape[1] - 1
+    ranks = simplex_ranks(states)
+    values = numpy.full(len(simplex_neighbors(N, dim)), numpy.nan)
+    values[ranks] = [numpy.nan if v is None else v for v in d.values()]
+    mask = local_extrema_array(values, N, dim, maxima=maxima)
+    return set(key for key, i in zip(keys, ranks) if mask[i])
+
+
 def find_local_minima(d, comp_func=None):
     """
     Finds local minima of distributions on the simplex.
@@ -22,6 +81,9 @@ def find_local_minima(d, comp_func=None):
     """
 
     if not comp_func:
+        extrema = _dict_extrema(d)
+        if extrema is not None:
+            return extrema
         comp_func = lambda x, y: (x - y >= 0)
 
     dim = len(list(d)[0]) - 1
@@ -60,6 +122,9 @@ def find_local_maxima(d):
     set of maximal states.
     """
 
+    extrema = _dict_extrema(d, maxima=True)
+    if extrema is not None:
+        return extrema
     comp_func = lambda x, y: (y - x >= 0)
     return find_local_minima(d, comp_func=comp_func)
 
@@ -100,6 +100,33 @@ def log_factorial(i):
     return p
 
 
+def logsumexp_array(a, axis=-1):
+    """
+    Computes log(sum(exp(a))) along an axis of an array stably, by subtracting
+    the maximum. Slices that are entirely -inf give -inf.
+    """
+
+    a = numpy.asarray(a, dtype=float)
+    m = numpy.max(a, axis=axis, keepdims=True)
+    m = numpy.where(numpy.isfinite(m), m, 0.)
+    with numpy.errstate(divide='ignore'):
+        s = numpy.log(numpy.sum(numpy.exp(a - m), axis=axis, keepdims=True))
+    return numpy.squeeze(s + m, axis=axis)
+
+
+def log1mexp(x):
+    """
+    Computes log(1 - exp(x)) for x <= 0 accurately, using log1p(-exp(x)) for
+    x < -log(2) (where 1 - exp(x) is close to 1) and log(-expm1(x)) otherwise.
+    """
+
+    x = numpy.asarray(x, dtype=float)
+    with numpy.errstate(divide='ignore'):
+        return numpy.where(x < -numpy.log(2),
+                           numpy.log1p(-numpy.exp(x)),
+                           numpy.log(-numpy.expm1(numpy.minimum(x, 0.))))
+
+
 def simplex_generator(N, d=2):
     """
     Generates a discretation of the simplex.
@@ -129,6 +156,122 @@ def simplex_generator(N, d=2):
                 yield tuple(t)
 
 
+## Ranking of simplex states in the order of simplex_generator, by the
+# combinatorial number system.
+
+_binomial_tables = dict()
+
+
+def binomial_table(n, k):
+    """
+    Returns an integer array B with B[i, j] = binom(i, j) for i <= n, j <= k.
+    Tables are cached.
+    """
+
+    try:
+        return _binomial_tables[(n, k)]
+    except KeyError:
+        pass
+    B = numpy.zeros((n + 1, k + 1), dtype=numpy.int64)
+    B[:, 0] = 1
+    for i in range(1, n + 1):
+        B[i, 1:] = B[i - 1, 1:] + B[i - 1, :-1]
+    _binomial_tables[(n, k)] = B
+    return B
+
+
+def num_simplex_states(N, d=2):
+    """
+    The number of states yielded by simplex_generator(N, d), binom{N+d}{d}.
+    """
+
+    return int(binomial_table(N + d, d)[N + d, d])
+
+
+def simplex_ranks(states):
+    """
+    Computes the indices of simplex states in the order yielded by
+    simplex_generator without enumerating the simplex.
+
+    Parameters
+    ----------
+    states: array-like of shape (S, d+1)
+        States of the discretized simplex, each summing to N
+
+    Returns
+    -------
+    numpy array of S integers in 0, ..., binom{N+d}{d} - 1
+    """
+
+    states = numpy.asarray(states, dtype=numpy.int64)
+    d = states.shape[1] - 1
+    N = int(states[0].sum())
+    B = binomial_table(N + d + 1, d + 1)
+    ranks = numpy.zeros(len(states), dtype=numpy.int64)
+    remaining = numpy.full(len(states), N, dtype=numpy.int64)
+    for k in range(d):
+        # Count the states with a smaller k-th coordinate
+        e = d - k
+        ranks += B[remaining + e, e] - B[remaining - states[:, k] + e, e]
+        remaining -= states[:, k]
+    return ranks
+
+
+def simplex_unranks(indices, N, d=2):
+    """
+    Computes the simplex states with the given indices in the order yielded
+    by simplex_generator, the inverse of simplex_ranks.
+
+    Parameters
+    ----------
+    indices: array-like of integers
+        Indices in 0, ..., binom{N+d}{d} - 1
+    N: int
+        The number of subdivsions in each dimension
+    d: int, 2
+        The dimension of the simplex
+
+    Returns
+    -------
+    numpy array of shape (S, d+1)
+    """
+
+    indices = numpy.array(indices, dtype=numpy.int64).reshape(-1)
+    B = binomial_table(N + d + 1, d + 1)
+    states = numpy.zeros((len(indices), d + 1), dtype=numpy.int64)
+    remaining = numpy.full(len(indices), N, dtype=numpy.int64)
+    for k in range(d):
+        e = d - k
+        # The smallest u = remaining - x_k with B[u + e, e] >= target
+        target = B[remaining + e, e] - indices
+        u = numpy.searchsorted(B[e:, e], target, side='left')
+        states[:, k] = remaining - u
+        indices = indices - (B[remaining + e, e] - B[u + e, e])
+        remaining = u
+    states[:, d] = remaining
+    return states
+
+
+def simplex_rank(state):
+    """The index of a single state in the order of simplex_generator."""
+
+    return int(simplex_ranks([state])[0])
+
+
+def simplex_unrank(index, N, d=2):
+    """The state with the given index in the order of simplex_generator."""
+
+    return tuple(int(x) for x in simplex_unranks([index], N, d)[0])
+
+
+def simplex_states(N, d=2):
+    """
+    The states of simplex_generator(N, d) as an array of shape (S, d+1).
+    """
+
+    return simplex_unranks(numpy.arange(num_simplex_states(N, d)), N, d)
+
+
 def one_step_generator(d):
     """
     Generates the arrays needed to construct neighboring states one step away
@@ -149,6 +292,33 @@ def one_step_generator(d):
             yield step
 
 
+_neighbor_tables = dict()
+
+
+def simplex_neighbors(N, d=2):
+    """
+    Returns an integer array T of shape (S, k) with T[i, j] the index of the
+    state one step away from the i-th state of simplex_generator(N, d) in the
+    j-th direction of one_step_generator(d), or -1 if that state is outside of
+    the simplex. Tables are cached.
+    """
+
+    try:
+        return _neighbor_tables[(N, d)]
+    except KeyError:
+        pass
+    states = simplex_states(N, d)
+    steps = list(one_step_generator(d))
+    table = numpy.full((len(states), len(steps)), -1, dtype=numpy.int64)
+    for j, step in enumerate(steps):
+        adj = states + numpy.array(step)
+        inside = numpy.all(adj >= 0, axis=1)
+        if numpy.any(inside):
+            table[inside, j] = simplex_ranks(adj[inside])
+    _neighbor_tables[(N, d)] = table
+    return table
+
+
 def one_step_indicies_generator(d):
     """
     Generates the indices that form all the neighboring states, by adding +1 in
@@ -165,6 +335,67 @@ def one_step_indicies_generator(d):
             yield (plus_index, minus_index)
 
 
+def interpolate_simplex(d, N, num_types=3):
+    """
+    Interpolates a function on a discretization of the simplex onto a finer
+    (or coarser) discretization. The value at each new state is the log-linear
+    interpolation of the values at the vertices of the simplicial cell (of the
+    Freudenthal triangulation) containing it, so positive functions such as
+    stationary distributions stay positive.
+
+    Parameters
+    ----------
+    d: dict
+        The function to interpolate, on the states of simplex_generator(M, d)
+        for some M
+    N: int
+        The number of subdivisions of the new discretization
+    num_types: int, 3
+        The number of population types (simplex dimension + 1)
+
+    Returns
+    -------
+    dictionary on the states of simplex_generator(N, num_types - 1)
+    """
+
+    M = sum(list(d)[0])
+    dim = num_types - 1
+    tiny = numpy.finfo(float).tiny
+    new_d = dict()
+    for state in simplex_generator(N, dim):
+        # Cumulative coordinates of the state scaled to the old simplex
+        c = numpy.cumsum(state[:-1]) * float(M) / N
+        c = numpy.round(c, 12)
+        base = numpy.floor(c)
+        fractions = c - base
+        order = numpy.argsort(-fractions, kind='stable')
+        weights = [1. - fractions[order[0]]]
+        for j in range(1, dim):
+            weights.append(fractions[order[j - 1]] - fractions[order[j]])
+        weights.append(fractions[order[-1]])
+        # Walk the vertices of the cell
+        vertex = base.copy()
+        log_value = 0.
+        total_weight = 0.
+        for j in range(dim + 1):
+            if j > 0:
+                vertex[order[j - 1]] += 1
+            if weights[j] <= 0:
+                continue
+            cell_state = [vertex[0]]
+            cell_state.extend(numpy.diff(vertex))
+            cell_state.append(M - vertex[-1])
+            cell_state = tuple(int(x) for x in cell_state)
+            try:
+                value = d[cell_state]
+            except KeyError:
+                continue
+            log_value += weights[j] * log(max(value, tiny))
+            total_weight += weights[j]
+        new_d[state] = numpy.exp(log_value / total_weight)
+    return new_d
+
+
 def kl_divergence(p, q):
     """
     Computes the KL-divergence or relative entropy of to input distributions.
@@ -196,6 +427,55 @@ def kl_divergence(p, q):
     return s
 
 
+def kl_divergence_array(p, q):
+    """
+    Computes the KL-divergence of two distributions given as numpy arrays. A
+    vectorized version of kl_divergence with the same conventions.
+
+    Parameters
+    ----------
+    p, q: numpy arrays
+        The probability distributions to compute the KL-divergence for
+
+    Returns
+    -------
+    float, the KL-divergence of p and q
+    """
+
+    p = numpy.asarray(p)
+    q = numpy.asarray(q)
+    support = p > 0
+    p, q = p[support], q[support]
+    if numpy.any(q == 0):
+        return float('nan')
+    return float(numpy.sum(p * (log(p) - log(q))))
+
+
+def log_kl_divergence_array(log_p, log_q):
+    """
+    Computes the KL-divergence of two distributions given by the logarithms
+    of their probabilities as numpy arrays, without leaving log-space except
+    for the weights exp(log_p). Uses the conventions of kl_divergence_array.
+
+    Parameters
+    ----------
+    log_p, log_q: numpy arrays
+        The log-probability distributions to compute the KL-divergence for
+
+    Returns
+    -------
+    float, the KL-divergence of p and q
+    """
+
+    log_p = numpy.asarray(log_p)
+    log_q = numpy.asarray(log_q)
+    support = log_p > -numpy.inf
+    log_p, log_q = log_p[support], log_q[support]
+    if numpy.any(log_q == -numpy.inf):
+        return float('nan')
+    return float(numpy.sum(numpy.exp(log_p) * (log_p - log_q)))
+
+
 def kl_divergence_dict(p, q):
     """
     Computes the KL-divergence of distributions given as dictionaries.
@@ -243,6 +523,43 @@ def q_divergence(q):
     return d
 
 
+def q_divergence_array(q, x, y):
+    """
+    Computes the divergence of q_divergence(q) between corresponding rows of
+    two arrays of distributions at once.
+
+    Parameters
+    ----------
+    q: float
+        The divergence parameter, see q_divergence
+    x, y: numpy arrays of shape (S, n)
+        The distributions
+
+    Returns
+    -------
+    numpy array of length S, the divergences D(x[i], y[i])
+    """
+
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if q == 0:
+            return 0.5 * numpy.sum((x - y) ** 2, axis=1)
+        if q == 1:
+            support = x > 0
+            terms = numpy.where(
+                support, x * (log(numpy.where(support, x, 1.)) - log(y)), 0.)
+            d = terms.sum(axis=1)
+            d[numpy.any(support & (y == 0), axis=1)] = float('nan')
+            return d
+        if q == 2:
+            return -numpy.sum(log(x / y) + 1 - x / y, axis=1)
+        q = float(q)
+        s = numpy.sum((numpy.power(y, 2 - q) - numpy.power(x, 2 - q)) / (2 - q)
+                      - numpy.power(y, 1 - q) * (y - x), axis=1)
+        return -s / (1 - q)
+
+
 def shannon_entropy(p):
     s = 0.
     for i in range(len(p)):
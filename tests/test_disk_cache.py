@@ -0,0 +1,109 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy
+from nose.tools import (
+    assert_equal, assert_not_equal, assert_raises, assert_true)
+
+from stationary.processes import (
+    incentive_process, variable_population_size, wright_fisher)
+from stationary.processes.incentives import fermi, linear_fitness_landscape
+from stationary.utils.disk_cache import DiskCache, hash_parameters
+
+
+def test_hash_parameters():
+    m = [[1, 2], [2, 1]]
+    assert_equal(hash_parameters(N=10, game_matrix=m, mu=0.1),
+                 hash_parameters(mu=0.1, game_matrix=numpy.array(m), N=10))
+    assert_not_equal(hash_parameters(N=10, game_matrix=m, mu=0.1),
+                     hash_parameters(N=11, game_matrix=m, mu=0.1))
+    assert_raises(ValueError, hash_parameters, incentive=fermi)
+
+
+def test_disk_cache_eviction():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = DiskCache(directory, max_bytes=2500)
+        for i in range(3):
+            cache.put(str(i), {"a": numpy.arange(100) * i})
+            # Distinct modification times
+            path = os.path.join(directory, str(i))
+            os.utime(path, (time.time() + i, time.time() + i))
+        # Only two entries of ~928 bytes fit
+        assert_true("0" not in cache)
+        assert_true("1" in cache)
+        assert_true(numpy.all(cache.get("2")["a"] == numpy.arange(100) * 2))
+        assert_true(cache.size() <= 2500)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cached_transitions():
+    directory = tempfile.mkdtemp()
+    try:
+        m = [[1, 2, 3], [2, 1, 2], [3, 2, 1]]
+        incentive = fermi(linear_fitness_landscape(m), beta=1.)
+        cache_key = {"game_matrix": m, "incentive": "fermi", "beta": 1.}
+
+        edges = incentive_process.multivariate_transitions(
+            10, incentive, mu=0.01)
+        for _ in range(2):
+            cached_edges = incentive_process.multivariate_transitions(
+                10, incentive, mu=0.01, cache=directory, cache_key=cache_key)
+            assert_equal(cached_edges, edges)
+
+        h = wright_fisher.multivariate_transitions(10, incentive, mu=0.01)
+        for _ in range(2):
+            cached_h = wright_fisher.multivariate_transitions(
+                10, incentive, mu=0.01, cache=directory, cache_key=cache_key,
+                chunk_size=20)
+            matrix = numpy.vstack(cached_h.blocks)
+            assert_true(numpy.all(matrix == h.matrix))
+        assert_true(isinstance(cached_h.blocks[0], numpy.memmap))
+
+        fitness_landscape = linear_fitness_landscape([[1, 2], [2, 1]])
+        edges = variable_population_size.variable_population_transitions(
+            10, fitness_landscape)
+        for _ in range(2):
+            cached_edges = \
+                variable_population_size.variable_population_transitions(
+                    10, fitness_landscape, cache=directory,
+                    cache_key={"game_matrix": [[1, 2], [2, 1]]})
+            assert_equal(cached_edges, edges)
+
+        # Death probabilities and incentives must be described by the key
+        death_probabilities = variable_population_size.linear_death(10)
+        assert_raises(
+            ValueError,
+            variable_population_size.variable_population_transitions,
+            10, fitness_landscape, death_probabilities=death_probabilities,
+            cache=directory, cache_key={"game_matrix": [[1, 2], [2, 1]]})
+        edges = variable_population_size.variable_population_transitions(
+            10, fitness_landscape, death_probabilities=death_probabilities)
+        cached_edges = \
+            variable_population_size.variable_population_transitions(
+                10, fitness_landscape,
+                death_probabilities=death_probabilities, cache=directory,
+                cache_key={"game_matrix": [[1, 2], [2, 1]],
+                           "death_probabilities": "linear_death"})
+        assert_equal(cached_edges, edges)
+
+        # Memory-mapped rank-indexed arrays
+        arrays = incentive_process.multivariate_transitions_arrays(
+            10, incentive, mu=0.01)
+        for _ in range(2):
+            cached_arrays = incentive_process.multivariate_transitions_arrays(
+                10, incentive, mu=0.01, cache=directory, cache_key=cache_key)
+            for a, b in zip(arrays, cached_arrays):
+                assert_true(numpy.all(a == b))
+        assert_true(isinstance(cached_arrays[2], numpy.memmap))
+
+        assert_equal(len(DiskCache(directory).entries()), 5)
+        assert_raises(ValueError, incentive_process.multivariate_transitions,
+                      10, incentive, cache=directory)
+    finally:
+        shutil.rmtree(directory)
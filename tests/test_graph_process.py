@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+
+from itertools import product
+
+import numpy
+from nose.tools import (
+    assert_almost_equal, assert_equal, assert_raises, assert_true)
+from scipy.sparse import csr_matrix
+
+from stationary import stationary_distribution
+from stationary.processes.graph_process import (
+    cycle_automorphisms, decode_configurations, encode_configuration,
+    graph_transitions_arrays, multivariate_graph_transitions,
+    orbit_representatives, quotient_graph_transitions_arrays)
+from stationary.processes.incentives import (
+    linear_fitness_landscape, replicator)
+from stationary.utils.graph import Graph
+
+
+def cycle(N):
+    graph = Graph()
+    edges = []
+    for i in range(N):
+        edges.append((i, (i + 1) % N))
+        edges.append(((i + 1) % N, i))
+    graph.add_edges(edges)
+    return graph
+
+
+def test_encoding():
+    N = 6
+    configs = list(product([0, 1], repeat=N))
+    codes = [encode_configuration(c) for c in configs]
+    assert_equal(codes, list(range(2 ** N)))
+    decoded = decode_configurations(numpy.array(codes), N)
+    assert_equal([tuple(c) for c in decoded.tolist()], configs)
+
+
+def test_graph_transitions():
+    incentive = replicator(linear_fitness_landscape([[2, 2], [1, 1]]))
+    mu = 0.1
+
+    # Two vertices: from (0, 1) either individual replaces the other
+    graph = Graph([(0, 1), (1, 0)])
+    edges = multivariate_graph_transitions(2, graph, incentive, mu=mu)
+    inc = incentive((1, 1))
+    assert_almost_equal(edges[((0, 1), (0, 0))],
+                        inc[0] / sum(inc) * (1 - mu))
+    assert_almost_equal(edges[((0, 1), (1, 1))],
+                        inc[1] / sum(inc) * (1 - mu))
+    assert_almost_equal(edges[((0, 0), (0, 1))], mu / 2.)
+
+    N = 8
+    rows, cols, values = graph_transitions_arrays(N, cycle(N), incentive,
+                                                  mu=mu)
+    assert_equal(len(values), (2 * N + 1) * 2 ** N)
+    matrix = csr_matrix((values, (rows, cols)), shape=(2 ** N, 2 ** N))
+    assert_true(numpy.allclose(matrix.sum(axis=1), 1))
+    assert_true(numpy.all(matrix.data >= 0))
+    edges = multivariate_graph_transitions(N, cycle(N), incentive, mu=mu)
+    for (source, target), v in edges.items():
+        i = encode_configuration(source)
+        j = encode_configuration(target)
+        assert_almost_equal(matrix[i, j], v)
+
+
+def test_quotient_graph_transitions():
+    N = 8
+    graph = cycle(N)
+    incentive = replicator(linear_fitness_landscape([[2, 2], [1, 1]]))
+    mu = 0.1
+
+    # Binary necklaces and bracelets of length 8
+    for reflections, num_orbits in [(False, 36), (True, 30)]:
+        automorphisms = cycle_automorphisms(N, reflections=reflections)
+        labels = orbit_representatives(N, graph, automorphisms)
+        representatives = numpy.unique(labels)
+        assert_equal(len(representatives), num_orbits)
+
+        # The lumped chain's stationary distribution is the full one summed
+        # over orbits
+        rows, cols, values = graph_transitions_arrays(N, graph, incentive,
+                                                      mu=mu)
+        matrix = csr_matrix((values, (rows, cols)), shape=(2 ** N, 2 ** N))
+        s = stationary_distribution(matrix, method="solve")
+        codes, rows, cols, values = quotient_graph_transitions_arrays(
+            N, graph, incentive, automorphisms, mu=mu)
+        assert_true(numpy.all(codes == representatives))
+        matrix = csr_matrix((values, (rows, cols)), shape=(num_orbits,) * 2)
+        assert_true(numpy.allclose(matrix.sum(axis=1), 1))
+        s_lumped = stationary_distribution(matrix, method="solve")
+        s_summed = numpy.bincount(numpy.searchsorted(codes, labels),
+                                  weights=s)
+        assert_true(numpy.allclose(s_lumped, s_summed))
+
+    edges = multivariate_graph_transitions(
+        N, graph, incentive, mu=mu, automorphisms=cycle_automorphisms(N))
+    assert_equal(len(set(source for source, _ in edges.keys())), 30)
+
+    # Not automorphisms of the cycle
+    assert_raises(ValueError, orbit_representatives, N, graph,
+                  [[1, 0, 2, 3, 4, 5, 6, 7]])
+    assert_raises(ValueError, orbit_representatives, N, graph,
+                  [[0] * N])
+
+
+def test_parallel_graph_transitions():
+    N = 8
+    graph = cycle(N)
+    incentive = replicator(linear_fitness_landscape([[2, 2], [1, 1]]))
+    rows, cols, values = graph_transitions_arrays(N, graph, incentive)
+    matrix = csr_matrix((values, (rows, cols)), shape=(2 ** N, 2 ** N))
+    rows, cols, values = graph_transitions_arrays(
+        N, graph, incentive, processes=2, chunk_size=50)
+    assert_equal(len(values), (2 * N + 1) * 2 ** N)
+    parallel_matrix = csr_matrix((values, (rows, cols)),
+                                 shape=(2 ** N, 2 ** N))
+    assert_true(numpy.allclose(matrix.toarray(), parallel_matrix.toarray()))
+
+    automorphisms = cycle_automorphisms(N)
+    codes, rows, cols, values = quotient_graph_transitions_arrays(
+        N, graph, incentive, automorphisms)
+    matrix = csr_matrix((values, (rows, cols)), shape=(len(codes),) * 2)
+    codes, rows, cols, values = quotient_graph_transitions_arrays(
+        N, graph, incentive, automorphisms, processes=2, chunk_size=7)
+    parallel_matrix = csr_matrix((values, (rows, cols)),
+                                 shape=(len(codes),) * 2)
+    assert_true(numpy.allclose(matrix.toarray(), parallel_matrix.toarray()))
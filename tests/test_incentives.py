@@ -0,0 +1,39 @@
+
+import numpy
+
+from nose.tools import assert_almost_equal, assert_equal, assert_raises, assert_true, assert_less_equal, assert_greater_equal, assert_greater
+
+from stationary.processes.incentives import (
+    constant_fitness, linear_fitness_landscape, replicator, logit, fermi,
+    batch_linear_fitness_landscape, batch_replicator)
+from stationary.utils.math_helpers import simplex_states
+
+
+def test_batch_incentives():
+    """
+    Check that the batch fitness landscapes and incentives agree with the
+    single state versions.
+    """
+
+    m = [[0, -1, 1], [1, 0, -1], [-1, 1, 2]]
+    states = simplex_states(12, 2)
+    for self_interaction in [True, False]:
+        for normalize in [True, False]:
+            fitness = linear_fitness_landscape(
+                m, self_interaction=self_interaction, normalize=normalize)
+            incentives = [fitness, constant_fitness([1, 2, 3]),
+                          replicator(fitness), replicator(fitness, q=2),
+                          logit(fitness, beta=2.), logit(fitness, q=0.5),
+                          fermi(fitness, beta=0.5)]
+            for incentive in incentives:
+                batch_values = incentive.batch(states)
+                assert_equal(batch_values.shape, states.shape)
+                values = [incentive(tuple(state))
+                          for state in states.tolist()]
+                assert_true(numpy.allclose(batch_values, values,
+                                           rtol=1e-12, atol=1e-12))
+
+    # The batch functions can also be used directly
+    fitness = batch_linear_fitness_landscape(m)
+    incentive = batch_replicator(fitness)
+    assert_equal(incentive(states).shape, states.shape)
@@ -1,9 +1,13 @@
 
+import numpy
 from scipy.misc import comb
 
 from nose.tools import assert_almost_equal, assert_equal, assert_raises, assert_true, assert_less_equal, assert_greater_equal, assert_greater
 
-from stationary.utils.math_helpers import simplex_generator
+from stationary.utils.math_helpers import (
+    simplex_generator, interpolate_simplex, num_simplex_states,
+    one_step_generator, simplex_neighbors, simplex_rank, simplex_ranks,
+    simplex_states, simplex_unrank, simplex_unranks)
 
 def test_stationary_generator():
     d = 1
@@ -39,3 +43,44 @@ def test_stationary_generator():
             states = set(simplex_generator(N, d))
             size = comb(N + d, d, exact=True)
             assert_equal(len(states), size)
+
+
+def test_interpolate_simplex():
+    # Log-linear functions are interpolated exactly
+    for d, M, N in [(1, 5, 12), (2, 4, 9), (3, 3, 7)]:
+        f = lambda state: numpy.exp(sum((i + 1.) * x / sum(state)
+                                        for i, x in enumerate(state)))
+        coarse = dict((state, f(state)) for state in simplex_generator(M, d))
+        fine = interpolate_simplex(coarse, N, num_types=d+1)
+        assert_equal(set(fine), set(simplex_generator(N, d)))
+        for state, value in fine.items():
+            assert_almost_equal(value, f(state))
+
+
+def test_simplex_ranks():
+    for d in range(1, 5):
+        for N in range(1, 12):
+            states = list(simplex_generator(N, d))
+            assert_equal(num_simplex_states(N, d), len(states))
+            ranks = simplex_ranks(states)
+            assert_equal(list(ranks), list(range(len(states))))
+            unranked = simplex_unranks(ranks, N, d)
+            assert_equal([tuple(x) for x in unranked], states)
+            assert_equal([tuple(x) for x in simplex_states(N, d)], states)
+            for i in [0, len(states) // 2, len(states) - 1]:
+                assert_equal(simplex_rank(states[i]), i)
+                assert_equal(simplex_unrank(i, N, d), states[i])
+
+
+def test_simplex_neighbors():
+    for d in range(1, 4):
+        for N in range(1, 8):
+            states = list(simplex_generator(N, d))
+            enum = dict((state, i) for i, state in enumerate(states))
+            table = simplex_neighbors(N, d)
+            steps = list(one_step_generator(d))
+            assert_equal(table.shape, (len(states), len(steps)))
+            for i, state in enumerate(states):
+                for j, step in enumerate(steps):
+                    adj = tuple(x + y for x, y in zip(state, step))
+                    assert_equal(table[i, j], enum.get(adj, -1))
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+
+import numpy
+from nose.tools import assert_equal, assert_less, assert_true
+from scipy.sparse import csr_matrix
+
+from stationary import stationary_distribution
+from stationary.processes import incentive_process
+from stationary.processes.graph_process import (
+    decode_configurations, graph_transitions_arrays)
+from stationary.processes.incentives import (
+    fermi, linear_fitness_landscape, replicator)
+from stationary.simulation import (
+    integrated_autocorrelation_time, simulate_graph_process,
+    simulate_incentive_process)
+from stationary.utils.graph import Graph
+
+
+def test_autocorrelation_time():
+    random_state = numpy.random.RandomState(0)
+    traces = random_state.normal(size=(2000, 50))
+    assert_less(abs(integrated_autocorrelation_time(traces) - 1.), 0.2)
+    # An AR(1) process with coefficient a has tau = (1 + a) / (1 - a) = 3
+    a = 0.5
+    for t in range(1, len(traces)):
+        traces[t] += a * traces[t - 1]
+    assert_less(abs(integrated_autocorrelation_time(traces) - 3.), 0.3)
+
+
+def test_simulate_incentive_process():
+    N = 10
+    incentive = fermi(linear_fitness_landscape(
+        [[1, 2, 3], [2, 1, 2], [3, 2, 1]]), beta=1.)
+    edges = incentive_process.multivariate_transitions(N, incentive, mu=0.1)
+    s = stationary_distribution(edges, method="solve")
+    s_1, report = simulate_incentive_process(
+        N, incentive, mu=0.1, chains=200, steps=1000, burn_in=100, seed=1,
+        report=True)
+    for state, v in s.items():
+        assert_less(abs(s_1.get(state, 0.) - v), 0.01)
+    assert_true(report["autocorrelation_time"] > 1)
+    inside = [lower <= s[state] <= upper for state, (lower, upper)
+              in report["confidence_intervals"].items()]
+    assert_true(numpy.mean(inside) > 0.8)
+
+    # Reproducible with a seed
+    s_2 = simulate_incentive_process(
+        N, incentive, mu=0.1, chains=200, steps=1000, burn_in=100, seed=1)
+    assert_equal(s_1, s_2)
+
+
+def test_simulate_graph_process():
+    N = 6
+    graph = Graph()
+    graph.add_edges([(i, (i + 1) % N) for i in range(N)] +
+                    [((i + 1) % N, i) for i in range(N)])
+    incentive = replicator(linear_fitness_landscape([[2, 2], [1, 1]]))
+    rows, cols, values = graph_transitions_arrays(N, graph, incentive, mu=0.1)
+    matrix = csr_matrix((values, (rows, cols)), shape=(2 ** N, 2 ** N))
+    s = stationary_distribution(matrix, method="solve")
+    configurations = [tuple(c) for c in decode_configurations(
+        numpy.arange(2 ** N), N).tolist()]
+    s_1 = simulate_graph_process(N, graph, incentive, mu=0.1, chains=200,
+                                 steps=1000, burn_in=100, seed=2)
+    for i, configuration in enumerate(configurations):
+        assert_less(abs(s_1.get(configuration, 0.) - s[i]), 0.01)
+
+    # A vertex without out-neighbors leaves the population unchanged when it
+    # is chosen to reproduce
+    N = 4
+    graph = Graph()
+    graph.add_edges([(0, 1), (1, 2), (2, 0), (0, 3)])
+    # Registers the vertex 3 without out-edges
+    graph.out_dict(3)
+    rows, cols, values = graph_transitions_arrays(N, graph, incentive, mu=0.1)
+    matrix = csr_matrix((values, (rows, cols)), shape=(2 ** N, 2 ** N))
+    s = stationary_distribution(matrix, method="solve")
+    configurations = [tuple(c) for c in decode_configurations(
+        numpy.arange(2 ** N), N).tolist()]
+    s_1 = simulate_graph_process(N, graph, incentive, mu=0.1, chains=200,
+                                 steps=1000, burn_in=100, seed=3)
+    for i, configuration in enumerate(configurations):
+        assert_less(abs(s_1.get(configuration, 0.) - s[i]), 0.01)
@@ -1,6 +1,10 @@
 from __future__ import absolute_import
 
+import warnings
+
 import numpy
+from scipy.sparse import csr_matrix
+from scipy.stats import multinomial
 
 from nose.tools import (
     assert_almost_equal, assert_equal, assert_raises, assert_true,
@@ -8,18 +12,25 @@ from nose.tools import (
 )
 
 from stationary import stationary_distribution, entropy_rate
+from stationary.stationary_ import (
+    approx_stationary, birth_death_stationary, detailed_balance_error,
+    exact_stationary, is_reversible, log_approx_stationary,
+    multilevel_stationary, sor_stationary, tree_stationary)
 from stationary.processes import incentive_process, wright_fisher
 from stationary.processes.incentives import (
-    replicator, logit, fermi, linear_fitness_landscape)
+    replicator, logit, fermi, log_fermi, linear_fitness_landscape,
+    rock_paper_scissors)
 from stationary.utils.matrix_checks import (
     check_detailed_balance, check_global_balance, check_eigenvalue)
 
 from stationary.utils import expected_divergence
-from stationary.utils.math_helpers import simplex_generator
+from stationary.utils.math_helpers import (
+    normalize, q_divergence, simplex_generator, simplex_rank, simplex_states)
 from stationary.utils.edges import (
     states_from_edges, edge_func_to_edges, power_transitions)
 from stationary.utils.extrema import (
-    find_local_minima, find_local_maxima, inflow_outflow)
+    find_local_minima, find_local_maxima, inflow_outflow,
+    local_extrema_array)
 
 
 # Test Generic processes
@@ -107,6 +118,196 @@ def test_stationary_4():
         for key in s.keys():
             assert_almost_equal(exact_stationary[key], s[key])
 
+
+def test_sparse_engine(lim=1e-14):
+    """
+    Test that the sparse matrix engine matches the pure python iteration.
+    """
+
+    N = 20
+    mu = 1. / N
+    m = [[0, -1, 1], [1, 0, -1], [-1, 1, 0]]
+    fitness_landscape = linear_fitness_landscape(m)
+    incentive = fermi(fitness_landscape, beta=1.)
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=3, mu=mu)
+
+    for iterations in [10, None]:
+        s_1 = approx_stationary(edges, iterations=iterations, lim=lim,
+                                sparse=True)
+        s_2 = approx_stationary(edges, iterations=iterations, lim=lim,
+                                sparse=False)
+        for key in s_2.keys():
+            assert_almost_equal(s_1[key], s_2[key], places=10)
+    check_global_balance(edges, s_1)
+
+
+def test_solve():
+    """
+    Test the direct sparse solve on reversible and non-reversible processes.
+    """
+
+    edges = [(0, 0, 1./3), (0, 1, 1./3), (0, 2, 1./3),
+             (1, 0, 1./4), (1, 1, 1./2), (1, 2, 1./4),
+             (2, 0, 1./6), (2, 1, 1./3), (2, 2, 1./2),]
+    exact_stationary = {0: 6./25, 1: 10./25, 2:9./25}
+    s = stationary_distribution(edges, method="solve")
+    for key in s.keys():
+        assert_almost_equal(exact_stationary[key], s[key])
+
+    # Rock-paper-scissors is not reversible
+    N = 20
+    mu = 1. / N
+    m = [[0, -1, 1], [1, 0, -1], [-1, 1, 0]]
+    fitness_landscape = linear_fitness_landscape(m)
+    incentive = fermi(fitness_landscape, beta=1.)
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=3, mu=mu)
+    s_1 = stationary_distribution(edges, method="solve")
+    s_2 = stationary_distribution(edges, lim=1e-16)
+    check_global_balance(edges, s_1, places=12)
+    for key in s_2.keys():
+        assert_almost_equal(s_1[key], s_2[key], places=7)
+
+
+def test_eigen(lim=1e-12):
+    """
+    Test the eigenvector solver, including warm starts.
+    """
+
+    edges = [(0, 0, 0), (0, 1, 1), (0, 2, 0), (0, 3, 0),
+             (1, 0, 1./3), (1, 1, 0), (1, 2, 2./3), (1, 3, 0),
+             (2, 0, 0), (2, 1, 2./3), (2, 2, 0), (2, 3, 1./3),
+             (3, 0, 0), (3, 1, 0), (3, 2, 1), (3, 3, 0)]
+    exact_stationary = {0: 1./8, 1: 3./8, 2: 3./8, 3: 1./8}
+    s = stationary_distribution(edges, method="eigen", lim=lim)
+    for key in s.keys():
+        assert_almost_equal(exact_stationary[key], s[key])
+
+    N = 10
+    mu = 1. / N
+    m = [[0, -1, 1, 1], [1, 0, -1, 1], [-1, 1, 0, 1], [0, 0, 0, 1]]
+    fitness_landscape = linear_fitness_landscape(m)
+    edges = incentive_process.multivariate_transitions(
+        N, fermi(fitness_landscape, beta=1.), num_types=4, mu=mu)
+    s_1 = stationary_distribution(edges, method="eigen", lim=lim)
+    s_2 = stationary_distribution(edges, method="solve")
+    for key in s_2.keys():
+        assert_almost_equal(s_1[key], s_2[key], places=10)
+
+    # Warm start from a nearby process
+    edges = incentive_process.multivariate_transitions(
+        N, fermi(fitness_landscape, beta=1.1), num_types=4, mu=mu)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        s_1 = stationary_distribution(edges, method="eigen", lim=lim,
+                                      initial_state=s_1)
+    assert_equal(len(w), 0)
+    s_2 = stationary_distribution(edges, method="solve")
+    for key in s_2.keys():
+        assert_almost_equal(s_1[key], s_2[key], places=10)
+
+    # An unattainable residual warns instead of silently returning
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        stationary_distribution(edges, method="eigen", lim=1e-30,
+                                iterations=2)
+    assert_equal(len(w), 1)
+    assert_true(issubclass(w[0].category, RuntimeWarning))
+
+
+def test_sor(lim=1e-12):
+    """
+    Test the Gauss-Seidel / SOR solver.
+    """
+
+    edges = [(0, 0, 1./3), (0, 1, 1./3), (0, 2, 1./3),
+             (1, 0, 1./4), (1, 1, 1./2), (1, 2, 1./4),
+             (2, 0, 1./6), (2, 1, 1./3), (2, 2, 1./2),]
+    exact_stationary = {0: 6./25, 1: 10./25, 2:9./25}
+    s = stationary_distribution(edges, method="sor", lim=lim)
+    for key in s.keys():
+        assert_almost_equal(exact_stationary[key], s[key])
+
+    N = 20
+    mu = 1. / N
+    m = [[0, -1, 1], [1, 0, -1], [-1, 1, 0]]
+    fitness_landscape = linear_fitness_landscape(m)
+    edges = incentive_process.multivariate_transitions(
+        N, fermi(fitness_landscape, beta=1.), num_types=3, mu=mu)
+    s_2 = stationary_distribution(edges, method="solve")
+    for omega in [1., 1.2]:
+        s_1, report = sor_stationary(edges, omega=omega, lim=lim, report=True)
+        assert_true(report["converged"])
+        assert_less_equal(report["residual"], lim)
+        for key in s_2.keys():
+            assert_almost_equal(s_1[key], s_2[key], places=10)
+    s_1 = stationary_distribution(edges, method="sor", omega=1.2, lim=lim)
+    for key in s_2.keys():
+        assert_almost_equal(s_1[key], s_2[key], places=10)
+
+    # Over-relaxation diverges for this process, which stops with a warning
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        s_1, report = sor_stationary(edges, omega=1.8, lim=lim, report=True)
+    assert_true(not report["converged"])
+    assert_less_equal(report["iterations"], 100)
+    assert_equal(len(w), 1)
+    assert_true(issubclass(w[0].category, RuntimeWarning))
+
+    # Absorbing states are not supported
+    edges = [(0, 0, 1.), (1, 0, 0.5), (1, 1, 0.5)]
+    assert_raises(ValueError, sor_stationary, edges)
+
+
+def test_multilevel(lim=1e-12):
+    """
+    Test the coarse-to-fine multilevel solver.
+    """
+
+    for n, N in [(2, 40), (3, 24)]:
+        m = numpy.ones((n, n)) - numpy.eye(n)
+        fitness_landscape = linear_fitness_landscape(m)
+        incentive = fermi(fitness_landscape, beta=1.)
+
+        def edges_func(N):
+            return incentive_process.multivariate_transitions(
+                N, incentive, num_types=n, mu=1./N)
+
+        s_1, report = multilevel_stationary(
+            edges_func, N, num_types=n, N_coarse=5, lim=lim, report=True)
+        s_2 = stationary_distribution(edges_func(N), method="solve")
+        assert_equal(report["levels"][-1], N)
+        assert_equal(len(report["levels"]), len(report["iterations"]))
+        assert_true(report["converged"])
+        for key in s_2.keys():
+            assert_almost_equal(s_1[key], s_2[key], places=10)
+
+    # A non-reversible (rock-paper-scissors) process
+    N = 32
+    incentive = fermi(linear_fitness_landscape(rock_paper_scissors(1, 3)),
+                      beta=3.)
+
+    def edges_func(N):
+        return incentive_process.multivariate_transitions(
+            N, incentive, num_types=3, mu=1./N)
+
+    s_1, report = multilevel_stationary(edges_func, N, lim=lim, report=True)
+    s_2 = stationary_distribution(edges_func(N), method="solve")
+    assert_true(report["converged"])
+    assert_less_equal(report["residuals"][-1], lim)
+    for key in s_2.keys():
+        assert_almost_equal(s_1[key], s_2[key], places=10)
+
+    # Over-relaxed smoothing diverges for it, which stops with a warning
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        s_1, report = multilevel_stationary(edges_func, N, omega=1.3,
+                                            lim=lim, report=True)
+    assert_true(not report["converged"])
+    assert_equal(len(w), 1)
+    assert_true(issubclass(w[0].category, RuntimeWarning))
+
 ## Test Moran / Incentive Processes
 
 
@@ -145,6 +346,444 @@ def test_incentive_process(lim=1e-14):
         assert_greater_equal(er, 0)
 
 
+def test_entropy_rate():
+    """
+    Compare the entropy rate of edge lists, sparse matrices and edge
+    functions, with and without cached blocks.
+    """
+
+    N = 10
+    incentive = fermi(linear_fitness_landscape(
+        [[1, 2, 3], [2, 1, 2], [3, 2, 1]]), beta=1.)
+    edges = incentive_process.multivariate_transitions(N, incentive, mu=0.1)
+    s = stationary_distribution(edges, method="solve")
+    e = sum(-s[a] * v * numpy.log(v) for a, b, v in edges)
+    assert_almost_equal(entropy_rate(edges, s), e)
+
+    rows, cols, values = incentive_process.multivariate_transitions_arrays(
+        N, incentive, mu=0.1)
+    states = simplex_states(N)
+    S = len(states)
+    matrix = csr_matrix((values, (rows, cols)), shape=(S, S))
+    states = [tuple(state) for state in states.tolist()]
+    assert_almost_equal(entropy_rate(matrix, s, states=states), e)
+    s_array = numpy.array([s[state] for state in states])
+    assert_almost_equal(entropy_rate(matrix, s_array), e)
+    # 0 log 0 = 0
+    matrix = csr_matrix((numpy.append(values, 0.),
+                         (numpy.append(rows, 0), numpy.append(cols, S - 1))),
+                        shape=(S, S))
+    assert_almost_equal(entropy_rate(matrix, s_array), e)
+
+    # Edge functions
+    h = wright_fisher.multivariate_transitions(N, incentive, mu=0.1,
+                                               chunk_size=20)
+    g = wright_fisher.multivariate_transitions(N, incentive, mu=0.1,
+                                               low_memory=True)
+    s = stationary_distribution(h, states=states, iterations=100)
+    e = sum(-s[a] * g(a, b) * numpy.log(g(a, b))
+            for a in states for b in states)
+    assert_almost_equal(entropy_rate(h, s, states=states), e)
+    assert_almost_equal(entropy_rate(g, s, states=states, block_size=7), e)
+
+
+def test_expected_divergence():
+    """
+    Compare the expected divergences of edge lists, sparse matrices and edge
+    functions with a direct computation.
+    """
+
+    N = 10
+    incentive = fermi(linear_fitness_landscape(
+        [[1, 2, 3], [2, 1, 2], [3, 2, 1]]), beta=1.)
+    edges = incentive_process.multivariate_transitions(N, incentive, mu=0.1)
+    rows, cols, values = incentive_process.multivariate_transitions_arrays(
+        N, incentive, mu=0.1)
+    states = simplex_states(N)
+    S = len(states)
+    matrix = csr_matrix((values, (rows, cols)), shape=(S, S))
+    states = [tuple(state) for state in states.tolist()]
+    h = wright_fisher.multivariate_transitions(N, incentive, mu=0.1,
+                                               chunk_size=20)
+    g = wright_fisher.multivariate_transitions(N, incentive, mu=0.1,
+                                               low_memory=True)
+
+    for q_d in [0, 0.5, 1, 2]:
+        dist = q_divergence(q_d)
+        expected = dict((state, numpy.zeros(3)) for state in states)
+        for a, b, v in edges:
+            expected[a] += numpy.array(b) * v
+        d = dict((state, dist(normalize(expected[state]),
+                              normalize(list(state)))) for state in states)
+        for boundary in [True, False]:
+            d1 = expected_divergence(edges, q_d=q_d, boundary=boundary)
+            d2 = expected_divergence(matrix, states=states, q_d=q_d,
+                                     boundary=boundary)
+            for i, state in enumerate(states):
+                if not boundary and not all(state):
+                    assert_true(state not in d1)
+                    assert_true(numpy.isnan(d2[i]))
+                    continue
+                if numpy.isnan(d[state]):
+                    assert_true(numpy.isnan(d1[state]))
+                    continue
+                assert_almost_equal(d1[state], d[state])
+                assert_almost_equal(d2[i], d[state])
+
+        # Edge functions, with and without cached blocks
+        d = dict((state, dist(normalize(numpy.dot(
+            [g(state, b) for b in states], states)),
+            normalize(list(state)))) for state in states if all(state))
+        d1 = expected_divergence(h, states=states, q_d=q_d, boundary=False)
+        d2 = expected_divergence(g, states=states, q_d=q_d, boundary=False,
+                                 block_size=7)
+        assert_equal(set(d1.keys()), set(d.keys()))
+        for state, v in d.items():
+            assert_almost_equal(d1[state], v)
+            assert_almost_equal(d2[state], v)
+
+    assert_raises(ValueError, expected_divergence, matrix)
+
+
+def test_incentive_process_arrays():
+    """
+    Compare the vectorized transitions to multivariate_transitions.
+    """
+
+    m = [[0, -1, 1, 2], [1, 0, -1, 0], [-1, 1, 0, 1], [0, 1, 1, 0]]
+    N = 10
+    for n in [2, 3, 4]:
+        fitness_landscape = linear_fitness_landscape([row[:n] for row in m[:n]])
+        incentive = fermi(fitness_landscape, beta=1.)
+        for no_boundary in [True, False]:
+            edges = incentive_process.multivariate_transitions(
+                N, incentive, num_types=n, mu=0.1, no_boundary=no_boundary)
+            rows, cols, values = \
+                incentive_process.multivariate_transitions_arrays(
+                    N, incentive, num_types=n, mu=0.1, no_boundary=no_boundary)
+            assert_equal(len(values), len(edges))
+            transitions = dict(zip(zip(rows, cols), values))
+            for source, target, v in edges:
+                assert_equal(
+                    transitions[(simplex_rank(source), simplex_rank(target))],
+                    v)
+
+        # Solve from the sparse matrix directly
+        S = len(simplex_states(N, n - 1))
+        matrix = csr_matrix((values, (rows, cols)), shape=(S, S))
+        s_1 = stationary_distribution(matrix, method="solve",
+                                      states=simplex_states(N, n - 1))
+        s_2 = stationary_distribution(edges, method="solve")
+        for key in s_2.keys():
+            assert_almost_equal(s_1[key], s_2[key])
+        ranks = stationary_distribution(matrix, method="eigen", lim=1e-12)
+        assert_almost_equal(ranks[0], s_2[(0,) * (n - 1) + (N,)])
+
+
+def test_log_incentive_process_arrays():
+    """
+    Compare the vectorized log-space transitions to
+    log_multivariate_transitions and multivariate_transitions_arrays.
+    """
+
+    m = [[0, -1, 1], [1, 0, -1], [-1, 1, 0]]
+    N = 10
+    for n in [2, 3]:
+        fitness_landscape = linear_fitness_landscape([row[:n] for row in m[:n]])
+        log_incentive = log_fermi(fitness_landscape, beta=2.)
+        incentive = fermi(fitness_landscape, beta=2.)
+        for no_boundary in [False, True]:
+            edges = incentive_process.log_multivariate_transitions(
+                N, log_incentive, num_types=n, mu=0.1, no_boundary=no_boundary)
+            rows, cols, log_values = \
+                incentive_process.log_multivariate_transitions_arrays(
+                    N, log_incentive, num_types=n, mu=0.1,
+                    no_boundary=no_boundary)
+            assert_equal(len(log_values), len(edges))
+            transitions = dict(zip(zip(rows, cols), log_values))
+            for source, target, v in edges:
+                assert_almost_equal(
+                    transitions[(simplex_rank(source), simplex_rank(target))],
+                    v)
+            _, _, values = incentive_process.multivariate_transitions_arrays(
+                N, incentive, num_types=n, mu=0.1, no_boundary=no_boundary)
+            assert_true(numpy.allclose(numpy.exp(log_values), values))
+
+    # Strong selection and rare mutation stay finite
+    fitness_landscape = linear_fitness_landscape(m)
+    rows, cols, log_values = \
+        incentive_process.log_multivariate_transitions_arrays(
+            200, log_fermi(fitness_landscape, beta=1000.), num_types=3,
+            mu=1e-6)
+    assert_true(numpy.all(numpy.isfinite(log_values)))
+    assert_true(numpy.all(log_values < 0))
+
+
+def test_log_sparse_engine(lim=1e-14):
+    """
+    Compare the log-domain sparse iteration to the linear one and to the
+    pure python logspace iteration.
+    """
+
+    N = 20
+    fitness_landscape = linear_fitness_landscape([[1, 2], [2, 1]])
+    incentive = replicator(fitness_landscape)
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=2, mu=1. / N)
+    s_1 = approx_stationary(edges, lim=lim)
+    s_2 = approx_stationary(edges, logspace=True, lim=lim)
+    s_3 = approx_stationary(edges, logspace=True, lim=lim, sparse=False)
+    for key in s_1.keys():
+        assert_almost_equal(s_1[key], s_2[key])
+        assert_almost_equal(s_1[key], s_3[key])
+
+    # Directly from the log-space transition arrays
+    m = [[0, -1, 1], [1, 0, -1], [-1, 1, 0]]
+    log_incentive = log_fermi(linear_fitness_landscape(m), beta=2.)
+    rows, cols, log_values = \
+        incentive_process.log_multivariate_transitions_arrays(
+            N, log_incentive, num_types=3, mu=0.1)
+    log_ranks = log_approx_stationary(rows, cols, log_values, lim=lim)
+    edges = incentive_process.multivariate_transitions(
+        N, fermi(linear_fitness_landscape(m), beta=2.), num_types=3, mu=0.1)
+    s = stationary_distribution(edges, method="solve")
+    for state, v in s.items():
+        assert_almost_equal(numpy.exp(log_ranks[simplex_rank(state)]), v,
+                            places=6)
+
+
+def test_birth_death(N=40):
+    """
+    Compare the birth-death formula with the linear solver and the path
+    products of the exact computation.
+    """
+
+    for m in [[[1, 1], [1, 1]], [[1, 2], [2, 1]], [[2, 1], [1, 2]]]:
+        for mu in [0.1, 1. / N]:
+            incentive = replicator(linear_fitness_landscape(m))
+            edges = incentive_process.multivariate_transitions(
+                N, incentive, num_types=2, mu=mu)
+            s = birth_death_stationary(edges)
+            s_1 = stationary_distribution(edges, method="solve")
+            s_2 = exact_stationary(edges)
+            assert_equal(set(s.keys()), set(s_1.keys()))
+            for state, v in s_1.items():
+                assert_almost_equal(s[state], v)
+                assert_almost_equal(s_2[state], v)
+
+            rows, cols, values = \
+                incentive_process.multivariate_transitions_arrays(
+                    N, incentive, num_types=2, mu=mu)
+            matrix = csr_matrix((values, (rows, cols)), shape=(N + 1, N + 1))
+            s_3 = stationary_distribution(matrix, method="birth_death")
+            states = simplex_states(N, 1)
+            for state, v in zip(states.tolist(), s_3):
+                assert_almost_equal(s[tuple(state)], v)
+
+    # Tiny mutation rates
+    incentive = replicator(linear_fitness_landscape([[1, 1], [1.2, 1.2]]))
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=2, mu=1e-24)
+    s = birth_death_stationary(edges)
+    assert_almost_equal(sum(s.values()), 1.)
+    assert_true(s[(0, N)] > 0.99)
+
+    # Not birth-death chains
+    incentive = replicator(linear_fitness_landscape(
+        [[1, 2, 3], [2, 1, 2], [3, 2, 1]]))
+    edges = incentive_process.multivariate_transitions(N, incentive, mu=0.1)
+    assert_raises(ValueError, birth_death_stationary, edges)
+    incentive = replicator(linear_fitness_landscape([[1, 2], [2, 1]]))
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=2, mu=0.)
+    assert_raises(ValueError, birth_death_stationary, edges)
+    h = wright_fisher.multivariate_transitions(10, incentive, num_types=2,
+                                               mu=0.1)
+    assert_raises(ValueError, birth_death_stationary, csr_matrix(h.matrix))
+
+
+def test_tree_stationary():
+    """
+    Compare the spanning tree computation for reversible processes with the
+    explicit neutral landscape distribution and the linear solver.
+    """
+
+    N = 10
+    for n in [2, 3, 4]:
+        mu = (n - 1.) / n * 1. / (N + 1)
+        alpha = N * mu / (n - 1. - n * mu)
+        edges = incentive_process.compute_edges(
+            N=N, num_types=n, incentive_func=replicator, mu=mu)
+        s = incentive_process.neutral_stationary(N, alpha, n)
+        for s_1 in [tree_stationary(edges), exact_stationary(edges)]:
+            assert_equal(set(s_1.keys()), set(s.keys()))
+            for state, v in s.items():
+                assert_almost_equal(s_1[state], v)
+
+        # Sparse matrices with rows in any order, and edge functions
+        states = list(s.keys())
+        enum = dict((state, i) for i, state in enumerate(states))
+        rows = [enum[a] for a, _, _ in edges]
+        cols = [enum[b] for _, b, _ in edges]
+        values = [v for _, _, v in edges]
+        matrix = csr_matrix((values, (rows, cols)), shape=(len(states),) * 2)
+        s_2 = tree_stationary(matrix, states=states)
+        s_3 = stationary_distribution(matrix, states=states, method="exact")
+        edge_dict = dict(((a, b), v) for a, b, v in edges)
+        s_4 = tree_stationary(lambda a, b: edge_dict.get((a, b), 0.),
+                              states=states)
+        for i, state in enumerate(states):
+            assert_almost_equal(s_2[i], s[state])
+            assert_almost_equal(s_3[state], s[state])
+            assert_almost_equal(s_4[state], s[state])
+
+    # Two-type processes are always reversible
+    incentive = fermi(linear_fitness_landscape([[1, 2], [2, 1]]), beta=1.)
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=2, mu=0.05)
+    s = stationary_distribution(edges, method="solve")
+    s_1 = tree_stationary(edges)
+    for state, v in s.items():
+        assert_almost_equal(s_1[state], v)
+
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=2, mu=0.)
+    assert_raises(ValueError, tree_stationary, edges)
+    assert_raises(ValueError, tree_stationary, matrix)
+
+    # The initial state and logspace no longer apply
+    edges = incentive_process.multivariate_transitions(
+        N, incentive, num_types=2, mu=0.05)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        s_2 = exact_stationary(edges, initial_state=(N // 2, N - N // 2),
+                               logspace=True)
+    assert_equal(len(caught), 2)
+    assert_true(all(issubclass(w.category, DeprecationWarning)
+                    for w in caught))
+    for state, v in s.items():
+        assert_almost_equal(s_2[state], v)
+
+
+def test_reversibility(N=10):
+    """
+    Test the detailed balance check and the automatic choice of the exact
+    computation for reversible processes.
+    """
+
+    # Neutral and two-type processes are reversible
+    for m in [numpy.ones((3, 3)), [[1, 2], [3, 1]]]:
+        incentive = replicator(linear_fitness_landscape(m))
+        edges = incentive_process.multivariate_transitions(
+            N, incentive, num_types=len(m), mu=0.1)
+        assert_true(is_reversible(edges))
+        s, report = stationary_distribution(edges, report=True)
+        assert_equal(report["method"], "exact")
+        assert_true(report["reversible"])
+        s_1 = stationary_distribution(edges, method="solve")
+        for state, v in s_1.items():
+            assert_almost_equal(s[state], v)
+        # A warm start is not passed on to the exact computation
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            stationary_distribution(edges, initial_state=s_1)
+        assert_equal(len(w), 0)
+
+        rows, cols, values = \
+            incentive_process.multivariate_transitions_arrays(
+                N, incentive, num_types=len(m), mu=0.1)
+        S = len(s)
+        matrix = csr_matrix((values, (rows, cols)), shape=(S, S))
+        states = simplex_states(N, len(m) - 1)
+        assert_true(is_reversible(matrix, states=states))
+        s_2, report = stationary_distribution(matrix, states=states,
+                                              report=True)
+        assert_equal(report["method"], "exact")
+        for state, v in s_1.items():
+            assert_almost_equal(s_2[state], v)
+
+    # Birth-death matrices without states
+    s_3, report = stationary_distribution(matrix, report=True)
+    assert_equal(report["method"], "birth_death")
+    for state, v in zip(states.tolist(), s_3):
+        assert_almost_equal(s_1[tuple(state)], v)
+
+    # A non-reversible process falls back to the approximate computation
+    incentive = replicator(linear_fitness_landscape(
+        [[1, 2, 3], [2, 1, 2], [3, 2, 1]]))
+    edges = incentive_process.multivariate_transitions(N, incentive, mu=0.1)
+    assert_greater(detailed_balance_error(edges), 0.01)
+    assert_true(not is_reversible(edges))
+    s, report = stationary_distribution(edges, lim=1e-14, report=True)
+    assert_equal(report["method"], "approx")
+    assert_true(not report["reversible"])
+    s_1 = stationary_distribution(edges, method="solve")
+    for state, v in s_1.items():
+        assert_almost_equal(s[state], v, places=6)
+
+    # Processes off the simplex are not tested
+    edges = [(0, 1, 0.5), (0, 0, 0.5), (1, 0, 0.5), (1, 1, 0.5)]
+    s, report = stationary_distribution(edges, report=True)
+    assert_equal(report["method"], "approx")
+    assert_equal(report["reversible"], None)
+    assert_equal(report["detailed_balance_error"], None)
+
+
+def test_reversibility_labels():
+    """
+    The automatic method falls back to the approximate computation for
+    states that are not integer points of a simplex.
+    """
+
+    # Two-state chains labelled by strings, ragged tuples and floats
+    for a, b in [("a", "b"), (("a", "b"), ("b", "a")), ((0,), (0, 1)),
+                 ((0.5, 0.5), (1., 0.))]:
+        edges = [(a, b, 0.25), (a, a, 0.75), (b, a, 0.5), (b, b, 0.5)]
+        s, report = stationary_distribution(edges, report=True)
+        assert_equal(report["method"], "approx")
+        assert_equal(report["reversible"], None)
+        assert_almost_equal(s[a], 2. / 3)
+        assert_almost_equal(s[b], 1. / 3)
+        assert_true(not is_reversible(edges))
+
+
+def test_reversibility_edge_func(N=6):
+    """
+    Edge functions are tested for reversibility unless they cache blocks or
+    are built with low_memory, and `exact` does not apply to them.
+    """
+
+    incentive = fermi(linear_fitness_landscape(
+        [[1, 2, 3], [2, 1, 2], [3, 2, 1]]), beta=1.)
+    g = wright_fisher.multivariate_transitions(N, incentive, mu=0.1,
+                                               low_memory=True)
+    states = [tuple(state) for state in simplex_states(N).tolist()]
+    s_1 = stationary_distribution(g, states=states, method="approx")
+    s_2 = stationary_distribution(g, states=states, exact=True)
+    s_3, report = stationary_distribution(g, states=states, report=True)
+    assert_equal(report["method"], "approx")
+    assert_equal(report["reversible"], None)
+    s_4, report = stationary_distribution(
+        lambda a, b: g(a, b), states=states, report=True)
+    assert_equal(report["method"], "approx")
+    assert_true(not report["reversible"])
+    for state in states:
+        assert_almost_equal(s_1[state], s_2[state])
+        assert_almost_equal(s_1[state], s_3[state])
+        assert_almost_equal(s_1[state], s_4[state])
+
+    # A reversible edge function
+    incentive = replicator(linear_fitness_landscape(numpy.ones((3, 3))))
+    edges = incentive_process.multivariate_transitions(N, incentive, mu=0.1)
+    edge_dict = dict(((a, b), v) for a, b, v in edges)
+    s, report = stationary_distribution(
+        lambda a, b: edge_dict.get((a, b), 0.), states=states, report=True)
+    assert_equal(report["method"], "exact")
+    s_1 = stationary_distribution(edges, method="solve")
+    for state in states:
+        assert_almost_equal(s[state], s_1[state])
+
+
 def test_incentive_process_k(lim=1e-14):
     """
     Compare stationary distribution computations to known analytic form for
@@ -181,6 +820,33 @@ def test_incentive_process_k(lim=1e-14):
                     stationary_1[key], stationary_2[key], places=5)
 
 
+def test_local_extrema_array():
+    """
+    Compare the vectorized extrema with comparisons of each state against its
+    neighbors.
+    """
+
+    random_state = numpy.random.RandomState(0)
+    for N, d in [(30, 1), (20, 2), (8, 3)]:
+        states = list(simplex_generator(N, d))
+        # Ties and missing values
+        values = random_state.randint(0, 20, size=len(states)).astype(float)
+        values[::7] = numpy.nan
+        dist = dict((state, v) for state, v in zip(states, values)
+                    if state[0] != 1)
+        minima = find_local_minima(dist, comp_func=lambda x, y: x - y >= 0)
+        maxima = find_local_minima(dist, comp_func=lambda x, y: y - x >= 0)
+        assert_equal(find_local_minima(dist), minima)
+        assert_equal(find_local_maxima(dist), maxima)
+
+        values[[i for i, state in enumerate(states) if state[0] == 1]] = \
+            numpy.nan
+        mask = local_extrema_array(values, N, d)
+        assert_equal(set(states[i] for i in numpy.flatnonzero(mask)), minima)
+        mask = local_extrema_array(values, N, d, maxima=True)
+        assert_equal(set(states[i] for i in numpy.flatnonzero(mask)), maxima)
+
+
 def test_extrema_moran(lim=1e-16):
     """
     Test for extrema of the stationary distribution.
@@ -324,6 +990,169 @@ def test_wright_fisher(N=20, lim=1e-10, n=2):
                 check_eigenvalue(wf_edges, s, places=2)
 
 
+def test_wright_fisher_cache(N=12):
+    """
+    Compare the rank-indexed cached Wright-Fisher transitions to the uncached
+    ones, with chunked and single precision storage.
+    """
+
+    for n in [2, 3]:
+        m = numpy.arange(n * n).reshape(n, n) % 3 + 1.
+        incentive = fermi(linear_fitness_landscape(m), beta=1.)
+        g = wright_fisher.multivariate_transitions(
+            N, incentive, mu=0.01, num_types=n, low_memory=True)
+        states = list(simplex_generator(N, d=n-1))
+        S = len(states)
+        for dtype, chunk_size, places in [(float, None, 12),
+                                          (float, 5, 12),
+                                          (numpy.float32, None, 6)]:
+            h = wright_fisher.multivariate_transitions(
+                N, incentive, mu=0.01, num_types=n, dtype=dtype,
+                chunk_size=chunk_size)
+            assert_equal(sum(len(block) for block in h.blocks), S)
+            for block in h.blocks:
+                assert_equal(block.shape[1], S)
+                assert_equal(block.dtype, numpy.dtype(dtype))
+            assert_equal(h.matrix is None, chunk_size is not None)
+            for x in states:
+                for y in states:
+                    assert_almost_equal(h(x, y), g(x, y), places=places)
+
+        # Iterate the single precision blocks directly
+        s_1 = stationary_distribution(h, states=states, iterations=1000)
+        s_2 = stationary_distribution(
+            edge_func_to_edges(g, states), method="solve")
+        for state in states:
+            assert_almost_equal(s_1[state], s_2[state], places=5)
+
+
+def test_wright_fisher_rows(N=10):
+    """
+    Compare the vectorized Wright-Fisher rows to the multinomial
+    distribution, including vanishing offspring probabilities on the boundary
+    when mu = 0.
+    """
+
+    m = [[1, 2, 3], [2, 1, 2], [3, 2, 1]]
+    incentive = replicator(linear_fitness_landscape(m))
+    states = list(simplex_generator(N, d=2))
+    for mu in [0., 0.01]:
+        rows = wright_fisher.transition_rows(N, incentive, states, mu=mu)
+        Q = numpy.full((3, 3), mu / 2.)
+        numpy.fill_diagonal(Q, 1. - mu)
+        for i, x in enumerate(states):
+            inc = numpy.array(incentive(x))
+            ps = inc.dot(Q) / inc.sum()
+            assert_almost_equal(rows[i].sum(), 1.)
+            for j, y in enumerate(states):
+                assert_almost_equal(rows[i, j], multinomial.pmf(y, N, ps))
+
+
+def test_wright_fisher_matrix_free(N=15):
+    """
+    Compare the matrix-free Wright-Fisher iteration, threaded or not, to the
+    cached transition matrix.
+    """
+
+    for n in [2, 3]:
+        m = numpy.arange(n * n).reshape(n, n) % 3 + 1.
+        incentive = fermi(linear_fitness_landscape(m), beta=1.)
+        edge_func = wright_fisher.multivariate_transitions(
+            N, incentive, mu=0.01, num_types=n)
+        states = list(simplex_generator(N, d=n-1))
+        s_1 = stationary_distribution(edge_func, states=states,
+                                      iterations=4 * N)
+        for threads in [1, 2]:
+            s_2 = wright_fisher.matrix_free_stationary(
+                N, incentive, mu=0.01, num_types=n, block_size=7,
+                threads=threads, iterations=4 * N)
+            for state in states:
+                assert_almost_equal(s_1[state], s_2[state], places=12)
+
+
+def test_wright_fisher_general(N=6):
+    """
+    Test the Wright-Fisher process with four and five types against the
+    multinomial distribution and the matrix-free iteration.
+    """
+
+    for n in [4, 5]:
+        m = numpy.arange(n * n).reshape(n, n) % 3 + 1.
+        incentive = replicator(linear_fitness_landscape(m))
+        mu = 0.01
+        Q = numpy.full((n, n), mu / (n - 1.))
+        numpy.fill_diagonal(Q, 1. - mu)
+        states = list(simplex_generator(N, d=n-1))
+        g = wright_fisher.multivariate_transitions(
+            N, incentive, mu=mu, num_types=n, low_memory=True)
+        h = wright_fisher.multivariate_transitions(
+            N, incentive, mu=mu, num_types=n, chunk_size=50)
+        for x in states[::7]:
+            inc = numpy.array(incentive(x))
+            ps = inc.dot(Q) / inc.sum()
+            for y in states:
+                v = multinomial.pmf(y, N, ps)
+                assert_almost_equal(g(x, y), v)
+                assert_almost_equal(h(x, y), v)
+
+        s_1 = stationary_distribution(h, states=states, iterations=200)
+        s_2 = wright_fisher.matrix_free_stationary(
+            N, incentive, mu=mu, num_types=n, iterations=200)
+        for state in states:
+            assert_almost_equal(s_1[state], s_2[state], places=12)
+        edges = edge_func_to_edges(h, states)
+        check_global_balance(
+            edges, stationary_distribution(edges, method="solve"))
+
+
+def test_wright_fisher_mutation_matrix(N=8):
+    """
+    Test the Wright-Fisher process with a non-uniform mutation matrix against
+    the multinomial distribution and the matrix-free iteration, and that the
+    uniform matrix agrees with the mutation rate.
+    """
+
+    for n in [2, 3, 4]:
+        m = numpy.arange(n * n).reshape(n, n) % 3 + 1.
+        incentive = replicator(linear_fitness_landscape(m))
+        # Mutation only to the next type
+        Q = numpy.eye(n) * 0.98 + numpy.roll(numpy.eye(n), 1, axis=1) * 0.02
+        states = list(simplex_generator(N, d=n-1))
+        g = wright_fisher.multivariate_transitions(
+            N, incentive, mu=Q, num_types=n, low_memory=True)
+        h = wright_fisher.multivariate_transitions(
+            N, incentive, mu=Q, num_types=n)
+        for x in states[::3]:
+            inc = numpy.array(incentive(x))
+            ps = inc.dot(Q) / inc.sum()
+            for y in states:
+                v = multinomial.pmf(y, N, ps)
+                assert_almost_equal(g(x, y), v)
+                assert_almost_equal(h(x, y), v)
+
+        s_1 = stationary_distribution(h, states=states, iterations=200)
+        s_2 = wright_fisher.matrix_free_stationary(
+            N, incentive, mu=Q, num_types=n, iterations=200)
+        for state in states:
+            assert_almost_equal(s_1[state], s_2[state], places=12)
+
+        mu = 0.01
+        uniform = numpy.full((n, n), mu / (n - 1.))
+        numpy.fill_diagonal(uniform, 1. - mu)
+        h_1 = wright_fisher.multivariate_transitions(
+            N, incentive, mu=mu, num_types=n)
+        h_2 = wright_fisher.multivariate_transitions(
+            N, incentive, mu=uniform, num_types=n)
+        for x in states[::3]:
+            for y in states:
+                assert_almost_equal(h_1(x, y), h_2(x, y))
+
+    assert_raises(ValueError, wright_fisher.multivariate_transitions,
+                  N, incentive, mu=numpy.eye(3), num_types=4)
+    assert_raises(ValueError, wright_fisher.multivariate_transitions,
+                  N, incentive, mu=numpy.full((4, 4), 0.5), num_types=4)
+
+
 def test_extrema_wf(lim=1e-10):
     """
     For small mu, the Wright-Fisher process is minimal in the center.